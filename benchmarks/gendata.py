@@ -0,0 +1,216 @@
+"""
+  Generates web test results to benchmark the loads with.
+
+  The rows have the source fields the configs in conf/ read, i.e., url,
+  serverversion, size, lastmoddate, downloaddate, test and errors, and are
+  written as tab-separated files with a header like the files read by
+  mapreader.map_csv_reader. Each page (url) keeps its size, server version
+  and modification date until it changes, which happens for a given share
+  of the rows and gives pagedim a new version. The pages can be picked with
+  a Zipf-like skew such that a few pages have most of the test results.
+
+  Usage: python benchmarks/gendata.py [options] output_dir
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import random
+from bisect import bisect_left
+from datetime import date, timedelta
+from optparse import OptionParser
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['FIELDS', 'TestResultGenerator', 'writefiles']
+
+
+# The source fields in the order they are written
+FIELDS = ('url', 'serverversion', 'size', 'lastmoddate', 'downloaddate',
+          'test', 'errors')
+
+TOPLEVELDOMAINS = ('com', 'org', 'net', 'dk', 'de', 'uk', 'fr', 'se', 'nl',
+                   'edu')
+SERVERS = ('Apache', 'nginx', 'IIS', 'lighttpd', 'Zeus')
+TESTS = ['Test%d' % (i,) for i in range(10)]
+
+
+class TestResultGenerator(object):
+    """Makes rows of test results for a fixed set of pages."""
+
+    def __init__(self, nurls=10000, ndomains=None, changerate=0.01, skew=0.0,
+                 fromdate='2009-01-01', ndays=365, seed=None):
+        """Arguments:
+           - nurls: the number of distinct pages. Default: 10000
+           - ndomains: the number of distinct domains. Default: nurls / 10
+           - changerate: the probability that the page of a row has changed
+             since it was last tested (0 <= changerate <= 1). Default: 0.01
+           - skew: the exponent of the Zipf-like distribution the pages are
+             picked from. 0 picks them uniformly. Default: 0.0
+           - fromdate: the first download date as a string of the form
+             'yyyy-MM-dd'. Default: '2009-01-01'
+           - ndays: the number of days the download dates are spread over.
+             Default: 365
+           - seed: the seed of the random numbers such that the same rows
+             can be made again. Default: None
+        """
+        if nurls < 1:
+            raise ValueError, "nurls must be positive"
+        if not 0 <= changerate <= 1:
+            raise ValueError, "changerate must be between 0 and 1"
+        self.random = random.Random(seed)
+        self.nurls = nurls
+        self.ndomains = max(ndomains or nurls // 10, 1)
+        self.changerate = changerate
+        self.fromdate = date(*[int(p) for p in fromdate.split('-')])
+        self.ndays = max(ndays, 1)
+        self.cumweights = None
+        if skew > 0:
+            total = 0.0
+            self.cumweights = []
+            for rank in xrange(1, nurls + 1):
+                total += 1.0 / rank ** skew
+                self.cumweights.append(total)
+        self.pages = [None] * nurls # Made when first picked
+        self.changes = 0
+
+    def __newversion(self, page, downloaddate, maxage=30):
+        rnd = self.random
+        page['size'] = rnd.randint(100, 500000)
+        page['serverversion'] = '%s/%d.%d' % (rnd.choice(SERVERS),
+                                              rnd.randint(1, 3),
+                                              rnd.randint(0, 9))
+        page['lastmoddate'] = downloaddate - timedelta(rnd.randint(0, maxage))
+
+    def __page(self, n, downloaddate):
+        page = self.pages[n]
+        if page is None:
+            domain = n % self.ndomains
+            url = 'http://www.domain%d.%s/page%d.html' % \
+                (domain, TOPLEVELDOMAINS[domain % len(TOPLEVELDOMAINS)], n)
+            page = self.pages[n] = {'url' : url}
+            self.__newversion(page, downloaddate)
+        elif self.random.random() < self.changerate and \
+                page['lastmoddate'] < downloaddate:
+            # A new version must be newer than the one it replaces
+            maxage = (downloaddate - page['lastmoddate']).days - 1
+            self.__newversion(page, downloaddate, min(maxage, 30))
+            self.changes += 1
+        return page
+
+    def pick(self):
+        """Return the number of a page."""
+        if self.cumweights is None:
+            return self.random.randrange(self.nurls)
+        value = self.random.random() * self.cumweights[-1]
+        return min(bisect_left(self.cumweights, value), self.nurls - 1)
+
+    def __picknew(self, untested):
+        # Pick a page that has not had all the tests on the day
+        n = self.pick()
+        tries = 0
+        while untested.get(n) == []:
+            tries += 1
+            if tries < 10:
+                n = self.pick()
+            else:
+                n = (n + 1) % self.nurls
+        return n
+
+    def rows(self, nrows):
+        """Return a generator of nrows rows whose download dates grow from
+           fromdate over ndays days. A page gets each test at most once a
+           day such that the facts have distinct (page, test, date) keys."""
+        if -(-nrows // self.ndays) > self.nurls * len(TESTS):
+            raise ValueError, "Too few urls for %d rows a day" % \
+                (-(-nrows // self.ndays),)
+        rnd = self.random
+        lastdate = None
+        for i in xrange(nrows):
+            downloaddate = self.fromdate + \
+                timedelta(i * self.ndays // max(nrows, 1))
+            if downloaddate != lastdate:
+                untested = {} # page number -> the tests it has not had
+                lastdate = downloaddate
+            n = self.__picknew(untested)
+            tests = untested.get(n)
+            if tests is None:
+                tests = untested[n] = list(TESTS)
+            test = tests.pop(rnd.randrange(len(tests)))
+            page = self.__page(n, downloaddate)
+            yield {'url' : page['url'],
+                   'serverversion' : page['serverversion'],
+                   'size' : page['size'],
+                   'lastmoddate' : page['lastmoddate'].isoformat(),
+                   'downloaddate' : downloaddate.isoformat(),
+                   'test' : test,
+                   'errors' : rnd.random() < 0.8 and '0' or \
+                       str(rnd.randint(1, 20))}
+
+
+def writefiles(generator, nrows, outputdir, nfiles=1, prefix='testresults'):
+    """Write nrows rows from the generator to nfiles tab-separated files in
+       outputdir and return their paths. The rows are dealt out round-robin
+       such that the files hold about the same number of rows."""
+    if not os.path.isdir(outputdir):
+        os.makedirs(outputdir)
+    paths = [os.path.join(outputdir, '%s_%03d.csv' % (prefix, i))
+             for i in range(nfiles)]
+    files = [open(path, 'w') for path in paths]
+    try:
+        for f in files:
+            f.write('\t'.join(FIELDS) + '\n')
+        for (i, row) in enumerate(generator.rows(nrows)):
+            files[i % nfiles].write(
+                '\t'.join([str(row[field]) for field in FIELDS]) + '\n')
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage='%prog [options] output_dir')
+    parser.add_option('--rows', type='int', default=100000,
+                      help='Number of rows (default=100000)')
+    parser.add_option('--urls', type='int', default=10000,
+                      help='Number of distinct urls (default=10000)')
+    parser.add_option('--domains', type='int', default=None,
+                      help='Number of distinct domains (default=urls/10)')
+    parser.add_option('--change-rate', type='float', default=0.01,
+                      help='Probability that a page has a new version '
+                      '(default=0.01)')
+    parser.add_option('--skew', type='float', default=0.0,
+                      help='Zipf exponent of the url popularity, 0 is '
+                      'uniform (default=0.0)')
+    parser.add_option('--days', type='int', default=365,
+                      help='Number of download days (default=365)')
+    parser.add_option('--files', type='int', default=1,
+                      help='Number of files to split the rows into (default=1)')
+    parser.add_option('--seed', type='int', default=0,
+                      help='Random seed (default=0)')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error('An output directory must be given')
+    generator = TestResultGenerator(nurls=options.urls,
+                                    ndomains=options.domains,
+                                    changerate=options.change_rate,
+                                    skew=options.skew, ndays=options.days,
+                                    seed=options.seed)
+    paths = writefiles(generator, options.rows, args[0], options.files)
+    print "Wrote %d rows with %d page changes to %s" % \
+        (options.rows, generator.changes, ', '.join(paths))
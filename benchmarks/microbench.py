@@ -0,0 +1,316 @@
+"""
+  Microbenchmarks of the caches and stores the dimensions are built on.
+
+  Each structure (lrustore.lrucache, LRUWrap, LRUShelve, FIFODict,
+  filedict.FileDict and the caches in caches.POLICIES) is run with the
+  workloads
+   - set: put keys that fit in the structure
+   - get: look up keys that are in the structure
+   - miss: look up keys that are not in the structure
+   - evict: put keys from a key space four times the size of the structure
+     such that most puts evict a key
+   - iter: iterate over the keys of a full structure (ops are keys visited)
+  with keys drawn uniformly or from a Zipf-like distribution, for each of
+  the given sizes. Each structure and size is run in a child process such
+  that its peak RSS can be measured. The ops per second, the change of the
+  RSS caused by each workload and the peak RSS of the structure and size
+  are printed and can be saved as JSON and compared with a saved baseline.
+
+  Usage: python benchmarks/microbench.py [options]
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from bisect import bisect_left
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The modules of pyetlmr import each other as top-level modules
+sys.path.insert(0, os.path.join(ROOT, 'pyetlmr'))
+
+import caches
+import lrustore
+from FIFODict import FIFODict
+from filedict import FileDict
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['STRUCTURES', 'WORKLOADS', 'keys', 'runcase', 'compare']
+
+
+WORKLOADS = ('set', 'get', 'miss', 'evict', 'iter')
+
+# The structures that write to disk and are run with fewer ops
+SLOW = ('LRUShelve', 'FileDict')
+
+
+def _iterkeys(store):
+    if isinstance(store, lrustore.LRUShelve):
+        return store.iterkeys()
+    if isinstance(store, lrustore.LRUWrap):
+        return iter(store.cache)
+    return iter(store)
+
+# name -> function(size, tmpdir) making an empty structure of the size
+STRUCTURES = {
+    'lrucache' : lambda size, tmpdir: lrustore.lrucache(size),
+    'LRUWrap' : lambda size, tmpdir: lrustore.LRUWrap({}, size),
+    'LRUShelve' : lambda size, tmpdir: lrustore.LRUShelve(
+        os.path.join(tmpdir, 'shelve'), size),
+    'FIFODict' : lambda size, tmpdir: FIFODict(size),
+    'FileDict' : lambda size, tmpdir: FileDict(
+        filename=os.path.join(tmpdir, 'filedict.db')),
+}
+for (_policy, _cls) in caches.POLICIES.items():
+    STRUCTURES['caches.%s' % (_policy,)] = \
+        lambda size, tmpdir, cls=_cls: cls(size)
+
+
+def keys(n, keyspace, skew, rnd):
+    """Return a list of n keys in range(keyspace) drawn uniformly if skew is
+       0 and otherwise from a Zipf-like distribution with the exponent
+       skew."""
+    if not skew:
+        return [rnd.randrange(keyspace) for i in xrange(n)]
+    cumweights = []
+    total = 0.0
+    for rank in xrange(1, keyspace + 1):
+        total += 1.0 / rank ** skew
+        cumweights.append(total)
+    return [min(bisect_left(cumweights, rnd.random() * total), keyspace - 1)
+            for i in xrange(n)]
+
+
+def _rssmb():
+    """Return the current RSS of this process in megabytes. Where /proc is
+       missing, the peak RSS is returned instead."""
+    try:
+        statm = open('/proc/self/statm')
+        try:
+            pages = int(statm.read().split()[1])
+        finally:
+            statm.close()
+        return pages * resource.getpagesize() / (1024.0 * 1024.0)
+    except (IOError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _timed(func, ops):
+    rss = _rssmb()
+    start = time.time()
+    func()
+    seconds = time.time() - start
+    return {'ops' : ops, 'seconds' : seconds,
+            'opspersecond' : ops / max(seconds, 1e-9),
+            'rssdeltamb' : _rssmb() - rss}
+
+
+def _fill(store, size):
+    for key in xrange(size):
+        store[key] = key
+
+
+def _workloads(factory, size, ops, skew, seed, tmpdir):
+    rnd = random.Random(seed)
+    res = {}
+    inside = keys(ops, size, skew, rnd)
+    wide = keys(ops, 4 * size, skew, rnd)
+
+    rss = _rssmb()
+    store = factory(size, tmpdir)
+    made = _rssmb() - rss
+    def setkeys():
+        for key in inside:
+            store[key] = key
+    res['set'] = _timed(setkeys, ops)
+
+    # The RSS used to make and fill the structure is counted for set
+    rss = _rssmb()
+    _fill(store, size)
+    res['set']['rssdeltamb'] += made + _rssmb() - rss
+    def getkeys():
+        for key in inside:
+            try:
+                store[key]
+            except KeyError:
+                pass
+    res['get'] = _timed(getkeys, ops)
+
+    def misskeys():
+        for key in inside:
+            try:
+                store[key + size]
+            except KeyError:
+                pass
+    res['miss'] = _timed(misskeys, ops)
+
+    def iterkeys():
+        for i in xrange(max(ops // size, 1)):
+            for key in _iterkeys(store):
+                pass
+    res['iter'] = _timed(iterkeys, max(ops // size, 1) * size)
+
+    def evictkeys():
+        for key in wide:
+            store[key] = key
+    res['evict'] = _timed(evictkeys, ops)
+    return res
+
+
+def runcase(name, size, ops, skews, seed=0):
+    """Run all workloads for one structure and size in a child process.
+       Return a list of result dicts and the peak RSS of the child in
+       megabytes."""
+    (readfd, writefd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(readfd)
+        tmpdir = tempfile.mkdtemp(prefix='etlmr-microbench-')
+        status = 0
+        try:
+            try:
+                res = {}
+                for skew in skews:
+                    res[str(skew)] = _workloads(STRUCTURES[name], size, ops,
+                                                skew, seed, tmpdir)
+                os.write(writefd, json.dumps(res))
+            except Exception, ex:
+                sys.stderr.write("%s %d failed: %s\n" % (name, size, ex))
+                status = 1
+        finally:
+            os.close(writefd)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            os._exit(status)
+    os.close(writefd)
+    chunks = []
+    while True:
+        chunk = os.read(readfd, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(readfd)
+    (pid, status, rusage) = os.wait4(pid, 0)
+    maxrssmb = rusage.ru_maxrss / 1024.0
+    if status or not chunks:
+        return ([], maxrssmb)
+    results = []
+    for (skew, workloads) in json.loads(''.join(chunks)).iteritems():
+        for (workload, res) in workloads.iteritems():
+            res.update({'structure' : name, 'size' : size,
+                        'skew' : float(skew), 'workload' : workload,
+                        'maxrssmb' : maxrssmb})
+            results.append(res)
+    return (results, maxrssmb)
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Return a list of lines describing the results whose ops per second
+       are below (1 - tolerance) times those of the same case in the
+       baseline results."""
+    case = lambda r: (r['structure'], r['size'], r['skew'], r['workload'])
+    before = dict([(case(r), r['opspersecond']) for r in baseline])
+    regressions = []
+    for res in results:
+        old = before.get(case(res))
+        if old and res['opspersecond'] < old * (1 - tolerance):
+            regressions.append("%s size=%d skew=%s %s: %.0f ops/s, was %.0f" % \
+                (case(res) + (res['opspersecond'], old)))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--structures', default=','.join(sorted(STRUCTURES)),
+                      help='Comma-separated structures to run (default=all)')
+    parser.add_option('--sizes', default='1000,10000,100000',
+                      help='Comma-separated sizes (default=1000,10000,100000)')
+    parser.add_option('--ops', type='int', default=200000,
+                      help='Operations per workload (default=200000)')
+    parser.add_option('--slow-ops', type='int', default=5000,
+                      help='Operations per workload of %s (default=5000)' % \
+                      (' and '.join(SLOW),))
+    parser.add_option('--skews', default='0,1.0',
+                      help='Comma-separated Zipf exponents, 0 is uniform '
+                      '(default=0,1.0)')
+    parser.add_option('--seed', type='int', default=0,
+                      help='Random seed (default=0)')
+    parser.add_option('--output', default=None,
+                      help='Write the results as JSON to this path '
+                      '(default=None)')
+    parser.add_option('--baseline', default=None,
+                      help='Compare with the results saved by --output of an '
+                      'earlier run and exit with 1 on regressions')
+    parser.add_option('--tolerance', type='float', default=0.1,
+                      help='Allowed drop in ops/s compared with the baseline '
+                      '(default=0.1)')
+    (options, args) = parser.parse_args()
+    names = options.structures.split(',')
+    for name in names:
+        if name not in STRUCTURES:
+            parser.error('Unknown structure %s' % (name,))
+    sizes = [int(s) for s in options.sizes.split(',')]
+    skews = [float(s) for s in options.skews.split(',')]
+
+    results = []
+    # dRSS is the RSS growth caused by the workload (for set, including the
+    # making and filling of the structure) and peak the peak RSS of the child
+    # process running all the workloads of the structure and size
+    print "%-16s %8s %5s %6s %10s %14s %10s %10s" % \
+        ('structure', 'size', 'skew', 'work', 'ops', 'ops/s', 'dRSS MB',
+         'peak MB')
+    for name in names:
+        for size in sizes:
+            ops = name in SLOW and options.slow_ops or options.ops
+            (caseresults, maxrssmb) = runcase(name, size, ops, skews,
+                                              options.seed)
+            caseresults.sort(key=lambda r: (r['skew'],
+                                            WORKLOADS.index(r['workload'])))
+            for res in caseresults:
+                print "%-16s %8d %5.2f %6s %10d %14.0f %10.1f %10.1f" % \
+                    (name, size, res['skew'], res['workload'], res['ops'],
+                     res['opspersecond'], res['rssdeltamb'], maxrssmb)
+            sys.stdout.flush()
+            results.extend(caseresults)
+    if options.output:
+        outputfile = open(options.output, 'w')
+        try:
+            json.dump({'time' : time.time(), 'python' : sys.version,
+                       'results' : results}, outputfile, indent=2,
+                      sort_keys=True)
+        finally:
+            outputfile.close()
+        print "Wrote the results to %s" % (options.output,)
+    if options.baseline:
+        baselinefile = open(options.baseline)
+        try:
+            regressions = compare(results,
+                                  json.load(baselinefile)['results'],
+                                  options.tolerance)
+        finally:
+            baselinefile.close()
+        for line in regressions:
+            print "Regression: %s" % (line,)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,261 @@
+"""
+  Runs the dimension and fact loads of each load method on the same input
+  and records how long they take.
+
+  For each load method (1. ODOT, 2. ODAT, 3. offline dim) the DW is reset by
+  the given reset command (e.g., psql running examples/dbschema/snowflake.sql)
+  and pyetlmr/paralleletl.py is run with --load-step 1 and then with
+  --load-step 2 (or once with --load-step 3 if --combined is given, which
+  reads the input once for both). The harness records the wall time, the
+  rows per second and the peak memory of the driver of each step, the phase
+  times printed by the driver (dimensions, post-fixing, facts) and the
+  metrics of the jobs written by --metrics-report (see pyetlmr.metrics),
+  including the peak memory of the tasks. The results are printed as a table and can be saved
+  as JSON and compared with a saved baseline to catch regressions.
+
+  Usage: python benchmarks/runbench.py [options] input_paths
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['METHODS', 'countrows', 'runstep', 'runmethod', 'compare',
+           'formatruns']
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DRIVER = os.path.join(ROOT, 'pyetlmr', 'paralleletl.py')
+
+# The load methods of paralleletl.py and the configs used for them
+METHODS = {1 : ('odot', 'conf/config.py'),
+           2 : ('odat', 'conf/odatconfig.py'),
+           3 : ('offline', 'conf/offlineconfig.py')}
+
+# The phase times printed by the driver
+PHASES = ((re.compile(r'^Time of loading dimensions: ([0-9.]+)'), 'dimensions'),
+          (re.compile(r'^Post-fixing time: ([0-9.]+)'), 'postfix'),
+          (re.compile(r'^Time of loading facts: ([0-9.]+)'), 'facts'))
+
+
+def countrows(input_paths):
+    """Return the number of rows (not counting the headers) in the files in
+       the given directories."""
+    nrows = 0
+    for input_path in input_paths:
+        for name in os.listdir(input_path):
+            path = os.path.join(input_path, name)
+            if os.path.isfile(path):
+                f = open(path)
+                try:
+                    nrows += max(sum(1 for line in f) - 1, 0)
+                finally:
+                    f.close()
+    return nrows
+
+
+def runstep(method, step, input_paths, config, options, log=sys.stdout):
+    """Run one step of one load method and return a dict with its wall time,
+       phase times, the peak memory of the driver in megabytes and the
+       metrics of its jobs. The output of the driver is copied to log."""
+    (fd, reportpath) = tempfile.mkstemp(prefix='etlmr-metrics-',
+                                        suffix='.json')
+    os.close(fd)
+    args = [options.python, DRIVER, '--load-method', str(method),
+            '--load-step', str(step), '--config', config,
+            '--nr-maps', str(options.nr_maps),
+            '--nr-reducers', str(options.nr_reducers),
+            '--metrics-report', reportpath]
+    if options.disco_master:
+        args.extend(['--disco-master', options.disco_master])
+    args.extend(input_paths)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] +
+                                        [p for p in [env.get('PYTHONPATH')]
+                                         if p])
+    res = {'step' : step, 'phases' : {}, 'jobs' : {}}
+    start = time.time()
+    driver = subprocess.Popen(args, cwd=ROOT, env=env,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+    for line in iter(driver.stdout.readline, ''):
+        log.write(line)
+        for (pattern, phase) in PHASES:
+            match = pattern.match(line)
+            if match:
+                res['phases'][phase] = float(match.group(1))
+    # wait4 gives the resource usage of this driver only
+    (pid, status, rusage) = os.wait4(driver.pid, 0)
+    if os.WIFSIGNALED(status):
+        driver.returncode = -os.WTERMSIG(status)
+    else:
+        driver.returncode = os.WEXITSTATUS(status)
+    res['seconds'] = time.time() - start
+    res['returncode'] = driver.returncode
+    res['maxrssmb'] = rusage.ru_maxrss / 1024.0
+    try:
+        if os.path.getsize(reportpath):
+            reportfile = open(reportpath)
+            try:
+                res['jobs'] = json.load(reportfile)
+            finally:
+                reportfile.close()
+    finally:
+        os.remove(reportpath)
+    taskmem = [job['histograms']['memory.maxrss.mb']['max'] for job in
+               res['jobs'].values() if 'memory.maxrss.mb' in
+               job.get('histograms', {})]
+    res['taskmaxrssmb'] = taskmem and max(taskmem) or None
+    return res
+
+
+def runmethod(method, input_paths, nrows, options, log=sys.stdout):
+    """Reset the DW and run both steps of a load method. Return a dict with
+       the results of the steps (see runstep)."""
+    (name, config) = METHODS[method]
+    config = getattr(options, '%s_config' % (name,)) or config
+    if options.reset_cmd:
+        log.write("Resetting the DW: %s\n" % (options.reset_cmd,))
+        if subprocess.call(options.reset_cmd, shell=True, cwd=ROOT):
+            raise RuntimeError, "The reset command failed"
+    res = {'method' : name, 'config' : config, 'rows' : nrows, 'steps' : []}
+    for step in (options.combined and (3,) or (1, 2)):
+        log.write("Running %s step %d ...\n" % (name, step))
+        stepres = runstep(method, step, input_paths, config, options, log)
+        stepres['rowspersecond'] = nrows / max(stepres['seconds'], 1e-6)
+        res['steps'].append(stepres)
+        if stepres['returncode']:
+            raise RuntimeError, "%s step %d failed with exit code %d" % \
+                (name, step, stepres['returncode'])
+    res['seconds'] = sum([s['seconds'] for s in res['steps']])
+    res['rowspersecond'] = nrows / max(res['seconds'], 1e-6)
+    return res
+
+
+def compare(runs, baseline, tolerance=0.1):
+    """Return a list of lines describing the steps of the runs that took
+       more than (1 + tolerance) times the seconds of the same step of the
+       same method in the baseline runs."""
+    before = {}
+    for run in baseline:
+        for step in run['steps']:
+            before[(run['method'], step['step'])] = step['seconds']
+    regressions = []
+    for run in runs:
+        for step in run['steps']:
+            old = before.get((run['method'], step['step']))
+            if old and step['seconds'] > old * (1 + tolerance):
+                regressions.append("%s step %d: %.2fs, was %.2fs (+%.0f%%)" % \
+                    (run['method'], step['step'], step['seconds'], old,
+                     100 * (step['seconds'] / old - 1)))
+    return regressions
+
+
+def formatruns(runs):
+    """Return the results of the runs as lines of a table."""
+    lines = ["%-8s %4s %10s %12s %10s %10s %10s %10s %10s" % \
+             ('method', 'step', 'seconds', 'rows/s', 'dims', 'postfix',
+              'facts', 'driverMB', 'taskMB')]
+    fmt = lambda v, f: v is None and '-' or f % (v,)
+    for run in runs:
+        for step in run['steps']:
+            phases = step['phases']
+            lines.append("%-8s %4d %10.2f %12.1f %10s %10s %10s %10s %10s" % \
+                (run['method'], step['step'], step['seconds'],
+                 step['rowspersecond'],
+                 fmt(phases.get('dimensions'), '%.2f'),
+                 fmt(phases.get('postfix'), '%.2f'),
+                 fmt(phases.get('facts'), '%.2f'),
+                 fmt(step['maxrssmb'], '%.1f'),
+                 fmt(step['taskmaxrssmb'], '%.1f')))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage='%prog [options] input_paths')
+    parser.add_option('--methods', default='1,2,3',
+                      help='Comma-separated load methods to run: 1. ODOT; '
+                      '2. ODAT; 3. Offline dim (default=1,2,3)')
+    parser.add_option('--disco-master', default=os.getenv('DISCO_MASTER'),
+                      help='Disco master')
+    parser.add_option('--nr-maps', default=2,
+                      help='Numbers of mappers (default=2)')
+    parser.add_option('--nr-reducers', default=2,
+                      help='Numbers of reducers (default=2)')
+    parser.add_option('--odot-config', default=None,
+                      help='Config of ODOT (default=conf/config.py)')
+    parser.add_option('--odat-config', default=None,
+                      help='Config of ODAT (default=conf/odatconfig.py)')
+    parser.add_option('--offline-config', default=None,
+                      help='Config of offline dim '
+                      '(default=conf/offlineconfig.py)')
+    parser.add_option('--reset-cmd', default=None,
+                      help='Shell command that recreates the DW before each '
+                      'method, e.g., "psql -d etlmr -f '
+                      'examples/dbschema/snowflake.sql" (default=None)')
+    parser.add_option('--combined', action='store_true', default=False,
+                      help='Load the dimensions and facts in one run that '
+                      'reads the input once (--load-step 3)')
+    parser.add_option('--python', default=sys.executable,
+                      help='Python to run the driver with (default=this one)')
+    parser.add_option('--output', default=None,
+                      help='Write the results as JSON to this path '
+                      '(default=None)')
+    parser.add_option('--baseline', default=None,
+                      help='Compare with the results saved by --output of an '
+                      'earlier run and exit with 1 on regressions')
+    parser.add_option('--tolerance', type='float', default=0.1,
+                      help='Allowed slowdown compared with the baseline '
+                      '(default=0.1)')
+    (options, input_paths) = parser.parse_args()
+    if not input_paths:
+        parser.error('No input paths given')
+    input_paths = [os.path.abspath(p) for p in input_paths]
+
+    nrows = countrows(input_paths)
+    runs = []
+    for method in [int(m) for m in options.methods.split(',')]:
+        runs.append(runmethod(method, input_paths, nrows, options))
+    for line in formatruns(runs):
+        print line
+    if options.output:
+        outputfile = open(options.output, 'w')
+        try:
+            json.dump(runs, outputfile, indent=2, sort_keys=True)
+        finally:
+            outputfile.close()
+        print "Wrote the results to %s" % (options.output,)
+    if options.baseline:
+        baselinefile = open(options.baseline)
+        try:
+            regressions = compare(runs, json.load(baselinefile),
+                                  options.tolerance)
+        finally:
+            baselinefile.close()
+        for line in regressions:
+            print "Regression: %s" % (line,)
+        if regressions:
+            sys.exit(1)
@@ -18,6 +18,7 @@ import pyetlmr as etlmr
 from pyetlmr import getint, getdate, datereader
 from pyetlmr.odottables import CachedDimension, \
      SlowlyChangingDimension, BulkFactTable
+from pyetlmr.datedimension import DateDimension
 
 __author__ = "Xiufeng Liu"
 __maintainer__ = "Xiufeng Liu"
@@ -54,16 +55,6 @@ def UDF_idfinder(name):
         connection.execute("SELECT nextval('%s')" % name)
         return connection.fetchonetuple()[0]
 
-def UDF_datehandling(row, namemapping):
-        date = etlmr.getvalue(row, 'date', namemapping)
-        (year, month, day, hour, minute, second, weekday, dayinyear, dst) = time.strptime(date, "%Y-%m-%d")
-        (isoyear, isoweek, isoweekday) = datetime.date(year, month, day).isocalendar()
-        row['day'] = day
-        row['month'] = month
-        row['year'] = year
-        row['week'] = isoweek
-        row['weekyear'] = isoyear
-
 def UDF_extractdomaininfo(row, namemapping):
         # Take the 'www.domain.org' part from 'http://www.domain.org/page.html'
         # We also the host name ('www') in the domain in this example.
@@ -137,9 +128,13 @@ testdim = CachedDimension(
         lookupatts=['testname']
 )
 
-datedim = CachedDimension(
+# The rows of the dates are made in advance (see pyetlmr.datedimension)
+datedim = DateDimension(
         name='datedim',
         key='dateid',
+        fromdate='2000-01-01',
+        todate='2030-12-31',
+        defaultidvalue = -1,
         attributes=['date','day','month','year','week','weekyear'],
         lookupatts=['date']
 )
@@ -161,7 +156,7 @@ dimensions = { # Settings of dimensions
                                   'rowhandlers' : (UDF_extractserverinfo, ),
                                   'namemappings' : {}},
                datedim: {'srcfields' : ('downloaddate',),
-                         'rowhandlers' : (UDF_datehandling,),
+                         'rowhandlers' : (),
                          'namemappings' : {'date':'downloaddate'}},
                testdim: {'srcfields' : ('test',),
                          'rowhandlers' : (),
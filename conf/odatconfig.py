@@ -20,6 +20,8 @@ from pyetlmr.odattables import CachedDimension, \
      BulkFactTable, FactTable
 from pyetlmr import getint, getdate, \
      datereader, getvalue
+from pyetlmr.prefill import prefill_dimensions
+from pyetlmr.datedimension import DateDimension
 
 __author__ = "Xiufeng Liu"
 __maintainer__ = "Xiufeng Liu"
@@ -54,21 +56,6 @@ def UDF_createConnection():
 
 connection = UDF_createConnection()
 
-def UDF_datehandling(row, namemapping):
-	# This method is called from ensure(row) when the lookup of a date fails.
-	# We have to calculate all date related fields and add them to the row.
-	date = getvalue(row, 'date', namemapping)
-	(year, month, day, hour, minute, second, weekday, dayinyear, dst) = \
-	        time.strptime(date, "%Y-%m-%d")
-	(isoyear, isoweek, isoweekday) = \
-	        datetime.date(year, month, day).isocalendar()
-	row['day'] = day
-	row['month'] = month
-	row['year'] = year
-	row['week'] = isoweek
-	row['weekyear'] = isoyear
-	return row
-
 def UDF_pgcopy(name, atts, fieldsep, rowsep, nullval, filehandle):
 	global connection
 	curs = connection.cursor()
@@ -111,7 +98,8 @@ pagedim = SlowlyChangingDimension(
         toatt='validto', 
         srcdateatt='lastmoddate',                     
         cachesize=-1,
-        defaultidvalue=-1)
+        defaultidvalue=-1,
+        indexversions=True)
 
 references = [(pagedim, (serverversiondim, domaindim)),
               (serverversiondim, serverdim),
@@ -126,20 +114,28 @@ testdim = CachedDimension(
         key='testid',
         attributes=['testname'],
         lookupatts=['testname'], 
-        prefill=True, 
         defaultidvalue=-1
 )
 # ----------------------------------------
 
-datedim = CachedDimension(
-        name='datedim', 
+# The rows of the dates are made in advance (see pyetlmr.datedimension)
+datedim = DateDimension(
+        name='datedim',
         key='dateid',
+        fromdate='2000-01-01',
+        todate='2030-12-31',
         attributes=['date', 'day', 'month', 'year', 'week', 'weekyear'],
         lookupatts=['date'], 
         defaultidvalue=-1
 )
 # ----------------------------------------    
 
+# The caches of these dimensions are filled concurrently at start-up, each
+# on its own connection
+prefilleddims = [testdim]
+prefill_dimensions(prefilleddims, UDF_createConnection)
+# ----------------------------------------    
+
 testresults = BulkFactTable(
         name='testresultsfact', 
         keyrefs=['pageid', 'testid', 'dateid'],
@@ -160,16 +156,6 @@ def UDF_extractserverinfo(row, namemapping):
 	# Find the server name from a string like "ServerName/Version"
 	row['server'] = row['serverversion'].split('/')[0]
 
-def UDF_datehandling(row, namemapping):
-	date = pyetlmr.getvalue(row, 'date', namemapping)
-	(year, month, day, hour, minute, second, weekday, dayinyear, dst) = time.strptime(date, "%Y-%m-%d")
-	(isoyear, isoweek, isoweekday) = datetime.date(year, month, day).isocalendar()
-	row['day'] = day
-	row['month'] = month
-	row['year'] = year
-	row['week'] = isoweek
-	row['weekyear'] = isoyear
-
 
 
 dimensions = {
@@ -178,7 +164,7 @@ dimensions = {
                    'namemappings' : {}
                    },
         datedim : {'srcfields': ('downloaddate',),
-                   'rowhandlers' :(UDF_datehandling,),
+                   'rowhandlers' :(),
                    'namemappings' : {'date':'downloaddate'}
                    },
         testdim : {'srcfields': (),
@@ -201,5 +187,26 @@ facts = {
                      }
 }
 
+# Optional: the number of bytes the dimension caches of a worker may use in
+# total. The bytes are moved to the caches with the most hits while loading.
+#cachememory = 256*1024*1024
+
+# Optional: the number of seconds between the progress lines of the workers.
+#progressinterval = 60
+
+# Optional: profile the rowhandlers, the ensure/lookup/insert calls and the
+# bulkloaders. Every profileudfs'th call is timed. profilesampling is the
+# seconds of CPU time between the samples of a sampling profiler.
+#profileudfs = 1
+#profilesampling = 0.01
+
+# Optional: the number of rows a worker collects before it ensures them in
+# a snowflaked dimension by one batched lookup and insert per table.
+#ensurebatchsize = 1000
+
+# Optional: the number of snowflake tables post-fixing may fix at the same
+# time, each on its own connection. Default: all independent tables.
+#postfixworkers = 4
+
 if __name__== "__main__":
 	print('Hello World!')
@@ -61,8 +61,8 @@ def UDF_idfinder(row, namemapping):
 
 def UDF_datehandling(row, namemapping):
         date = etlmr.getvalue(row, 'date', namemapping)
-        (year, month, day, hour, minute, second, weekday, dayinyear, dst) = time.strptime(date, "%Y-%m-%d")
-        (isoyear, isoweek, isoweekday) = datetime.date(year, month, day).isocalendar()
+        # dateparts remembers the few thousand distinct dates
+        (year, month, day, isoyear, isoweek, isoweekday) = etlmr.dateparts(date)
         row['day'] = day
         row['month'] = month
         row['year'] = year
@@ -108,6 +108,7 @@ pagedim = SlowlyChangingDimension(
         toatt='validto',
         srcdateatt='lastmoddate',
         shelvedpath='/home/demouser/disco/root/input/pagedim',
+        indexversions=True,
         #bigdim = True
 )
 
@@ -141,6 +142,9 @@ dimensions = { # Settings of dimension tables
                          'namemappings':{'testname':'test'}}
 }
 
+# The offline dimensions that are filled from the DW before loading
+prefilleddims = [dim for dim in dimensions if dim.prefill]
+
 #------ Declare fact tables and their settings -------------
 testresultsfact = BulkFactTable(
         name='testresultsfact',
@@ -155,4 +159,17 @@ facts = { # Settings of fact table
                   'namemappings' : {'testname':'test', 'date':'downloaddate'},
                   'rowhandlers' : (UDF_convertstrtoint,),
                   },
-}
\ No newline at end of file
+}
+
+# Optional: the number of bytes the dimension caches of a worker may use in
+# total. The bytes are moved to the caches with the most hits while loading.
+#cachememory = 256*1024*1024
+
+# Optional: the number of seconds between the progress lines of the workers.
+#progressinterval = 60
+
+# Optional: profile the rowhandlers, the ensure/lookup/insert calls and the
+# bulkloaders. Every profileudfs'th call is timed. profilesampling is the
+# seconds of CPU time between the samples of a sampling profiler.
+#profileudfs = 1
+#profilesampling = 0.01
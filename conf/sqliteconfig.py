@@ -0,0 +1,175 @@
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os, time, datetime 
+import pyetlmr as etlmr
+from pyetlmr import sqlitetarget
+from pyetlmr import getint, getdate, datereader
+from pyetlmr.odottables import CachedDimension, \
+     SlowlyChangingDimension, BulkFactTable
+from pyetlmr.datedimension import DateDimension
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+# A config like config.py which loads into SQLite instead of PostgreSQL,
+# e.g., for local runs and benchmarks. Only the ODOT load method
+# (--load-method 1) is supported. All the tasks must run on the host
+# holding the database file.
+
+#---- Define the database setting -------
+dbconfig = {
+'path'      : os.getenv('ETLMR_SQLITE', '/tmp/etlmr.db'),
+'wal'       : True,  # Use ':memory:' as the path for an in-memory DW
+'schema'    : os.path.join(os.path.dirname(os.path.abspath(etlmr.__file__)),
+                           os.pardir, 'examples', 'dbschema',
+                           'snowflake_sqlite.sql')
+}
+
+#-- Define the UDFs  --------------------
+def UDF_createConnection():
+        return sqlitetarget.connect(dbconfig['path'], wal=dbconfig['wal'],
+                                    schema=dbconfig['schema'])
+
+connection = UDF_createConnection()
+
+def UDF_extractdomaininfo(row, namemapping):
+        # Take the 'www.domain.org' part from 'http://www.domain.org/page.html'
+        # We also the host name ('www') in the domain in this example.
+        domaininfo = row['url'].split('/')[-2]
+        row['domain'] = domaininfo
+        # Take the top level which is the last part of the domain
+        row['topleveldomain'] = domaininfo.split('.')[-1]
+
+def UDF_extractserverinfo(row, namemapping):
+        # Find the server name from a string like "ServerName/Version"
+        row['server'] = row['serverversion'].split('/')[0]
+
+def UDF_convertstrtoint(row):
+        row['errors'] = etlmr.getint(row['errors'])
+
+
+def UDF_sqlitecopy(name, atts, fieldsep, rowsep, nullval, filehandle):
+	sqlitetarget.copyfrom(connection, name, atts, fieldsep, rowsep, nullval,
+	                      filehandle)
+
+#-- Declare dimensions and their settings -------------------
+topleveldomaindim = CachedDimension(
+        name='topleveldomaindim',
+        key='topleveldomainid',
+        attributes=['topleveldomain'],
+        lookupatts=['topleveldomain'])
+
+domaindim = CachedDimension(
+        name='domaindim',
+        key='domainid',
+        attributes=['domain', 'topleveldomainid'],
+        lookupatts=['domain']
+)
+
+serverdim = CachedDimension(
+        name='serverdim',
+        key='serverid',
+        attributes=['server'],
+        lookupatts=['server'])
+
+serverversiondim = CachedDimension(
+        name='serverversiondim',
+        key='serverversionid',
+        attributes=['serverversion', 'serverid'],
+        lookupatts=['serverversion']
+)
+
+pagedim = SlowlyChangingDimension(
+        name='pagedim',
+        key='pageid',
+        lookupatts=['url'],
+        attributes=['url', 'size', 'validfrom', 'validto', 'version', 'domainid', 'serverversionid'],
+        versionatt='version',
+        fromatt='validfrom',
+        toatt='validto',
+        srcdateatt='lastmoddate'
+)
+
+testdim = CachedDimension(
+        name='testdim',
+        key='testid',
+        defaultidvalue = -1,
+        attributes=['testname'],
+        lookupatts=['testname']
+)
+
+# The rows of the dates are made in advance (see pyetlmr.datedimension)
+datedim = DateDimension(
+        name='datedim',
+        key='dateid',
+        fromdate='2000-01-01',
+        todate='2030-12-31',
+        attributes=['date','day','month','year','week','weekyear'],
+        lookupatts=['date']
+)
+
+dimensions = { # Settings of dimensions
+               pagedim: {'srcfields' : ('url', 'serverversion', 'domain', 'size', 'lastmoddate'),
+                         'rowhandlers' : (UDF_extractdomaininfo, UDF_extractserverinfo),
+                         'namemappings' : {}},
+               topleveldomaindim: {'srcfields' : ('url',),
+                                   'rowhandlers' : (UDF_extractdomaininfo,),
+                                   'namemappings' : {}},
+               domaindim: {'srcfields' : ('url',),
+                           'rowhandlers' : (UDF_extractdomaininfo,),
+                           'namemappings' : {}},
+               serverdim: {'srcfields' : ('serverversion',),
+                           'rowhandlers' : (UDF_extractserverinfo, ),
+                           'namemappings' : {}},
+               serverversiondim: {'srcfields' : ('serverversion',),
+                                  'rowhandlers' : (UDF_extractserverinfo, ),
+                                  'namemappings' : {}},
+               datedim: {'srcfields' : ('downloaddate',),
+                         'rowhandlers' : (),
+                         'namemappings' : {'date':'downloaddate'}},
+               testdim: {'srcfields' : ('test',),
+                         'rowhandlers' : (),
+                         'namemappings':{'testname':'test'}}
+}
+
+# Define the reference-ship of snowflaked dimension tables
+references = [(pagedim, (serverversiondim, domaindim)),
+              (serverversiondim, serverdim),
+              (domaindim, topleveldomaindim)
+              ]
+
+
+# The loading order of  snowflake dimensions
+order =  [(topleveldomaindim, serverdim), (domaindim, serverversiondim), (pagedim, testdim, datedim)]
+
+
+# --- Define facts and their settings ---------
+testresultsfact = BulkFactTable(
+        name='testresultsfact',
+        keyrefs=['pageid', 'testid', 'dateid'],
+        measures=['errors'],
+        bulkloader=UDF_sqlitecopy,
+        bulksize=500000)
+
+facts = { # Settings of facts
+          testresultsfact: {
+                  'refdims' : (testdim, pagedim, datedim),
+                  'namemappings' : {'testname':'test', 'date':'downloaddate'},
+                  'rowhandlers' : (UDF_convertstrtoint,),
+                  },
+}
+
+#factdict = {'testresultsfact':testresultsfact}
\ No newline at end of file
@@ -0,0 +1,72 @@
+-- The snowflake schema of snowflake.sql for SQLite (see pyetlmr.sqlitetarget)
+
+-- tables
+create table if not exists topleveldomaindim(
+   topleveldomainid int primary key,
+   topleveldomain varchar
+);
+
+create table if not exists domaindim(
+   domainid int primary key,
+   domain varchar,
+   topleveldomainid int
+);
+
+
+create table if not exists serverdim(
+   serverid int primary key,
+   server varchar
+);
+
+create table if not exists serverversiondim(
+   serverversionid int primary key,
+   serverversion varchar,
+   serverid int
+);
+
+create table if not exists pagedim(
+   pageid int primary key,
+   url varchar,
+   size int,
+   validfrom date,
+   validto date,
+   version int,
+   domainid int,
+   serverversionid int
+);
+
+create table if not exists testdim(
+   testid int primary key,
+   testname varchar,
+   testauthor varchar
+);
+
+insert or ignore into testdim values (0, 'Test0', 'Joe Doe'), (1, 'Test1', 'Joe Doe'), 
+(2, 'Test2', 'Joe Doe'), (3, 'Test3', 'Joe Doe'), (4, 'Test4', 'Joe Doe'),
+(5, 'Test5', 'Joe Doe'), (6, 'Test6', 'Joe Doe'), (7, 'Test7', 'Joe Doe'),
+(8, 'Test8', 'Joe Doe'), (9, 'Test9', 'Joe Doe'),
+(-1, 'Unknown test', 'Unknown author');
+
+
+create table if not exists datedim(
+   dateid int primary key,
+   "date" date,
+   day int,
+   month int,
+   year int,
+   week int,
+   weekyear int
+);
+
+create table if not exists testresultsfact(
+   pageid int,
+   testid int,
+   dateid int,
+   errors int,
+   primary key(pageid, testid, dateid)
+);
+
+
+-- indexes
+
+--create index url_version_idx on pagedim(url, version desc);
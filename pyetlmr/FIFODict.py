@@ -19,7 +19,7 @@
 #
 
 
-from collections import deque
+from collections import OrderedDict
 
 __author__ = "Christian Thomsen"
 __maintainer__ = "Christian Thomsen"
@@ -43,8 +43,9 @@ class FIFODict:
             raise ValueError, "size must be positive"
 
         self.__size = size
-        self.__data = {}
-        self.__order = deque()
+        # The insertion order of the keys is kept by the OrderedDict such
+        # that adding, evicting and deleting are all O(1)
+        self.__data = OrderedDict()
 
     def add(self, key, val):
         """Add a key/value pair to the dict.
@@ -57,16 +58,13 @@ class FIFODict:
 
            The argument key is the key and the argument val is the value."""
         if key in self.__data:
-            self.__data[key] = val # Replace old value
-        elif len(self.__order) < self.__size:
+            self.__data[key] = val # Replace old value, keeps the position
+        elif len(self.__data) < self.__size:
             # The dict is not full yet. Just add the new pair.
-            self.__order.append(key)
             self.__data[key] = val
         else:
             # The dict is full. We have to delete the oldest item first.
-            delKey = self.__order.popleft()
-            del self.__data[delKey]
-            self.__order.append(key)
+            self.__data.popitem(last=False)
             self.__data[key] = val
 
     def get(self, key, default=None):
@@ -78,9 +76,7 @@ class FIFODict:
 
     def clear(self):
         """Delete all key/value pairs from the dict"""
-        self.__data = {}
-        self.__order = []
-
+        self.__data.clear()
 
     def __setitem__(self, key, item):
         self.add(key, item)
@@ -93,8 +89,7 @@ class FIFODict:
 
     def __str__(self):
         allitems = []
-        for key in self.__order:
-            val = self.__data[key]
+        for key, val in self.__data.iteritems():
             item = "%s: %s" % (str(key), str(val))
             allitems.append(item)
         return "{%s}" % ", ".join(allitems)
@@ -107,8 +102,6 @@ class FIFODict:
             raise ValueError, item
 
         del self.__data[item]
-        self.__order.remove(item)
 
     def __iter__(self):
-        for k in self.__order:
-            yield k
+        return iter(self.__data)
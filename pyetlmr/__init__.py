@@ -11,6 +11,12 @@
    - tables for giving easy and abstracted access to dimension and fact tables
    - FIFODict for providing a dict with a limited size and where elements are 
      removed in first-in first-out order
+   - caches for bounded caches with FIFO, LRU, CLOCK and ARC replacement
+   - prefill for filling the caches of several dimensions concurrently
+   - bloom for a Bloom filter that tells when a dimension member is new
+   - versionindex for finding the version of a member valid at a date
+   - datedimension for a date dimension computed in advance for a range
+   - sqlitetarget for using SQLite as the DW, e.g., for local runs
 """
 #  This file contains the code for the pygrametl-based solution
 #  presented in C. Thomsen & T.B. Pedersen's
@@ -33,6 +39,7 @@
 import copy as pcopy
 import types
 from datetime import date, datetime
+from functools import wraps
 from Queue import Queue
 from sys import modules
 from threading import Thread
@@ -45,12 +52,44 @@ __all__ = ['project', 'copy', 'rename', 'getint', 'getlong', 'getfloat',
            'getstr', 'getstrippedstr', 'getstrornullvalue', 'getbool', 
            'getdate', 'gettimestamp', 'getvalue', 'getvalueor', 'setdefaults', 
            'rowfactory', 'endload', 'today', 'now', 'ymdparser', 'ymdhmsparser',
-           'datereader', 'datetimereader', 'toupper', 'tolower', 'keepasis', 
+           'dateparts', 'memoize', 'datereader', 'datetimereader', 'toupper',
+           'tolower', 'keepasis', 
            'ConnectionWrapper', 'BackgroundConnectionWrapper']
 
 
 _alltables = []
 
+# The number of distinct values the date parsing functions remember. There
+# are usually only a few thousand distinct dates in a load.
+DATECACHESIZE = 20000
+
+def memoize(size=DATECACHESIZE):
+    """Return a decorator that remembers the results of a function in a dict
+       holding at most size results. The dict is emptied when it is full,
+       which is much cheaper than keeping an LRU order for functions as
+       cheap as the date parsers.
+
+       The arguments of the function must be hashable and the results should
+       not be changed by the callers as they are shared. The dict may be
+       used by several threads as its get and set are atomic.
+    """
+    def decorator(func):
+        cache = {}
+        @wraps(func)
+        def wrapped(*args):
+            try:
+                return cache[args]
+            except KeyError:
+                pass
+            value = func(*args)
+            if len(cache) >= size:
+                cache.clear()
+            cache[args] = value
+            return value
+        wrapped.cache = cache
+        return wrapped
+    return decorator
+
 def project(atts, row, renaming={}):
     """Create a new dictionary with a subset of the attributes.
 
@@ -188,12 +227,15 @@ def getdate(targetconnection, ymdstr, default=None):
        - default: The value to return if the conversion fails
     """
     try:
-        (year, month, day) = ymdstr.split('-')
-        modref = targetconnection.getunderlyingmodule()
-        return modref.Date(int(year), int(month), int(day))
+        return _getdate(targetconnection.getunderlyingmodule(), ymdstr)
     except Exception:
         return default
 
+@memoize()
+def _getdate(modref, ymdstr):
+    (year, month, day) = ymdstr.split('-')
+    return modref.Date(int(year), int(month), int(day))
+
 def gettimestamp(targetconnection, ymdhmsstr, default=None):
     """Converts a string of the form 'yyyy-MM-dd HH:mm:ss' to a Timestamp.
     
@@ -205,15 +247,19 @@ def gettimestamp(targetconnection, ymdhmsstr, default=None):
        - default: The value to return if the conversion fails
     """
     try:
-        (datepart, timepart) = ymdhmsstr.strip().split(' ')
-        (year, month, day) = datepart.split('-')
-        (hour, minute, second) = timepart.split(':')
-        modref = targetconnection.getunderlyingmodule()
-        return modref.Timestamp(int(year), int(month), int(day),\
-                                int(hour), int(minute), int(second))
+        return _gettimestamp(targetconnection.getunderlyingmodule(),
+                             ymdhmsstr)
     except Exception:
         return default
 
+@memoize()
+def _gettimestamp(modref, ymdhmsstr):
+    (datepart, timepart) = ymdhmsstr.strip().split(' ')
+    (year, month, day) = datepart.split('-')
+    (hour, minute, second) = timepart.split(':')
+    return modref.Timestamp(int(year), int(month), int(day),\
+                            int(hour), int(minute), int(second))
+
 def getvalue(row, name, mapping={}):
     """If name in mapping, return row[mapping[name]], else return row[name]."""
     if name in mapping:
@@ -329,22 +375,26 @@ def now(targetconnection, ignoredrow=None, ignorednamemapping=None):
                             to.second)
     return _now
 
+@memoize()
 def ymdparser(ymdstr):
-    """Convert a string of the form 'yyyy-MM-dd' to a datetime.date. 
+    """Convert a string of the form 'yyyy-MM-dd' to a datetime.date.
 
-       If the input is None, the return value is also None.
+       If the input is None, the return value is also None. The results are
+       remembered (see memoize).
     """
     if ymdstr is None:
         return None
     (year, month, day) = ymdstr.split('-')
     return date(int(year), int(month), int(day))
 
+@memoize()
 def ymdhmsparser(ymdhmsstr):
-    """Convert a string 'yyyy-MM-dd HH:mm:ss' to a datetime.datetime. 
+    """Convert a string 'yyyy-MM-dd HH:mm:ss' to a datetime.datetime.
 
-       If the input is None, the return value is also None.
+       If the input is None, the return value is also None. The results are
+       remembered (see memoize).
     """
-    if ymdstr is None:
+    if ymdhmsstr is None:
         return None
     (datepart, timepart) = ymdhmsstr.strip().split(' ')
     (year, month, day) = datepart.split('-')
@@ -352,6 +402,29 @@ def ymdhmsparser(ymdhmsstr):
     return datetime(int(year), int(month), int(day),\
                     int(hour), int(minute), int(second))
 
+@memoize()
+def dateparts(ymdstr):
+    """Return (year, month, day, isoyear, isoweek, isoweekday) for a string
+       of the form 'yyyy-MM-dd' or a datetime.date.
+
+       The results are remembered (see memoize).
+    """
+    if isinstance(ymdstr, basestring):
+        thedate = ymdparser(ymdstr)
+    else:
+        thedate = ymdstr
+    (isoyear, isoweek, isoweekday) = thedate.isocalendar()
+    return (thedate.year, thedate.month, thedate.day,
+            isoyear, isoweek, isoweekday)
+
+@memoize()
+def _todbdate(modref, thedate):
+    return modref.Date(thedate.year, thedate.month, thedate.day)
+
+@memoize()
+def _todbtimestamp(modref, thedt):
+    return modref.Timestamp(thedt.year, thedt.month, thedt.day,
+                            thedt.hour, thedt.minute, thedt.second)
 
 def datereader(dateattribute, parsingfunction=ymdparser):
     """Return a function that converts a certain dictionary member to a Date.
@@ -367,8 +440,7 @@ def datereader(dateattribute, parsingfunction=ymdparser):
     """
     def readerfunction(targetconnection, row, ignorednamemapping = None):
         thedate = parsingfunction(row[dateattribute]) # a datetime.date
-        modref = targetconnection.getunderlyingmodule()
-        return modref.Date(thedate.year, thedate.month, thedate.day)
+        return _todbdate(targetconnection.getunderlyingmodule(), thedate)
     
     return readerfunction
     
@@ -387,9 +459,7 @@ def datetimereader(datetimeattribute, parsingfunction=ymdhmsparser):
     """
     def readerfunction(targetconnection, row, ignoredmapping = None):
         thedt = parsingfunction(row[datetimeattribute]) # a datetime.datetime
-        modref = targetconnection.getunderlyingmodule()
-        return modref.Timestamp(thedt.year, thedt.month, thedt.day, 
-                                thedt.hour, thedt.minute, thedt.second)
+        return _todbtimestamp(targetconnection.getunderlyingmodule(), thedt)
 
     return readerfunction
 
@@ -0,0 +1,95 @@
+"""
+  A Bloom filter for the lookup values of dimension members. A dimension
+  with a complete filter, i.e., one holding the values of all members in
+  the dimension table, knows that a member is new without querying the DW.
+
+  The values are compared by their text form (see memberkey) since values
+  read from the DW and from the source data may have different types.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from hashlib import md5
+from math import ceil, log
+from struct import unpack
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['BloomFilter', 'memberkey']
+
+
+def memberkey(values):
+    """Return a string representing a tuple of lookup values by their text
+       form such that, e.g., 5, '5' and u'5' give the same string."""
+    parts = []
+    for value in values:
+        if value is None:
+            parts.append('\x01')
+        elif isinstance(value, unicode):
+            parts.append(value.encode('utf-8'))
+        else:
+            parts.append(str(value))
+    return '\x00'.join(parts)
+
+
+class BloomFilter(object):
+    """A set of strings which may answer that a string is present when it is
+       not, but never that a string is absent when it has been added."""
+
+    def __init__(self, capacity, errorrate=0.01):
+        """Arguments:
+           - capacity: the number of strings expected to be added. More can
+             be added, but the error rate then grows.
+           - errorrate: the wanted probability of a false positive when
+             capacity strings have been added. Default: 0.01
+        """
+        if not capacity > 0:
+            raise ValueError, "capacity must be positive"
+        if not 0 < errorrate < 1:
+            raise ValueError, "errorrate must be between 0 and 1"
+        self.nbits = int(ceil(-capacity * log(errorrate) / (log(2) ** 2)))
+        self.nhashes = max(1, int(round(self.nbits * log(2) / capacity)))
+        self.bits = bytearray((self.nbits + 7) // 8)
+        self.count = 0
+
+    def __positions(self, item):
+        # Double hashing: the k positions are h1 + i*h2 for i = 0..k-1
+        h1, h2 = unpack('<QQ', md5(item).digest())
+        nbits = self.nbits
+        return [(h1 + i * h2) % nbits for i in xrange(self.nhashes)]
+
+    def add(self, item):
+        """Add the string item to the filter."""
+        bits = self.bits
+        for pos in self.__positions(item):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for pos in self.__positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        """Remove all strings from the filter."""
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
@@ -0,0 +1,612 @@
+"""
+  Bounded mappings between keys and values with different replacement
+  policies. All caches offer the same interface as FIFODict and count
+  their hits, misses and evictions such that the policies can be compared
+  on real workloads.
+
+  The policies are:
+  - fifo: the pair that was added first is evicted first
+  - lru: the pair that was used least recently is evicted first
+  - clock: an approximation of LRU which only sets a reference bit on a hit
+  - arc: the Adaptive Replacement Cache which balances between recency and
+    frequency and thus is resistant to scans of keys that are used only once
+
+  A cache can be bounded by the number of pairs, by the approximate number
+  of bytes the pairs use, or both. A MemoryBudget splits a number of bytes
+  between several caches in proportion to the hits they get. A KeyIndex
+  keeps the key of each cached dimension member such that single members
+  can be evicted on updates.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from collections import OrderedDict
+from sys import getsizeof
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['FIFOCache', 'LRUCache', 'ClockCache', 'ARCCache', 'makecache',
+           'POLICIES', 'approxsize', 'KeyIndex', 'MemoryBudget', 'budgetfor']
+
+
+# The approximate number of bytes a cache uses per pair besides the key and
+# the value, i.e., the slot in the hash table and the links of the list.
+ENTRYOVERHEAD = 128
+
+def approxsize(obj):
+    """Return the approximate number of bytes used by obj including the
+       objects held by a tuple, list, set or dict."""
+    size = getsizeof(obj)
+    t = type(obj)
+    if t in (tuple, list, set, frozenset):
+        for o in obj:
+            size += approxsize(o)
+    elif t is dict:
+        for (k, v) in obj.iteritems():
+            size += approxsize(k) + approxsize(v)
+    return size
+
+
+
+class _Cache(object):
+    """The common part of the caches: counters, eviction and the mapping
+       interface. A subclass stores the pairs and implements the policy in
+       _get, _peek, _put, _replace, _remove, _popvictim, _clear, __len__,
+       __contains__ and __iter__.
+    """
+
+    def __init__(self, size, callback=None, maxbytes=None):
+        """Arguments:
+           - size: the maximum number of key/value pairs in the cache. May 
+             be None if maxbytes is given.
+           - callback: an optional function(key, value) that is called when
+             a pair is evicted from the cache (but not when it is deleted)
+           - maxbytes: the maximum number of bytes the pairs may use as 
+             estimated by approxsize. If None, the bytes are not counted.
+        """
+        if size is None:
+            if maxbytes is None:
+                raise ValueError, "size or maxbytes must be given"
+        elif not type(size) in (int, long):
+            raise TypeError, "size must be an int"
+        elif not size > 0:
+            raise ValueError, "size must be positive"
+        self.size = size
+        self.callback = callback
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.maxbytes = None
+        self.bytes = 0
+        self._sizes = None
+        if maxbytes is not None:
+            self.setmaxbytes(maxbytes)
+
+    def setmaxbytes(self, maxbytes):
+        """Bound the cache by the given number of bytes and evict pairs if
+           the cache currently uses more."""
+        if self._sizes is None:
+            # Start counting the bytes of the pairs already in the cache
+            self._sizes = {}
+            for key in self:
+                self._sizes[key] = ENTRYOVERHEAD + approxsize(key) + \
+                    approxsize(self._peek(key))
+            self.bytes = sum(self._sizes.itervalues())
+        self.maxbytes = maxbytes
+        self._shrink()
+
+    def add(self, key, val):
+        """Add a key/value pair to the cache. If the cache is full, pairs
+           are evicted as decided by the policy."""
+        if key in self:
+            self._replace(key, val)
+            if self._sizes is not None:
+                sz = ENTRYOVERHEAD + approxsize(key) + approxsize(val)
+                self.bytes += sz - self._sizes[key]
+                self._sizes[key] = sz
+        else:
+            self._insert(key, val)
+            if self._sizes is not None:
+                sz = ENTRYOVERHEAD + approxsize(key) + approxsize(val)
+                self.bytes += sz
+                self._sizes[key] = sz
+        if self.maxbytes is not None and self.bytes > self.maxbytes:
+            self._shrink()
+
+    def _shrink(self):
+        # Keep at least one pair to make progress with very large pairs
+        while self.bytes > self.maxbytes and len(self) > 1:
+            self._evict()
+
+    def _isfull(self):
+        return self.size is not None and len(self) >= self.size
+
+    def _insert(self, key, val):
+        while self._isfull():
+            self._evict(key)
+        self._put(key, val)
+
+    def _evict(self, incoming=None):
+        (key, val) = self._popvictim(incoming)
+        self._evicted(key, val)
+
+    def _evicted(self, key, val):
+        self.evictions += 1
+        if self._sizes is not None:
+            self.bytes -= self._sizes.pop(key)
+        if self.callback:
+            self.callback(key, val)
+
+    def get(self, key, default=None):
+        """Return the value key maps to or default if key is not cached."""
+        try:
+            val = self._get(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return val
+
+    def peek(self, key):
+        """Return the value key maps to without updating the counters or
+           the position of key in the policy. Raise KeyError if not found."""
+        return self._peek(key)
+
+    def stats(self):
+        """Return the counters as a dict."""
+        return {'hits' : self.hits, 'misses' : self.misses,
+                'evictions' : self.evictions, 'entries' : len(self),
+                'bytes' : self.bytes}
+
+    def resetstats(self):
+        """Set the hit, miss and eviction counters to 0."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __setitem__(self, key, val):
+        self.add(key, val)
+
+    def __getitem__(self, key):
+        try:
+            val = self._get(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return val
+
+    def __delitem__(self, key):
+        self._remove(key)
+        if self._sizes is not None:
+            self.bytes -= self._sizes.pop(key)
+
+    def clear(self):
+        """Delete all key/value pairs from the cache."""
+        self._clear()
+        if self._sizes is not None:
+            self._sizes = {}
+            self.bytes = 0
+
+    def __str__(self):
+        return "{%s}" % ", ".join(["%s: %s" % (str(k), str(self._peek(k))) \
+                                       for k in self])
+
+
+class FIFOCache(_Cache):
+    """A cache where the pair that was added first is evicted first. A
+       lookup does not change the order of the pairs."""
+
+    def __init__(self, size, callback=None, maxbytes=None):
+        self._data = OrderedDict()
+        _Cache.__init__(self, size, callback, maxbytes)
+
+    def _get(self, key):
+        return self._data[key]
+
+    _peek = _get
+
+    def _put(self, key, val):
+        self._data[key] = val
+
+    def _replace(self, key, val):
+        # An OrderedDict keeps the position of an existing key
+        self._data[key] = val
+
+    def _remove(self, key):
+        del self._data[key]
+
+    def _popvictim(self, incoming=None):
+        return self._data.popitem(last=False)
+
+    def _clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+
+class LRUCache(FIFOCache):
+    """A cache where the pair that was used least recently is evicted
+       first. Both lookups and replacements count as uses."""
+
+    def _get(self, key):
+        # Move the key to the (most recent) end
+        val = self._data.pop(key)
+        self._data[key] = val
+        return val
+
+    def _peek(self, key):
+        return self._data[key]
+
+    def _replace(self, key, val):
+        del self._data[key]
+        self._data[key] = val
+
+
+_EMPTY = object()
+
+class ClockCache(_Cache):
+    """A cache using the CLOCK policy. The pairs are kept in a circular
+       buffer and a hit only sets the reference bit of the pair. To find a
+       victim, a hand sweeps the buffer, clears the reference bits it passes
+       and evicts the first pair whose reference bit is already cleared."""
+
+    def __init__(self, size, callback=None, maxbytes=None):
+        self._clear()
+        _Cache.__init__(self, size, callback, maxbytes)
+
+    def _get(self, key):
+        slot = self._slots[key]
+        self._refs[slot] = True
+        return self._vals[slot]
+
+    def _peek(self, key):
+        return self._vals[self._slots[key]]
+
+    def _put(self, key, val):
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+            self._vals[slot] = val
+            self._refs[slot] = False
+        else:
+            slot = len(self._keys)
+            self._keys.append(key)
+            self._vals.append(val)
+            self._refs.append(False)
+        self._slots[key] = slot
+
+    def _replace(self, key, val):
+        slot = self._slots[key]
+        self._vals[slot] = val
+        self._refs[slot] = True
+
+    def _remove(self, key):
+        slot = self._slots.pop(key)
+        self._keys[slot] = _EMPTY
+        self._vals[slot] = None
+        self._refs[slot] = False
+        self._free.append(slot)
+
+    def _popvictim(self, incoming=None):
+        keys = self._keys
+        refs = self._refs
+        nslots = len(keys)
+        while True:
+            slot = self._hand
+            self._hand = (slot + 1) % nslots
+            if keys[slot] is _EMPTY:
+                continue
+            if refs[slot]:
+                refs[slot] = False
+                continue
+            key = keys[slot]
+            val = self._vals[slot]
+            self._remove(key)
+            return (key, val)
+
+    def _clear(self):
+        self._slots = {}
+        self._keys = []
+        self._vals = []
+        self._refs = []
+        self._free = []
+        self._hand = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __iter__(self):
+        for key in self._keys:
+            if key is not _EMPTY:
+                yield key
+
+
+class ARCCache(_Cache):
+    """A cache using the Adaptive Replacement Cache policy (N. Megiddo and
+       D. S. Modha, FAST 2003).
+
+       Keys seen once are kept in the list T1 and keys seen more than once
+       in the list T2. The keys most recently evicted from T1 and T2 are
+       remembered (without values) in the ghost lists B1 and B2. A miss on a
+       ghost key shifts the target size p of T1 towards recency or
+       frequency. A scan of keys used only once thus only flushes T1 and
+       leaves the frequently used keys in T2 alone.
+    """
+
+    def __init__(self, size, callback=None, maxbytes=None):
+        self._clear()
+        _Cache.__init__(self, size, callback, maxbytes)
+
+    def _get(self, key):
+        if key in self._t1:
+            val = self._t1.pop(key)
+        else:
+            val = self._t2.pop(key)
+        self._t2[key] = val
+        return val
+
+    def _peek(self, key):
+        if key in self._t1:
+            return self._t1[key]
+        return self._t2[key]
+
+    def _insert(self, key, val):
+        # When only bounded by bytes, the lists are sized as if there was
+        # room for one more pair than the cache currently holds
+        c = self.size or len(self) + 1
+        if key in self._b1:
+            self._p = min(c, self._p + max(len(self._b2) // len(self._b1), 1))
+            del self._b1[key]
+            self._makeroom(key)
+            self._t2[key] = val
+        elif key in self._b2:
+            self._p = max(0, self._p - max(len(self._b1) // len(self._b2), 1))
+            del self._b2[key]
+            self._makeroom(key)
+            self._t2[key] = val
+        else:
+            l1 = len(self._t1) + len(self._b1)
+            if l1 >= c:
+                if len(self._t1) < c:
+                    self._b1.popitem(last=False)
+                    self._makeroom(key)
+                else:
+                    # B1 is empty. Evict from T1 without remembering it.
+                    (oldkey, oldval) = self._t1.popitem(last=False)
+                    self._evicted(oldkey, oldval)
+            else:
+                total = l1 + len(self._t2) + len(self._b2)
+                if total >= 2 * c and self._b2:
+                    self._b2.popitem(last=False)
+                self._makeroom(key)
+            self._t1[key] = val
+
+    def _makeroom(self, incoming):
+        while self._isfull():
+            self._evict(incoming)
+
+    def _put(self, key, val):
+        self._t1[key] = val
+
+    def _replace(self, key, val):
+        if key in self._t1:
+            del self._t1[key]
+        else:
+            del self._t2[key]
+        self._t2[key] = val
+
+    def _remove(self, key):
+        if key in self._t1:
+            del self._t1[key]
+        else:
+            del self._t2[key]
+
+    def _popvictim(self, incoming=None):
+        t1len = len(self._t1)
+        if t1len and (t1len > self._p or \
+                          (incoming in self._b2 and t1len == self._p) or \
+                          not self._t2):
+            (key, val) = self._t1.popitem(last=False)
+            self._b1[key] = None
+        else:
+            (key, val) = self._t2.popitem(last=False)
+            self._b2[key] = None
+        return (key, val)
+
+    def _clear(self):
+        # The ghost keys are forgotten as well
+        self._t1 = OrderedDict()
+        self._t2 = OrderedDict()
+        self._b1 = OrderedDict()
+        self._b2 = OrderedDict()
+        self._p = 0
+
+    def __len__(self):
+        return len(self._t1) + len(self._t2)
+
+    def __contains__(self, key):
+        return key in self._t1 or key in self._t2
+
+    def __iter__(self):
+        for key in self._t1:
+            yield key
+        for key in self._t2:
+            yield key
+
+
+POLICIES = {'fifo' : FIFOCache, 'lru' : LRUCache, 'clock' : ClockCache,
+            'arc' : ARCCache}
+
+def makecache(policy, size, callback=None, maxbytes=None):
+    """Create a cache with the given policy.
+
+       Arguments:
+       - policy: the name of the policy: 'fifo', 'lru', 'clock' or 'arc'
+       - size: the maximum number of key/value pairs in the cache or None
+         if only maxbytes should bound the cache
+       - callback: an optional function(key, value) called on evictions
+       - maxbytes: an optional maximum number of bytes for the pairs
+    """
+    try:
+        cls = POLICIES[policy]
+    except KeyError:
+        raise ValueError, "Unknown cache policy: %s" % (policy,)
+    return cls(size, callback, maxbytes)
+
+
+class KeyIndex(object):
+    """A cache from lookup values to dimension keys together with the
+       reverse mapping from keys to the cached lookup values. When a member
+       is updated, the entry for its old lookup values can then be deleted
+       without clearing the whole cache.
+    """
+
+    def __init__(self, cache):
+        """Arguments:
+           - cache: the cache or dict from lookup values to keys. Pairs 
+             must be added through the KeyIndex afterwards.
+        """
+        self.cache = cache
+        self.keys = {}
+        if isinstance(cache, _Cache):
+            cache.callback = self.__evicted
+
+    def __evicted(self, vals, key):
+        if self.keys.get(key) == vals:
+            del self.keys[key]
+
+    def add(self, vals, key):
+        """Cache that the lookup values vals map to key."""
+        if isinstance(self.cache, _Cache):
+            try:
+                oldkey = self.cache.peek(vals)
+            except KeyError:
+                oldkey = None
+        else:
+            oldkey = self.cache.get(vals)
+        if oldkey is not None and oldkey != key:
+            # E.g., a new version of a member got the lookup values
+            self.__evicted(vals, oldkey)
+        self.cache[vals] = key
+        self.keys[key] = vals
+
+    def discard(self, key):
+        """Delete the cached lookup values of the member with the given key,
+           if any."""
+        vals = self.keys.pop(key, None)
+        if vals is not None and vals in self.cache:
+            del self.cache[vals]
+
+    def clear(self):
+        """Delete all pairs."""
+        self.cache.clear()
+        self.keys.clear()
+
+
+class MemoryBudget(object):
+    """Split a number of bytes between several caches.
+
+       Each cache first gets an equal share. Every interval calls of tick,
+       the budget is split again in proportion to the number of hits each 
+       cache got, as each hit saved a lookup in the DW. The hits are 
+       smoothed over the rebalancings, and each cache keeps a minimal share
+       such that a cache that was given little memory can still show that 
+       it is useful.
+    """
+
+    def __init__(self, maxbytes, caches, minshare=0.1, interval=10000):
+        """Arguments:
+           - maxbytes: the number of bytes to split between the caches
+           - caches: a sequence of caches from this module. The caches are
+             bounded by bytes only, i.e., their limits on the number of
+             pairs are removed.
+           - minshare: the part of maxbytes that is split equally between 
+             the caches no matter how many hits they get. Default: 0.1
+           - interval: the number of calls of tick between rebalancings.
+             Default: 10000
+        """
+        self.maxbytes = maxbytes
+        self.caches = list(caches)
+        self.minshare = minshare
+        self.interval = interval
+        self.__ticks = 0
+        self.__lasthits = [c.hits for c in self.caches]
+        self.__benefit = [0.0] * len(self.caches)
+        for cache in self.caches:
+            cache.size = None
+        self.rebalance()
+
+    def tick(self, n=1):
+        """Count n units of work (e.g., rows) and rebalance when due."""
+        self.__ticks += n
+        if self.__ticks >= self.interval:
+            self.__ticks = 0
+            self.rebalance()
+
+    def rebalance(self):
+        """Split the budget in proportion to the recent hits of the caches."""
+        if not self.caches:
+            return
+        for i, cache in enumerate(self.caches):
+            self.__benefit[i] = self.__benefit[i] / 2.0 + \
+                (cache.hits - self.__lasthits[i])
+            self.__lasthits[i] = cache.hits
+        total = sum(self.__benefit)
+        n = len(self.caches)
+        fixed = self.maxbytes * self.minshare / n
+        rest = self.maxbytes - fixed * n
+        for i, cache in enumerate(self.caches):
+            if total > 0:
+                share = fixed + rest * self.__benefit[i] / total
+            else:
+                share = self.maxbytes / n
+            cache.setmaxbytes(int(share))
+
+    def shares(self):
+        """Return the current number of bytes given to each cache."""
+        return [c.maxbytes for c in self.caches]
+
+
+def budgetfor(dimensions, maxbytes, **kwargs):
+    """Return a MemoryBudget for the caches of the given dimensions or None
+       if they have no bounded caches.
+
+       Arguments:
+       - dimensions: a sequence of dimension objects. The caches are found
+         by means of their getcaches methods.
+       - maxbytes: the number of bytes to split between the caches
+       - **kwargs: further arguments for MemoryBudget
+    """
+    caches = []
+    for dim in dimensions:
+        getcaches = getattr(dim, 'getcaches', None)
+        if callable(getcaches):
+            caches.extend(getcaches())
+    if not caches:
+        return None
+    return MemoryBudget(maxbytes, caches, **kwargs)
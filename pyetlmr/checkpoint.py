@@ -0,0 +1,291 @@
+"""
+  Checkpoints of long loads such that a failed job can be restarted where
+  its tasks got to instead of from the beginning (see paralleletl.py
+  --checkpoint and --resume).
+
+  The rows must be read by mapreader.map_csv_reader_pos which sets
+  row[POSITION] to the input and the number of the row in the input.
+
+  Facts: a FactCheckpointer is given to the bulk fact tables as their
+  beforebulkload hook. Before each bulk load of a table, it writes the
+  positions in the inputs up to which the rows of the table are in the
+  loaded batch to a checkpoint table in the DW. When the bulkloader commits
+  the batch on the same connection, the checkpoint is committed with it, so
+  a batch and its checkpoint are either both or neither in the DW. When the
+  job is restarted, the rows before the committed positions are not
+  inserted again (they are still read, but not looked up or inserted).
+
+  Big dimensions of the offline method: a ShelveCheckpointer syncs the
+  shelves of the big dimensions every interval rows and then writes the
+  positions and the sequence state next to the shelve. Ensuring a member is
+  idempotent, so rows that were ensured after the last checkpoint can
+  safely be ensured again when the job is restarted.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import os
+import time
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['POSITION', 'CheckpointTable', 'FactCheckpointer',
+           'ShelveCheckpointer', 'openfactcheckpoints', 'factstoload',
+           'closefactcheckpoints', 'openshelvecheckpoints', 'ensuredbefore',
+           'closeshelvecheckpoints']
+
+
+# The key of the (input, row number) of a row (see mapreader.map_csv_reader_pos)
+POSITION = '__position__'
+
+
+class CheckpointTable(object):
+    """The checkpoints of the fact tables in a table in the DW."""
+
+    def __init__(self, connection, name='etlmr_checkpoint', create=False):
+        """Arguments:
+           - connection: the ConnectionWrapper to use. It must be the one the
+             bulkloaders commit on.
+           - name: the name of the checkpoint table. Default: 'etlmr_checkpoint'
+           - create: create the table if it does not exist. This is done by
+             the driver before the tasks start. Default: False
+        """
+        self.connection = connection
+        self.name = name
+        if create:
+            self.create()
+
+    def create(self):
+        """Create the table if it does not exist."""
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS %s (job VARCHAR(255), "
+            "input VARCHAR(1024), tablename VARCHAR(255), rowoffset BIGINT, "
+            "rowsloaded BIGINT, updated VARCHAR(32))" % (self.name,))
+        self.connection.commit()
+
+    def load(self, job, input):
+        """Return a dict mapping the names of the tables to the number of
+           rows of the input whose facts are committed for the job."""
+        self.connection.execute(
+            "SELECT tablename, rowoffset FROM " + self.name +
+            " WHERE job = %(job)s AND input = %(input)s",
+            {'job' : job, 'input' : input})
+        return dict(self.connection.fetchalltuples())
+
+    def save(self, job, input, tablename, rowoffset, rowsloaded):
+        """Write a checkpoint. It is not committed."""
+        args = {'job' : job, 'input' : input, 'tablename' : tablename,
+                'rowoffset' : rowoffset, 'rowsloaded' : rowsloaded,
+                'updated' : time.strftime('%Y-%m-%d %H:%M:%S')}
+        self.connection.execute(
+            "DELETE FROM " + self.name + " WHERE job = %(job)s AND "
+            "input = %(input)s AND tablename = %(tablename)s", args)
+        self.connection.execute(
+            "INSERT INTO " + self.name + " (job, input, tablename, "
+            "rowoffset, rowsloaded, updated) VALUES (%(job)s, %(input)s, "
+            "%(tablename)s, %(rowoffset)s, %(rowsloaded)s, %(updated)s)",
+            args)
+
+    def clear(self, job):
+        """Delete and commit the deletion of the checkpoints of the job."""
+        self.connection.execute("DELETE FROM " + self.name +
+                                " WHERE job = %(job)s", {'job' : job})
+        self.connection.commit()
+
+
+class FactCheckpointer(object):
+    """Tracks the positions of the rows of a fact map task and writes
+       checkpoints of the bulk fact tables when they bulk load."""
+
+    def __init__(self, store, job, facts):
+        """Arguments:
+           - store: the CheckpointTable to use
+           - job: the name of the job, e.g., 'fact'
+           - facts: the bulk fact tables. Their beforebulkload hooks are set.
+        """
+        self.store = store
+        self.job = job
+        self.input = None
+        self.committed = {} # table name -> rows of self.input committed
+        self.pending = {} # table name -> {input : position after the row}
+        self.loaded = {} # (table name, input) -> rows inserted
+        self.skipped = 0
+        for fact in facts:
+            self.pending[fact.name] = {}
+            fact.beforebulkload = self.checkpoint
+
+    def facts(self, row, facts):
+        """Return the fact tables among the given ones that the row must be
+           inserted into, i.e., those whose checkpoint for the input of the
+           row is not after the row."""
+        (input, offset) = row[POSITION]
+        if input != self.input:
+            self.input = input
+            self.committed = self.store.load(self.job, input)
+        res = []
+        for fact in facts:
+            if offset >= self.committed.get(fact.name, 0):
+                self.pending[fact.name][input] = offset + 1
+                key = (fact.name, input)
+                self.loaded[key] = self.loaded.get(key, 0) + 1
+                res.append(fact)
+        if not res:
+            self.skipped += 1
+        return res
+
+    def checkpoint(self, fact):
+        """Write the positions of the rows in the coming bulk load of the
+           fact table. Used as the beforebulkload hook of the table."""
+        pending = self.pending.get(fact.name, {})
+        for (input, rowoffset) in pending.iteritems():
+            self.store.save(self.job, input, fact.name, rowoffset,
+                            self.loaded.get((fact.name, input), 0))
+        pending.clear()
+
+
+class ShelveCheckpointer(object):
+    """Syncs the shelves of big dimensions every interval rows and then
+       writes the positions in the inputs next to each shelve."""
+
+    def __init__(self, dimensions, interval=1000000, resume=False):
+        """Arguments:
+           - dimensions: the dimensions with open shelves (shelveddb)
+           - interval: the number of rows between the checkpoints
+           - resume: read the checkpoints of an earlier run such that rows
+             before them are not ensured again (see skip)
+        """
+        self.dimensions = dimensions
+        for dim in dimensions:
+            dim.shelveddb.onsync = lambda shelve, dim=dim: self.write(dim)
+        self.interval = interval
+        self.positions = {} # input -> position after the last row
+        self.resumed = {}
+        self.rows = 0
+        if resume:
+            for dim in dimensions:
+                checkpoint = self.__read(dim)
+                for (input, offset) in checkpoint.get('positions',
+                                                      {}).iteritems():
+                    self.resumed[input] = max(self.resumed.get(input, 0),
+                                              offset)
+
+    def __path(self, dim):
+        owned = getattr(dim.shelveddb, 'owned', None)
+        if owned:
+            # A PartitionedShelve shared by the tasks. The checkpoint is
+            # next to the partition this task writes.
+            return dim.shelveddb.pathpattern % min(owned) + '.checkpoint'
+        return dim.shelvedpath + '.checkpoint'
+
+    def __read(self, dim):
+        if not os.path.exists(self.__path(dim)):
+            return {}
+        checkpointfile = open(self.__path(dim))
+        try:
+            return json.load(checkpointfile)
+        finally:
+            checkpointfile.close()
+
+    def skip(self, row):
+        """Return True if the row was ensured before the checkpoint the job
+           resumes from. Otherwise, make a checkpoint if interval rows have
+           been counted since the last one and count the row."""
+        (input, offset) = row[POSITION]
+        if offset < self.resumed.get(input, 0):
+            return True
+        if self.rows and self.rows % self.interval == 0:
+            # The rows counted so far are ensured, but this one is not yet
+            self.checkpoint()
+        self.positions[input] = offset + 1
+        self.rows += 1
+        return False
+
+    def checkpoint(self):
+        """Sync the shelves. Their onsync hooks write the checkpoints."""
+        for dim in self.dimensions:
+            dim.shelveddb.sync()
+
+    def write(self, dim):
+        """Write the positions and the sequence state of the dimension.
+           Used as the onsync hook of its shelve."""
+        positions = dict(self.resumed)
+        positions.update(self.positions)
+        tmppath = self.__path(dim) + '.tmp'
+        checkpointfile = open(tmppath, 'w')
+        try:
+            json.dump({'positions' : positions,
+                       'seq' : getattr(dim, 'bigdimid', None),
+                       'rows' : self.rows,
+                       'updated' : time.time()}, checkpointfile)
+        finally:
+            checkpointfile.close()
+        os.rename(tmppath, self.__path(dim))
+
+
+# The checkpointers of this task (see the functions below, which are used
+# by the map functions of the ETL modules)
+_facts = None
+_shelves = None
+
+def openfactcheckpoints(params, config):
+    """Checkpoint the bulk loads of the facts of this task if
+       params.checkpoint (the name of the job) is set."""
+    global _facts
+    job = getattr(params, 'checkpoint', None)
+    if job and _facts is None:
+        store = CheckpointTable(config.connection,
+                                getattr(config, 'checkpointtable',
+                                        'etlmr_checkpoint'))
+        _facts = FactCheckpointer(store, job, config.facts.keys())
+
+def factstoload(row, facts):
+    """Return the facts the row must be inserted into."""
+    if _facts is None:
+        return facts
+    return _facts.facts(row, facts)
+
+def closefactcheckpoints():
+    """Stop checkpointing. Call it after the facts have been loaded."""
+    global _facts
+    _facts = None
+
+def openshelvecheckpoints(params, dimensions):
+    """Checkpoint the shelves of the given big dimensions of this task if
+       params.checkpoint is set. The rows ensured before the checkpoints of
+       an earlier run are skipped if params.resume is set."""
+    global _shelves
+    if getattr(params, 'checkpoint', None) and dimensions and \
+            _shelves is None:
+        _shelves = ShelveCheckpointer(dimensions,
+                                      getattr(params, 'checkpointinterval',
+                                              None) or 1000000,
+                                      getattr(params, 'resume', False))
+
+def ensuredbefore(row):
+    """Return True if the big dimensions ensured the row in the run this
+       job resumes."""
+    if _shelves is None:
+        return False
+    return _shelves.skip(row)
+
+def closeshelvecheckpoints():
+    """Write the last checkpoints of the shelves and stop checkpointing."""
+    global _shelves
+    if _shelves is not None:
+        _shelves.checkpoint()
+        _shelves = None
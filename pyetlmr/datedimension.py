@@ -0,0 +1,253 @@
+"""
+  A date dimension computed in advance for a range of dates. Each date gets
+  the key firstkey + the number of days since the first date in the range,
+  such that lookup and ensure compute the key from the date instead of
+  reading it from the DW or a cache, and the rows of the dimension are made
+  once instead of once per source row by a rowhandler.
+
+  The dimension table is filled by fill, e.g., by the driver before the
+  dimension jobs start. As the keys only depend on the dates, all mappers
+  and reducers agree on them without communicating.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from datetime import date, timedelta
+import types
+import pyetlmr
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['DateDimension', 'dateattributes']
+
+
+# The attributes a DateDimension can compute itself. Each function gets a
+# datetime.date.
+dateattributes = {
+    'date' : lambda d: d.isoformat(),
+    'day' : lambda d: d.day,
+    'month' : lambda d: d.month,
+    'year' : lambda d: d.year,
+    'week' : lambda d: d.isocalendar()[1],
+    'weekyear' : lambda d: d.isocalendar()[0],
+    'weekday' : lambda d: d.isoweekday(),
+    'dayinyear' : lambda d: d.timetuple().tm_yday,
+    'quarter' : lambda d: (d.month - 1) // 3 + 1,
+}
+
+
+class DateDimension(object):
+    """A dimension with a row for each date in a range. Does no DW lookups."""
+
+    def __init__(self, name, key, fromdate, todate, attributes,
+                 lookupatts=('date',), firstkey=1, defaultidvalue=None,
+                 rowexpander=None, targetconnection=None):
+        """Arguments:
+           - name: the name of the dimension table in the DW
+           - key: the name of the primary key in the DW
+           - fromdate: the first date of the range as a datetime.date or a
+             string of the form 'yyyy-MM-dd'
+           - todate: the last date of the range (included)
+           - attributes: a sequence of the attribute names in the dimension
+             table. The attributes in dateattributes are computed by the
+             dimension. Others must be set by the rowexpander.
+           - lookupatts: a sequence holding the name of the one attribute
+             holding the date in the rows given to lookup and ensure. The
+             values may be datetime.dates or strings of the form
+             'yyyy-MM-dd'. Default: ('date',)
+           - firstkey: the key of fromdate. Default: 1
+           - defaultidvalue: the value lookup returns for dates outside the
+             range (ensure raises a ValueError for them)
+           - rowexpander: an optional function(row, date) -> row that sets
+             the attributes not in dateattributes for the given
+             datetime.date
+           - targetconnection: The ConnectionWrapper to use. If not given,
+             the default target connection is used.
+        """
+        if type(key) not in types.StringTypes:
+            raise ValueError, "Key argument must be a string"
+        if len(lookupatts) != 1 or lookupatts[0] not in attributes:
+            raise ValueError, "lookupatts must be one of the attributes"
+        if rowexpander is None:
+            for att in attributes:
+                if att not in dateattributes:
+                    raise ValueError, "No rowexpander given for %s" % (att,)
+        if targetconnection is None:
+            targetconnection = pyetlmr.getdefaulttargetconnection()
+            if targetconnection is None:
+                raise ValueError, "No target connection available"
+        self.targetconnection = targetconnection
+        self.name = name
+        self.key = key
+        self.attributes = attributes
+        self.all = [key,]
+        self.all.extend(attributes)
+        self.lookupatts = lookupatts
+        self.fromdate = self.__todate(fromdate)
+        self.todate = self.__todate(todate)
+        if self.todate < self.fromdate:
+            raise ValueError, "todate is before fromdate"
+        self.firstkey = firstkey
+        self.defaultidvalue = defaultidvalue
+        self.rowexpander = rowexpander
+        self.ndays = (self.todate - self.fromdate).days + 1
+        self.__firstordinal = self.fromdate.toordinal()
+        self.__rows = [None] * self.ndays # Made when first needed
+
+        # This gives "INSERT INTO name(key, att1, att2, ...)
+        #             VALUES (%(key)s, %(att1)s, %(att2)s, ...)"
+        self.insertsql = "INSERT INTO " + name + "(%s, " % (key,) + \
+            ", ".join(attributes) + ") VALUES (" + \
+            ", ".join(["%%(%s)s" % (att,) for att in self.all]) + ")"
+
+    def __todate(self, value):
+        if isinstance(value, basestring):
+            return pyetlmr.ymdparser(value.strip())
+        return value
+
+    def __offset(self, row, namemapping):
+        att = self.lookupatts[0]
+        value = row[namemapping.get(att) or att]
+        if value is None:
+            return -1
+        if isinstance(value, basestring):
+            value = pyetlmr.ymdparser(value.strip()[:10])
+        return value.toordinal() - self.__firstordinal
+
+    def __makerow(self, offset):
+        row = self.__rows[offset]
+        if row is None:
+            thedate = self.fromdate + timedelta(offset)
+            row = {self.key : self.firstkey + offset}
+            for att in self.attributes:
+                func = dateattributes.get(att)
+                row[att] = func and func(thedate)
+            if self.rowexpander is not None:
+                row = self.rowexpander(row, thedate)
+            self.__rows[offset] = row
+        return row
+
+    def lookup(self, row, namemapping={}):
+        """Return the key of the date in the row or defaultidvalue if the
+           date is outside the range.
+
+           Arguments:
+           - row: a dict which must contain the lookup attribute
+           - namemapping: an optional namemapping (see module's documentation)
+        """
+        offset = self.__offset(row, namemapping)
+        if 0 <= offset < self.ndays:
+            return self.firstkey + offset
+        return self.defaultidvalue
+
+    def ensure(self, row, namemapping={}):
+        """Return the key of the date in the row and set the key in the row.
+
+           As the dimension table is filled in advance (see fill), nothing
+           is inserted. A ValueError is raised for a date outside the range
+           (or a missing date) as the dimension table has no row for it.
+
+           Arguments:
+           - row: a dict which must contain the lookup attribute
+           - namemapping: an optional namemapping (see module's documentation)
+        """
+        offset = self.__offset(row, namemapping)
+        if not 0 <= offset < self.ndays:
+            att = self.lookupatts[0]
+            raise ValueError, "%s: %r is not in the range %s to %s" % \
+                (self.name, row[namemapping.get(att) or att], self.fromdate,
+                 self.todate)
+        keyval = self.firstkey + offset
+        row[(namemapping.get(self.key) or self.key)] = keyval
+        return keyval
+
+    def getbykey(self, keyvalue):
+        """Return the row with the given key value.
+
+           If the key is outside the range, the function returns a row
+           where all values (including the key) are None.
+        """
+        if type(keyvalue) == types.DictType:
+            keyvalue = keyvalue[self.key]
+        offset = keyvalue - self.firstkey
+        if 0 <= offset < self.ndays:
+            return dict(self.__makerow(offset))
+        return dict([(att, None) for att in self.all])
+
+    def rows(self):
+        """Return a generator of the rows of all dates in the range."""
+        for offset in xrange(self.ndays):
+            yield self.__makerow(offset)
+
+    def fill(self, targetconnection=None, batchsize=1000):
+        """Insert the rows for the dates in the range that are not in the
+           dimension table yet. Return the number of rows inserted.
+
+           A ValueError is raised if a date in the range is in the table
+           with another key than the one the dimension computes.
+
+           Arguments:
+           - targetconnection: the ConnectionWrapper to use. If not given,
+             the dimension's own connection is used.
+           - batchsize: the number of rows to give to each executemany
+        """
+        if targetconnection is None:
+            targetconnection = self.targetconnection
+        dateatt = self.lookupatts[0]
+        targetconnection.execute("SELECT %s, %s FROM %s" % \
+                                     (self.key, dateatt, self.name))
+        present = set()
+        for (keyval, dateval) in targetconnection.fetchalltuples():
+            offset = self.__offset({dateatt : str(dateval)}, {})
+            if not 0 <= offset < self.ndays:
+                continue
+            if keyval != self.firstkey + offset:
+                raise ValueError, "%s has key %s for %s, expected %s" % \
+                    (self.name, keyval, dateval, self.firstkey + offset)
+            present.add(offset)
+        batch = []
+        inserted = 0
+        for offset in xrange(self.ndays):
+            if offset in present:
+                continue
+            batch.append(self.__makerow(offset))
+            if len(batch) >= batchsize:
+                targetconnection.executemany(self.insertsql, batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            targetconnection.executemany(self.insertsql, batch)
+            inserted += len(batch)
+        return inserted
+
+    def prefillcache(self, targetconnection=None):
+        """Make the rows of all dates in the range. Return their number.
+
+           The targetconnection is ignored but accepted such that the
+           dimension can be given to pyetlmr.prefill.
+        """
+        for row in self.rows():
+            pass
+        return self.ndays
+
+    def getcaches(self):
+        """Return the caches of the dimension. It has none."""
+        return []
+
+    def endload(self):
+        """Finalize the load."""
+        pass
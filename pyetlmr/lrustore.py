@@ -14,6 +14,7 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.  
 #  
 import shelve
+from caches import makecache
 __author__ = "Xiufeng Liu"
 __maintainer__ = "Xiufeng Liu"
 __version__ = '0.1.0'
@@ -190,7 +191,8 @@ class lrucache(object):
         
 SEQ = 'seq'
 class LRUWrap(object):
-    def __init__(self, store, size, readonly=False):
+    def __init__(self, store, size, readonly=False, policy='lru', 
+                 maxbytes=None):
         self.store = store
         self.dirty = set()
         self.readonly = readonly
@@ -198,7 +200,9 @@ class LRUWrap(object):
             if key in self.dirty:
                 self.store[key] = value
                 self.dirty.remove(key)
-        self.cache = lrucache(size, None if readonly else callback)
+        # The policy is any of those in caches.POLICIES
+        self.cache = makecache(policy, size, None if readonly else callback, 
+                               maxbytes)
 
     def __len__(self):
         return len(self.store)
@@ -313,10 +317,10 @@ class _SerializedShelve:
     def __getitem__(self, key):
         return self.get(key, None)
 
-    def iteritems(self):
-        for k, v in self.db.items():
+    def iteritems(self): # Reads one item at a time
+        for k in self.db.keys():
             if k != SEQ:
-                yield (k, v)        
+                yield (k, self.db[k])
         
             
     def iterkeys(self):
@@ -327,15 +331,23 @@ class _SerializedShelve:
     def iterms(self):
         return list(self.iteritems())
     
+    def sync(self):
+        self.db.sync()
+
     def close(self):
         self.db.close()
 
 
 class LRUShelve:
 
-    def __init__(self, filepath, cachesize, temp=False, readonly=False):
+    def __init__(self, filepath, cachesize, temp=False, readonly=False, 
+                 policy='lru', maxbytes=None):
         self.slowDict = _SerializedShelve(filepath, 'r' if readonly else 'c')
-        self.cacheDict = LRUWrap(self.slowDict, cachesize, readonly)
+        self.cacheDict = LRUWrap(self.slowDict, cachesize, readonly, policy, 
+                                 maxbytes)
+        # An optional function f(shelve) called after each sync, e.g., by
+        # pyetlmr.checkpoint.ShelveCheckpointer
+        self.onsync = None
 
     def get(self, key, default=None):
         try:
@@ -355,6 +367,9 @@ class LRUShelve:
     def get_nextid(self):
         return self.cacheDict.incr()
 
+    def cachestats(self):
+        return self.cacheDict.cache.stats()
+
     def iteritems(self):
         self.cacheDict.sync()
         return self.slowDict.iteritems()
@@ -368,6 +383,12 @@ class LRUShelve:
         return self.slowDict.iterms()
     
     
+    def sync(self): # Write the cached items to the shelve and it to disk
+        self.cacheDict.sync()
+        self.slowDict.sync()
+        if self.onsync is not None:
+            self.onsync(self)
+
     def __del__(self):
         self.close()
         
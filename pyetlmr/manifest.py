@@ -0,0 +1,175 @@
+"""
+  A load manifest recording which input files have been loaded such that a
+  run only processes the files that are new or have changed since they
+  were loaded (see paralleletl.py --manifest).
+
+  For each file, the manifest holds its size, modification time, SHA-1 of
+  the content, number of rows and the runs that loaded it by each load
+  step. A file whose size and modification time are as recorded is taken
+  as unchanged without reading it. Otherwise its content is hashed, such
+  that a file that was only touched or copied is not loaded again. For
+  each run, the manifest holds the load step and method, the files and the
+  row counters of its jobs (e.g., rows.pagedim and rows.read). The manifest
+  is a JSON file which is replaced atomically when a run is recorded.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import hashlib
+import json
+import os
+import time
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['Manifest', 'filestats']
+
+
+# The load steps a load step includes (see paralleletl.py --load-step)
+STEPS = {1 : ('1',), 2 : ('2',), 3 : ('1', '2')}
+
+
+def filestats(path, blocksize=1 << 20):
+    """Return a dict with the size, modification time, SHA-1 and number of
+       rows (lines except the header) of the file."""
+    st = os.stat(path)
+    sha1 = hashlib.sha1()
+    lines = 0
+    last = '\n'
+    f = open(path, 'rb')
+    try:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            sha1.update(block)
+            lines += block.count('\n')
+            last = block[-1]
+    finally:
+        f.close()
+    if last != '\n':
+        lines += 1 # The last line has no newline
+    return {'size' : st.st_size, 'mtime' : st.st_mtime,
+            'sha1' : sha1.hexdigest(), 'rows' : max(lines - 1, 0)}
+
+
+class Manifest(object):
+    """The loaded input files and the runs that loaded them."""
+
+    def __init__(self, path):
+        """Arguments:
+           - path: the path of the JSON file. It is created by the first
+             call of record if it does not exist.
+        """
+        self.path = path
+        self.files = {}
+        self.runs = []
+        if os.path.exists(path):
+            manifestfile = open(path)
+            try:
+                values = json.load(manifestfile)
+            finally:
+                manifestfile.close()
+            self.files = values.get('files', {})
+            self.runs = values.get('runs', [])
+        self.__stats = {}
+
+    def __current(self, path, entry):
+        # Return the stats of the file, reading it only if needed
+        st = os.stat(path)
+        if entry is not None and entry['size'] == st.st_size and \
+                entry['mtime'] == st.st_mtime:
+            return entry
+        stats = self.__stats.get(path)
+        if stats is None or stats['size'] != st.st_size or \
+                stats['mtime'] != st.st_mtime:
+            stats = self.__stats[path] = filestats(path)
+        return stats
+
+    def select(self, paths, loadstep):
+        """Return the paths of the given files that the load step has not
+           loaded in their current content, in the given order.
+
+           Arguments:
+           - paths: the paths of the input files
+           - loadstep: the load step (1, 2 or 3) to select the files for
+        """
+        steps = STEPS[loadstep]
+        selected = []
+        for path in paths:
+            path = os.path.abspath(path)
+            entry = self.files.get(path)
+            stats = self.__current(path, entry)
+            if entry is not None and entry['sha1'] == stats['sha1']:
+                # Only touched. Remember the new time such that the file is
+                # not read again.
+                entry['size'] = stats['size']
+                entry['mtime'] = stats['mtime']
+            elif entry is not None:
+                if entry.get('loaded'):
+                    print "%s has changed since it was loaded. Rows loaded " \
+                          "from its earlier content are not removed." % (path,)
+                entry = None
+            if entry is None or \
+                    [s for s in steps if s not in entry.get('loaded', {})]:
+                selected.append(path)
+        return selected
+
+    def record(self, paths, loadstep, loadmethod=None, counters={},
+               started=None):
+        """Record that the load step has loaded the given files and save
+           the manifest. Return the id of the run.
+
+           Arguments:
+           - paths: the paths of the files loaded
+           - loadstep: the load step (1, 2 or 3)
+           - loadmethod: the load method (1, 2 or 3), stored for information
+           - counters: the counters of the jobs of the run, e.g., the number
+             of rows per dimension
+           - started: the time the run started. Default: now
+        """
+        now = time.time()
+        runid = len(self.runs) + 1
+        paths = [os.path.abspath(p) for p in paths]
+        self.runs.append({'id' : runid, 'loadstep' : loadstep,
+                          'loadmethod' : loadmethod,
+                          'started' : started or now, 'finished' : now,
+                          'files' : len(paths),
+                          'rows' : 0, 'counters' : counters})
+        for path in paths:
+            stats = self.__current(path, self.files.get(path))
+            entry = self.files.get(path)
+            if entry is None or entry['sha1'] != stats['sha1']:
+                entry = self.files[path] = {'loaded' : {}}
+            for key in ('size', 'mtime', 'sha1', 'rows'):
+                entry[key] = stats[key]
+            for step in STEPS[loadstep]:
+                entry['loaded'][step] = runid
+            self.runs[-1]['rows'] += entry['rows']
+        self.save()
+        return runid
+
+    def save(self):
+        """Write the manifest to its file."""
+        tmppath = self.path + '.tmp'
+        manifestfile = open(tmppath, 'w')
+        try:
+            json.dump({'files' : self.files, 'runs' : self.runs},
+                      manifestfile, sort_keys=True)
+        finally:
+            manifestfile.close()
+        os.rename(tmppath, self.path)
@@ -31,11 +31,20 @@ def map_csv_reader_re(fd, content_len, fname):
 		yield dict(zip(fieldnames, line.split('\t')))
 
 def map_csv_reader_bkey(fd, content_len, fname, params):
+	'''Read the rows whose key is in the partition of this map task. The
+	   key is the values of params.partitionatts (default: url) and is
+	   partitioned by pyetlmr.partitioning.partitionof with the seed
+	   params.partitionseed and params.consistentpartitioning.'''
 	from csv import DictReader
+	from partitioning import partitionof
 	rows = DictReader(fd, delimiter='\t')  
 	nr_maps = params.nr_maps
+	atts = getattr(params, 'partitionatts', None) or ('url',)
+	seed = getattr(params, 'partitionseed', 0) or 0
+	consistent = getattr(params, 'consistentpartitioning', False)
+	partition = this_partition()
 	for row in rows:
-		if hash(row['url'])%nr_maps==this_partition():
+		if partitionof(tuple([row[att] for att in atts]), nr_maps, seed, consistent)==partition:
 			yield row
 
 def map_csv_reader(fd, content_len, fname):
@@ -44,6 +53,15 @@ def map_csv_reader(fd, content_len, fname):
 	for row in rows:
 		yield row
 
+def map_csv_reader_pos(fd, content_len, fname):
+	'''Like map_csv_reader, but sets the field __position__ of each row to
+	   the input and the number of the row in it (see pyetlmr.checkpoint).'''
+	from csv import DictReader
+	rows = DictReader(fd, delimiter='\t')
+	for (i, row) in enumerate(rows):
+		row['__position__'] = (fname, i)
+		yield row
+
 def map_socket_reader(fd, content_len, fname):
 	import socket    
 	lsnr = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -0,0 +1,271 @@
+"""
+  Counters and histograms for finding where the time of a load goes.
+
+  Each worker records into the module's Metrics instance (see getmetrics)
+  by means of incr, observe and timed, e.g., the rows read, the latency of
+  the lookups and ensures per dimension, the bytes and seconds of the bulk
+  loads and the bytes shuffled between the map and the reduce phase. When a
+  task is done, the metrics are added to its output under the key METRICSKEY
+  and the driver merges the metrics of all tasks of a job into one report.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import resource
+import time
+from contextlib import contextmanager
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['METRICSKEY', 'Histogram', 'Metrics', 'getmetrics', 'incr',
+           'observe', 'timed', 'recordcaches', 'recordbulkloads',
+           'recordmemory']
+
+
+# The key under which the tasks return their metrics in the job results
+METRICSKEY = '__metrics__'
+
+
+class Histogram(object):
+    """Counts observed values (e.g., seconds) in buckets whose upper bounds
+       grow by powers of two from one microsecond."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = {} # the exponent of the upper bound -> count
+
+    def add(self, value):
+        """Count the value."""
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        bound = 0
+        upper = 1e-6
+        while value > upper and bound < 40:
+            bound += 1
+            upper *= 2
+        self.buckets[bound] = self.buckets.get(bound, 0) + 1
+
+    def merge(self, other):
+        """Add the values counted by another Histogram."""
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        for (bound, count) in other.buckets.iteritems():
+            self.buckets[bound] = self.buckets.get(bound, 0) + count
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket holding the p'th percentile
+           (0 < p <= 100) or None if nothing is counted."""
+        if not self.count:
+            return None
+        wanted = self.count * p / 100.0
+        seen = 0
+        for bound in sorted(self.buckets):
+            seen += self.buckets[bound]
+            if seen >= wanted:
+                return min(1e-6 * 2 ** bound, self.max)
+        return self.max
+
+    def todict(self):
+        return {'count' : self.count, 'total' : self.total,
+                'min' : self.min, 'max' : self.max,
+                'mean' : self.count and self.total / self.count or None,
+                'p50' : self.percentile(50), 'p99' : self.percentile(99),
+                'buckets' : dict([(str(b), c) for (b, c) in
+                                  self.buckets.iteritems()])}
+
+    @staticmethod
+    def fromdict(values):
+        res = Histogram()
+        res.count = values['count']
+        res.total = values['total']
+        res.min = values['min']
+        res.max = values['max']
+        res.buckets = dict([(int(b), c) for (b, c) in
+                            values['buckets'].iteritems()])
+        return res
+
+
+class Metrics(object):
+    """Named counters and histograms. Names are dotted such as
+       'ensure.pagedim' or 'bulkload.testresultsfact.bytes'."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.starttime = time.time()
+        self.__lastprogress = self.starttime
+
+    def incr(self, name, n=1):
+        """Add n to the named counter."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        """Count the value in the named histogram."""
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram()
+        hist.add(value)
+
+    @contextmanager
+    def timed(self, name):
+        """Count the seconds spent in a with block in the named histogram."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+    def merge(self, other):
+        """Add the counters and histograms of another Metrics."""
+        for (name, n) in other.counters.iteritems():
+            self.incr(name, n)
+        for (name, hist) in other.histograms.iteritems():
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].merge(hist)
+        self.starttime = min(self.starttime, other.starttime)
+
+    def clear(self):
+        """Forget all counters and histograms."""
+        self.counters.clear()
+        self.histograms.clear()
+        self.starttime = time.time()
+        self.__lastprogress = self.starttime
+
+    def todict(self):
+        return {'seconds' : time.time() - self.starttime,
+                'counters' : dict(self.counters),
+                'histograms' : dict([(name, hist.todict()) for (name, hist)
+                                     in self.histograms.iteritems()])}
+
+    def tojson(self):
+        """Return the metrics as a JSON string (see fromjson)."""
+        res = self.todict()
+        res['starttime'] = self.starttime
+        return json.dumps(res)
+
+    @staticmethod
+    def fromjson(jsonstr):
+        values = json.loads(jsonstr)
+        res = Metrics()
+        res.counters = values['counters']
+        res.histograms = dict([(name, Histogram.fromdict(hist)) for
+                               (name, hist) in values['histograms'].iteritems()])
+        res.starttime = values.get('starttime', res.starttime)
+        return res
+
+    def report(self, path=None):
+        """Write the metrics as indented JSON to the given path or return
+           them as such a string if no path is given."""
+        res = json.dumps(self.todict(), indent=2, sort_keys=True)
+        if path is None:
+            return res
+        reportfile = open(path, 'w')
+        try:
+            reportfile.write(res)
+        finally:
+            reportfile.close()
+
+    def progressline(self):
+        """Return a line with the counters and their rates per second. The
+           counters of pyetlmr.profiling (profile.*) are left out as there
+           may be very many of them."""
+        seconds = max(time.time() - self.starttime, 1e-6)
+        return "%.0fs: " % (seconds,) + ", ".join(
+            ["%s=%d (%.1f/s)" % (name, n, n / seconds)
+             for (name, n) in sorted(self.counters.iteritems())
+             if not name.startswith('profile.')])
+
+    def progress(self, report, interval=60):
+        """Call report(progressline()) if interval seconds have passed since
+           the last call of report."""
+        now = time.time()
+        if now - self.__lastprogress >= interval:
+            self.__lastprogress = now
+            report(self.progressline())
+
+
+_metrics = Metrics()
+
+def getmetrics():
+    """Return the Metrics instance of this process."""
+    return _metrics
+
+def incr(name, n=1):
+    """Add n to the named counter of this process (see Metrics.incr)."""
+    _metrics.incr(name, n)
+
+def observe(name, value):
+    """Count the value in the named histogram of this process."""
+    _metrics.observe(name, value)
+
+def timed(name):
+    """Time a with block in the named histogram of this process."""
+    return _metrics.timed(name)
+
+def recordcaches(dimensions):
+    """Add the hits and misses of the caches of the given dimensions (see
+       their cachestats methods) to the counters of this process."""
+    for dim in dimensions:
+        levels = getattr(dim, 'levels', None)
+        if levels:
+            # A SnowflakedDimension. Record its participating dimensions.
+            for dims in levels.values():
+                recordcaches(dims)
+            continue
+        cachestats = getattr(dim, 'cachestats', None)
+        if not callable(cachestats):
+            continue
+        for (cachename, stats) in cachestats().iteritems():
+            for counter in ('hits', 'misses', 'evictions'):
+                if counter in stats:
+                    _metrics.incr("cache.%s.%s.%s" % (dim.name, cachename,
+                                                       counter),
+                                  stats[counter])
+
+def recordbulkloads(tables):
+    """Add the number, bytes and seconds of the bulk loads of the given
+       tables (e.g., BulkFactTable) to the counters of this process."""
+    for table in tables:
+        if hasattr(table, 'bulkloads'):
+            for (att, counter) in (('bulkloads', 'count'),
+                                   ('bulkloadbytes', 'bytes'),
+                                   ('bulkloadseconds', 'seconds')):
+                _metrics.incr("bulkload.%s.%s" % (table.name, counter),
+                              getattr(table, att))
+
+def recordmemory():
+    """Count the peak resident memory of this process in megabytes in the
+       histogram 'memory.maxrss.mb' such that the merged metrics of a job
+       hold the largest and the mean peak of its tasks."""
+    # ru_maxrss is in kilobytes on Linux
+    _metrics.observe('memory.maxrss.mb',
+                     resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
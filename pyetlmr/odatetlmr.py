@@ -18,8 +18,16 @@
 
 import datetime, time, sys, os, getopt, tempfile
 from disco.core import result_iterator, Params
-from disco.func import re_reader, default_partition, msg
+from disco.func import re_reader, msg
 from mapreader import map_csv_reader
+from caches import budgetfor
+from metrics import getmetrics, recordcaches, recordbulkloads, recordmemory, \
+     METRICSKEY
+from profiling import instrument, SamplingProfiler
+from spool import openspool, spoolrow, closespool
+from partitioning import partition_func
+from checkpoint import openfactcheckpoints, factstoload, \
+	closefactcheckpoints
 
 __author__ = "Xiufeng Liu"
 __maintainer__ = "Xiufeng Liu"
@@ -27,42 +35,138 @@ __version__ = '0.1.0'
 
 map_reader = map_csv_reader
 
+_cachebudget = None
+_pending = {} # dimension -> [row, ...] waiting for ensuremany
+_metrics = getmetrics()
+_sampler = SamplingProfiler(_metrics)
+
+def _budgetcaches(dimensions):
+	'''
+	Split config.cachememory bytes between the caches of the dimensions
+	'''
+	global _cachebudget
+	cachememory = getattr(config, 'cachememory', None)
+	if cachememory:
+		_cachebudget = budgetfor(dimensions, cachememory)
+
+def _tickbudget():
+	if _cachebudget is not None:
+		_cachebudget.tick()
+
+def _progress():
+	'''
+	Report the counters of the task every config.progressinterval seconds
+	'''
+	_metrics.progress(msg, getattr(config, 'progressinterval', 60))
+
+def _profile():
+	'''
+	Profile the UDFs and tables of the config if config.profileudfs (time
+	every n'th call) or config.profilesampling (seconds between samples) is set
+	'''
+	every = getattr(config, 'profileudfs', 0)
+	if every:
+		instrument(config, _metrics, every)
+	interval = getattr(config, 'profilesampling', 0)
+	if interval:
+		_sampler.interval = interval
+		_sampler.start()
+
+def _metricsresult(tables):
+	'''
+	Return the metrics of the task as a result pair for the driver
+	'''
+	_sampler.stop()
+	recordcaches(tables)
+	recordbulkloads(tables)
+	recordmemory()
+	return (METRICSKEY, _metrics.tojson())
+
+def _ensuremany(dimension, rows, namemapping):
+	start = time.time()
+	dimension.ensuremany(rows, namemapping)
+	_metrics.observe('ensuremany.%s' % dimension.name, time.time()-start)
+
+def _ensurelater(dimension, row, namemapping):
+	'''
+	Collect the row for the next ensuremany of the dimension
+	'''
+	rows = _pending.setdefault(dimension, [])
+	rows.append(dict(row))
+	if len(rows) >= getattr(config, 'ensurebatchsize', 1000):
+		_ensuremany(dimension, rows, namemapping)
+		del rows[:]
+
+def _ensurepending():
+	for dimension, rows in _pending.items():
+		if rows:
+			namemapping = config.dimensions[dimension].get('namemappings',{})
+			_ensuremany(dimension, rows, namemapping)
+	_pending.clear()
+
 def dim_map_init(row, params):
-	pass
+	_metrics.clear()
+	_profile()
+	_budgetcaches(config.dimensions.keys())
+	openspool(params, config, this_partition())
 	#if config.connection and config.connection.isclose():
 	#	config.connection = config.UDF_createConnection()
 
 def dim_map_func(row, params):
 	dimensions = [dim for dim in config.dimensions.keys()]
+	_metrics.incr('rows.read')
+	spoolrow(row) # Before the rowhandlers change the row
 	for dimension in dimensions:
+		_metrics.incr('rows.%s' % dimension.name)
 		rowhandlers = config.dimensions[dimension].get('rowhandlers',[])
 		namemapping = config.dimensions[dimension].get('namemappings',{})
 		if rowhandlers:
 			for handler in rowhandlers:
 				handler(row, namemapping)
-		dimension.ensure(row, namemapping)
+		if hasattr(dimension, 'ensuremany'):
+			# Snowflaked dimensions are ensured a block of rows at a time
+			_ensurelater(dimension, row, namemapping)
+		else:
+			start = time.time()
+			dimension.ensure(row, namemapping)
+			_metrics.observe('ensure.%s' % dimension.name, time.time()-start)
+	_tickbudget()
+	_progress()
 	return []
 
-dim_partition_func = default_partition
+dim_partition_func = partition_func
 
 def dim_combiner_func(table, rows, tab_rows, done, params):
 	if done:
+		closespool()
+		_ensurepending()
 		dimensions = [dim for dim in config.dimensions.keys()]
 		for dimension in dimensions:	
 			dimension.endload()
 		config.connection.close()
+		return [_metricsresult(dimensions)]
 
 def dim_reduce_func(iter, out, params):
-	pass
+	# Only the metrics of the map tasks are passed on to the driver
+	for key, value in iter:
+		if key == METRICSKEY:
+			out.add(key, value)
 
 # ----------------------------------------------------------------------
 #         Fact table                                                            #
 # ----------------------------------------------------------------------
 def fact_map_init(row, params):
-	pass
+	_metrics.clear()
+	_profile()
+	_budgetcaches(config.dimensions.keys())
+	openfactcheckpoints(params, config)
 
 def fact_map_func(row, params):
-	facts = config.facts.keys()
+	# The facts whose checkpoints are not after the row (all without them)
+	facts = factstoload(row, config.facts.keys())
+	_metrics.incr('rows.read')
+	if not facts:
+		_metrics.incr('rows.skipped')
 	for fact in facts:
 		refereddims = config.facts[fact].get('refdims',[])
 		namemappings = config.facts[fact].get('namemappings', {})
@@ -70,11 +174,17 @@ def fact_map_func(row, params):
 		for handler in rowhandlers:
 			handler(row)
 		for dim in refereddims:
+			start = time.time()
 			row[dim.key] = dim.lookup(row, namemappings)
+			_metrics.observe('lookup.%s' % dim.name, time.time()-start)
 
 		start = time.time()
 		fact.insert(row)
-		params.totalcopytime += time.time()-start
+		elapsed = time.time()-start
+		params.totalcopytime += elapsed
+		_metrics.observe('insert.%s' % fact.name, elapsed)
+	_tickbudget()
+	_progress()
 	return []
 
 def fact_combiner_func(key, value, comb_buffer, done, params):
@@ -83,6 +193,8 @@ def fact_combiner_func(key, value, comb_buffer, done, params):
 		for fact in facts:	
 			fact.endload()
 		config.connection.commit()
+		closefactcheckpoints()
+		return [_metricsresult(facts + [dim for fact in facts for dim in config.facts[fact].get('refdims',[])])]
 
 def golive(config, shelvedb_paths=[]):
 	pass
\ No newline at end of file
@@ -28,8 +28,16 @@
 #
 import datetime, time, sys, os, getopt, tempfile
 from disco.core import Disco, result_iterator, Params
-from disco.func import default_partition
 from mapreader import map_csv_reader
+from disco.util import msg
+from caches import budgetfor
+from metrics import getmetrics, recordcaches, recordbulkloads, recordmemory, \
+     METRICSKEY
+from profiling import instrument, SamplingProfiler
+from spool import openspool, spoolrow, closespool
+from partitioning import partition_func
+from checkpoint import openfactcheckpoints, factstoload, \
+	closefactcheckpoints
 
 __author__ = "Xiufeng Liu"
 __maintainer__ = "Xiufeng Liu"
@@ -39,21 +47,72 @@ __version__ = '0.1.0'
 
 map_reader = map_csv_reader
 
+_cachebudget = None
+_metrics = getmetrics()
+_sampler = SamplingProfiler(_metrics)
+
+def _budgetcaches(dimensions):
+	'''
+	Split config.cachememory bytes between the caches of the dimensions
+	'''
+	global _cachebudget
+	cachememory = getattr(config, 'cachememory', None)
+	if cachememory:
+		_cachebudget = budgetfor(dimensions, cachememory)
+
+def _tickbudget():
+	if _cachebudget is not None:
+		_cachebudget.tick()
+
+def _progress():
+	'''
+	Report the counters of the task every config.progressinterval seconds
+	'''
+	_metrics.progress(msg, getattr(config, 'progressinterval', 60))
+
+def _profile():
+	'''
+	Profile the UDFs and tables of the config if config.profileudfs (time
+	every n'th call) or config.profilesampling (seconds between samples) is set
+	'''
+	every = getattr(config, 'profileudfs', 0)
+	if every:
+		instrument(config, _metrics, every)
+	interval = getattr(config, 'profilesampling', 0)
+	if interval:
+		_sampler.interval = interval
+		_sampler.start()
+
+def _metricsresult(tables):
+	'''
+	Return the metrics of the task as a result pair for the driver
+	'''
+	_sampler.stop()
+	recordcaches(tables)
+	recordbulkloads(tables)
+	recordmemory()
+	return (METRICSKEY, _metrics.tojson())
+
 def dim_map_init(row, params):
-	pass
+	_metrics.clear()
+	_profile()
+	openspool(params, config, this_partition())
 
 
 def dim_map_func(row, params):
 	dimnames = eval(params.dimnames)
 	dimensions = [dim for dim in config.dimensions.keys() if dim.name in dimnames]
 	dim_row = []
+	_metrics.incr('rows.read')
+	spoolrow(row)
 	for dimension in dimensions:
 		srcfields = config.dimensions[dimension].get('srcfields',[])
 		nrow = dict([(field, row[field]) for field in srcfields if row.has_key(field)])
 		dim_row.append((dimension.name, repr(nrow)))
+	_progress()
 	return dim_row
 
-dim_partition_func = default_partition
+dim_partition_func = partition_func
 
 def dim_combiner_func(name, row, comb_buffer, done, params):
 	if params.count>=50000:
@@ -66,6 +125,9 @@ def dim_combiner_func(name, row, comb_buffer, done, params):
 		if params.count>=50000:
 			return comb_buffer.iteritems()
 	if done:
+		closespool()
+		(key, value) = _metricsresult([])
+		comb_buffer[key] = value
 		return comb_buffer.iteritems()
 
 
@@ -78,7 +140,15 @@ def dim_reduce_func(iter, out, params):
 		if isinstance(refdims, pyetlmr.odottables.Dimension):
 			refdims = (refdims, )
 		refdimdict[dim] = refdims	
+	_budgetcaches(config.dimensions.keys())
+	_metrics.clear()
+	_profile()
 	for name, par_rows in iter:
+		if name == METRICSKEY:
+			# The metrics of a map task
+			out.add(name, par_rows)
+			continue
+		_metrics.incr('shuffle.bytes', len(par_rows))
 		rows = eval(par_rows)
 		dimension = dimdict.get(name)
 		refdims = refdimdict.get(dimension, [])
@@ -91,9 +161,18 @@ def dim_reduce_func(iter, out, params):
 			for refdim in refdims:
 				refnamemapping = config.dimensions[refdim].get('namemappings',{})
 				row[refdim.key] = refdim.lookup(row, refnamemapping)
+			start = time.time()
 			dimension.ensure(row, namemapping)
-
+			_metrics.observe('ensure.%s' % name, time.time()-start)
+			_metrics.incr('rows.%s' % name)
+			_tickbudget()
+			_progress()
+
+	# Apply the changes that bulk dimensions may have collected
+	for dimension in dimdict.values():
+		dimension.endload()
 	config.connection.commit()
+	out.add(*_metricsresult(dimdict.values()))
 
 
 
@@ -101,10 +180,17 @@ def dim_reduce_func(iter, out, params):
 #         Fact table                                                            #
 # ----------------------------------------------------------------------
 def fact_map_init(row, params):
-	pass
+	_metrics.clear()
+	_profile()
+	_budgetcaches(config.dimensions.keys())
+	openfactcheckpoints(params, config)
 
 def fact_map_func(row, params):
-	facts = config.facts.keys()
+	# The facts whose checkpoints are not after the row (all without them)
+	facts = factstoload(row, config.facts.keys())
+	_metrics.incr('rows.read')
+	if not facts:
+		_metrics.incr('rows.skipped')
 	for fact in facts:
 		refereddims = config.facts[fact].get('refdims',[])
 		namemappings = config.facts[fact].get('namemappings', {})
@@ -112,11 +198,17 @@ def fact_map_func(row, params):
 		for handler in rowhandlers:
 			handler(row)
 		for dim in refereddims:
+			start = time.time()
 			row[dim.key] = dim.lookup(row, namemappings)
+			_metrics.observe('lookup.%s' % dim.name, time.time()-start)
 
 		start = time.time()
 		fact.insert(row)
-		params.totalcopytime += time.time()-start
+		elapsed = time.time()-start
+		params.totalcopytime += elapsed
+		_metrics.observe('insert.%s' % fact.name, elapsed)
+	_tickbudget()
+	_progress()
 	return []
 
 def fact_combiner_func(key, value, comb_buffer, done, params):
@@ -125,6 +217,8 @@ def fact_combiner_func(key, value, comb_buffer, done, params):
 		for fact in facts:	
 			fact.endload()
 		config.connection.commit()
+		closefactcheckpoints()
+		return [_metricsresult(facts + [dim for fact in facts for dim in config.facts[fact].get('refdims',[])])]
 
 def golive(config, shelvedb_paths=[]):
 	pass
\ No newline at end of file
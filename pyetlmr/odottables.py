@@ -18,26 +18,36 @@
 #  
 
 from subprocess import Popen, PIPE
-from time import sleep
+from time import sleep, time
 import types, tempfile
 from disco.util import msg
 import pyetlmr
-from pyetlmr.FIFODict import FIFODict
+from pyetlmr.caches import makecache, KeyIndex
+from pyetlmr.bloom import BloomFilter, memberkey
+from pyetlmr.versionindex import VersionIndex
 
 __author__ = "Xiufeng Liu"
 __maintainer__ = "Xiufeng Liu"
 __version__ = '0.1.0'
 
 __all__ = ['Dimension', 'CachedDimension', 'SlowlyChangingDimension',
-           'SnowflakedDimension', 'FactTable', 'BatchFactTable',
+           'BulkSlowlyChangingDimension', 'SnowflakedDimension',
+           'FactTable', 'BatchFactTable',
            'BulkFactTable', 'SubprocessFactTable']
 
+def _allstrings(values):
+    for value in values:
+        if value is not None and not isinstance(value, basestring):
+            return False
+    return True
+
+
 class Dimension(object):
     """A class for accessing a dimension. Does no caching."""
 
     def __init__(self, name, key, attributes, lookupatts=(), 
                  idfinder=None, defaultidvalue=None, rowexpander=None,
-                targetconnection=None):
+                targetconnection=None, bloomcapacity=0, negcachesize=0):
         """Arguments:
            - name: the name of the dimension table in the DW
            - key: the name of the primary key in the DW
@@ -66,6 +76,25 @@ class Dimension(object):
              done.
            - targetconnection: The ConnectionWrapper to use. If not given,
              the default target connection is used.
+           - bloomcapacity: if greater than 0, a Bloom filter for this
+             number of members is filled with the lookup values of all
+             members in the dimension table when it is first needed and
+             kept up to date on inserts and updates. lookup then only
+             queries the DW for members that may exist. The filter compares
+             the text forms of the values read from the DW with those of the
+             source values, which only agree for strings (e.g., not for 5.0
+             and '5' or for a timestamp and 'yyyy-MM-dd'). It is thus only
+             used for lookup attributes of string types: it is dropped when
+             the DW gives another type, and rows with values of other types
+             are looked up in the DW. Default: 0
+           - negcachesize: if greater than 0, the maximum number of lookup
+             values for which lookup found no member and that are
+             remembered such that the DW is not queried again. Default: 0
+
+           The lookup values are compared by their text form (see
+           pyetlmr.bloom). The Bloom filter and the negative cache assume
+           that no other process adds members while they are used, which
+           holds for ODOT where one task loads each dimension.
         """
         if not type(key) in types.StringTypes:
             raise ValueError, "Key argument must be a string"
@@ -87,6 +116,15 @@ class Dimension(object):
         self.lookupatts = lookupatts
         self.defaultidvalue = defaultidvalue
         self.rowexpander = rowexpander
+        # The Bloom filter and the negative cache let lookup skip the DW
+        # for members that are known to be absent
+        self.bloomfilter = None
+        self.bloomfilled = False
+        if bloomcapacity > 0:
+            self.bloomfilter = BloomFilter(bloomcapacity)
+        self.negcache = None
+        if negcachesize > 0:
+            self.negcache = makecache('fifo', negcachesize)
         pyetlmr._alltables.append(self)
 
         # Now create the SQL that we will need...
@@ -128,16 +166,175 @@ class Dimension(object):
         key = self._before_lookup(row, namemapping)
         if key is not None:
             return key
+        if self.__isabsent(row, namemapping):
+            return self.defaultidvalue
         
         self.targetconnection.execute(self.keylookupsql, row, namemapping)
         
         keyvalue = self.targetconnection.fetchonetuple()[0]
         if keyvalue is None:
+            self.__markabsent(row, namemapping)
             keyvalue = self.defaultidvalue  # most likely also None...
 
         self._after_lookup(row, namemapping, keyvalue)
         return keyvalue
 
+    def lookupmany(self, rows, namemapping={}, batchsize=500):
+        """Find the keys for several rows at once. Return a list holding the
+           key value (or defaultidvalue) for each row.
+
+           Each member is only looked up once. The members that are not
+           found by _before_lookup (e.g., in a cache) are read from the
+           dimension table by one query per batchsize members.
+
+           Arguments:
+           - rows: a sequence of dicts which must contain at least the
+             lookup attributes
+           - namemapping: an optional namemapping (see module's documentation)
+           - batchsize: the number of members to look up per query.
+             Default: 500
+        """
+        namesinrow = [(namemapping.get(a) or a) for a in self.lookupatts]
+        members = {} # searchtuple -> the first row with the member
+        searchtuples = []
+        for row in rows:
+            searchtuple = tuple([row[n] for n in namesinrow])
+            members.setdefault(searchtuple, row)
+            searchtuples.append(searchtuple)
+        keys = {}
+        missing = []
+        for (searchtuple, row) in members.iteritems():
+            key = self._before_lookup(row, namemapping)
+            if key is not None:
+                keys[searchtuple] = key
+            elif self.__isabsent(row, namemapping):
+                keys[searchtuple] = self.defaultidvalue
+            else:
+                missing.append(searchtuple)
+        for start in xrange(0, len(missing), batchsize):
+            batch = missing[start:start + batchsize]
+            found = self.__lookupbatch(batch)
+            for searchtuple in batch:
+                row = members[searchtuple]
+                keyvalue = found.get(searchtuple)
+                if keyvalue is None:
+                    self.__markabsent(row, namemapping)
+                    keyvalue = self.defaultidvalue
+                self._after_lookup(row, namemapping, keyvalue)
+                keys[searchtuple] = keyvalue
+        return [keys[searchtuple] for searchtuple in searchtuples]
+
+    def __lookupbatch(self, searchtuples):
+        # This gives "SELECT key, lookupatt1, ... FROM name WHERE
+        #             (lookupatt1 = %(v0_0)s AND ...) OR (...) OR ..."
+        # and returns a dict from the given search tuples to the keys found.
+        # The values read from the DW may be of other types than those in
+        # the search tuples (e.g., u'5' and 5), so both are matched by
+        # their memberkey.
+        arguments = {}
+        conditions = []
+        for (i, searchtuple) in enumerate(searchtuples):
+            condition = []
+            for (j, att) in enumerate(self.lookupatts):
+                argname = "v%d_%d" % (i, j)
+                arguments[argname] = searchtuple[j]
+                condition.append("%s = %%(%s)s" % (att, argname))
+            conditions.append("(" + " AND ".join(condition) + ")")
+        self.targetconnection.execute("SELECT %s, %s FROM %s WHERE %s" % \
+                                          (self.key, ", ".join(self.lookupatts),
+                                           self.name, " OR ".join(conditions)),
+                                      arguments)
+        found = dict([(memberkey(rawrow[1:]), rawrow[0]) for rawrow in \
+                          self.targetconnection.fetchalltuples()])
+        res = {}
+        for searchtuple in searchtuples:
+            keyvalue = found.get(memberkey(searchtuple))
+            if keyvalue is not None:
+                res[searchtuple] = keyvalue
+        return res
+
+    def fillbloomfilter(self, targetconnection=None):
+        """Fill the Bloom filter with the lookup values of all members in
+           the dimension table. Return the number of members. If a lookup
+           value is not a string, the filter is dropped and 0 is returned.
+
+           Arguments:
+           - targetconnection: the ConnectionWrapper to read the members
+             with. If not given, the dimension's own connection is used.
+        """
+        if self.bloomfilter is None:
+            return 0
+        if targetconnection is None:
+            targetconnection = self.targetconnection
+        targetconnection.execute("SELECT %s FROM %s" % \
+                                     (", ".join(self.lookupatts), self.name))
+        rawrows = targetconnection.fetchalltuples()
+        self.bloomfilter.clear()
+        for rawrow in rawrows:
+            if not _allstrings(rawrow):
+                # Its text form may differ from that of the source values
+                self.bloomfilter = None
+                self.bloomfilled = False
+                return 0
+            self.bloomfilter.add(memberkey(rawrow))
+        self.bloomfilled = True
+        return len(rawrows)
+
+    def __memberkey(self, row, namemapping):
+        try:
+            return memberkey([row[namemapping.get(a) or a] \
+                                  for a in self.lookupatts])
+        except KeyError:
+            return None
+
+    def __isabsent(self, row, namemapping):
+        if self.bloomfilter is None and self.negcache is None:
+            return False
+        mkey = self.__memberkey(row, namemapping)
+        if mkey is None:
+            return False
+        if self.bloomfilter is not None and not self.bloomfilled:
+            self.fillbloomfilter()
+        if self.bloomfilter is not None and mkey not in self.bloomfilter and \
+                _allstrings([row[namemapping.get(a) or a] \
+                                 for a in self.lookupatts]):
+            return True
+        return self.negcache is not None and mkey in self.negcache
+
+    def __markabsent(self, row, namemapping):
+        if self.negcache is not None:
+            mkey = self.__memberkey(row, namemapping)
+            if mkey is not None:
+                self.negcache[mkey] = True
+
+    def __storedmemberkey(self, row, namemapping):
+        keyval = row.get(namemapping.get(self.key) or self.key)
+        if keyval is None:
+            return None
+        self.targetconnection.execute("SELECT %s FROM %s WHERE %s = %%(key)s" \
+                                          % (", ".join(self.lookupatts),
+                                             self.name, self.key),
+                                      {'key' : keyval})
+        rawrow = self.targetconnection.fetchonetuple()
+        if not rawrow:
+            return None
+        return memberkey(rawrow)
+
+    def _markpresent(self, row, namemapping):
+        if self.bloomfilter is None and self.negcache is None:
+            return
+        mkey = self.__memberkey(row, namemapping)
+        if mkey is None:
+            # Only some of the lookup values are known (an update). The
+            # others are read from the updated member.
+            mkey = self.__storedmemberkey(row, namemapping)
+            if mkey is None:
+                return
+        if self.bloomfilter is not None and self.bloomfilled:
+            self.bloomfilter.add(mkey)
+        if self.negcache is not None and mkey in self.negcache:
+            del self.negcache[mkey]
+
 
     def _before_lookup(self, row, namemapping):
         return None
@@ -223,6 +420,10 @@ class Dimension(object):
             ", ".join(["%s = %%(%s)s" % (att, att) for att in attstouse]) + \
             " WHERE %s = %%(%s)s" % (self.key, self.key)
         self.targetconnection.execute(sql, row, namemapping)
+        for att in self.lookupatts:
+            if att in row or att in namemapping:
+                self._markpresent(row, namemapping)
+                break
         self._after_update(row, namemapping)
 
     def _before_update(self, row, namemapping):
@@ -276,6 +477,7 @@ class Dimension(object):
         #    row[refdim.key] = refdim.ensure(row, refdim.namemapping)
             
         self.targetconnection.execute(self.insertsql, row, namemapping)
+        self._markpresent(row, namemapping)
         if keyadded:
             del row[key]
 
@@ -283,6 +485,38 @@ class Dimension(object):
         self._after_insert(row, namemapping, keyval)
         return keyval
 
+    def insertmany(self, rows, namemapping={}):
+        """Insert several rows by one executemany. Return a list of their
+           new key values.
+
+           Arguments:
+           - rows: a sequence of rows to insert. The dicts are not updated.
+             Each must contain all attributes.
+           - namemapping: an optional namemapping (see module's documentation)
+        """
+        key = (namemapping.get(self.key) or self.key)
+        keyvals = []
+        toinsert = []
+        for row in rows:
+            res = self._before_insert(row, namemapping)
+            if res:
+                keyvals.append(res)
+                continue
+            keyval = row.get(key)
+            if keyval is None:
+                keyval = self.idfinder(row, namemapping)
+            dbrow = pyetlmr.project(self.attributes, row, namemapping)
+            dbrow[self.key] = keyval
+            keyvals.append(keyval)
+            toinsert.append((row, dbrow))
+        if toinsert:
+            self.targetconnection.executemany(self.insertsql,
+                                              [d for (r, d) in toinsert])
+        for (row, dbrow) in toinsert:
+            self._markpresent(row, namemapping)
+            self._after_insert(row, namemapping, dbrow[self.key])
+        return keyvals
+
     def _before_insert(self, row, namemapping):
         return None
 
@@ -311,7 +545,8 @@ class CachedDimension(Dimension):
     def __init__(self, name, key, attributes, lookupatts=(), 
                  idfinder=None, defaultidvalue=None, rowexpander=None,
                  size=10000, prefill=False, cachefullrows=False,
-                 cacheoninsert=True, targetconnection=None):
+                 cacheoninsert=True, targetconnection=None, cachepolicy='fifo',
+                 cachememory=None, bloomcapacity=0, negcachesize=0):
         """Arguments:
            - name: the name of the dimension table in the DW
            - key: the name of the primary key in the DW
@@ -349,41 +584,103 @@ class CachedDimension(Dimension):
              when insertions are done. Default: True
            - targetconnection: The ConnectionWrapper to use. If not given,
              the default target connection is used.
+           - cachepolicy: the replacement policy of the caches when size is
+             greater than 0: 'fifo', 'lru', 'clock' or 'arc' (see
+             pyetlmr.caches). Default: 'fifo'
+           - cachememory: an optional number of bytes the caches may use. 
+             The caches are then bounded by the approximate size of the 
+             cached rows, and by size only if size is greater than 0.
+             Default: None
+           - bloomcapacity: see Dimension. Default: 0
+           - negcachesize: see Dimension. Default: 0
         """
 
         Dimension.__init__(self, name, key, attributes, lookupatts, idfinder, 
-                           defaultidvalue, rowexpander, targetconnection)
+                           defaultidvalue, rowexpander, targetconnection,
+                           bloomcapacity, negcachesize)
         self.cacheoninsert = cacheoninsert
-        if size > 0:
+        if size > 0 or cachememory:
+            maxentries = None
+            if size > 0:
+                maxentries = size
+            maxbytes = None
+            if cachememory:
+                # Split the memory between the caches
+                maxbytes = cachememory / (cachefullrows and 2 or 1)
             if cachefullrows:
-                self.__key2row = FIFODict(size)
-            self.__vals2key = FIFODict(size)
+                self.__key2row = makecache(cachepolicy, maxentries, 
+                                           maxbytes=maxbytes)
+            self.__vals2key = makecache(cachepolicy, maxentries, 
+                                        maxbytes=maxbytes)
         else:
             # Use dictionaries as unlimited caches
             if cachefullrows:
                 self.__key2row = {}
             self.__vals2key = {}
+        # Knows the cached lookup values of each key (see _before_update)
+        self.__keyindex = KeyIndex(self.__vals2key)
 
         self.cachefullrows = cachefullrows
+        self.cachesize = size
 
         if prefill:
-            if cachefullrows:
-                positions = tuple([self.all.index(att) \
-                                       for att in self.lookupatts])
-                # select all key and all attributes
-                sql = "SELECT %s FROM %s" % (", ".join(self.all), name)
-            else:
-                # select key and lookup attributes
-                sql = "SELECT %s FROM %s" % \
-                    (", ".join([key] + [l for l in self.lookupatts]), name)
-                positions = range(1, len(self.lookupatts) + 1)
-
-            self.targetconnection.execute(sql)
-            for rawrow in self.targetconnection.fetchmanytuples(size):
-                if cachefullrows:
-                    self.__key2row[rawrow[0]] = rawrow
-                t = tuple([rawrow[i] for i in positions])
-                self.__vals2key[t] = rawrow[0]
+            self.prefillcache()
+
+    def prefillcache(self, targetconnection=None):
+        """Fill the cache with rows from the dimension table.
+
+           Return the number of rows read into the cache.
+
+           Arguments:
+           - targetconnection: the ConnectionWrapper to read the rows with.
+             Giving each dimension its own connection allows several 
+             dimensions to be filled concurrently (see pyetlmr.prefill).
+             If not given, the dimension's own connection is used.
+        """
+        if targetconnection is None:
+            targetconnection = self.targetconnection
+        if self.cachefullrows:
+            positions = tuple([self.all.index(att) \
+                                   for att in self.lookupatts])
+            # select all key and all attributes
+            sql = "SELECT %s FROM %s" % (", ".join(self.all), self.name)
+        else:
+            # select key and lookup attributes
+            sql = "SELECT %s FROM %s" % \
+                (", ".join([self.key] + [l for l in self.lookupatts]), 
+                 self.name)
+            positions = range(1, len(self.lookupatts) + 1)
+
+        targetconnection.execute(sql)
+        if self.cachesize > 0:
+            rawrows = targetconnection.fetchmanytuples(self.cachesize)
+        else:
+            rawrows = targetconnection.fetchalltuples()
+        for rawrow in rawrows:
+            if self.cachefullrows:
+                self.__key2row[rawrow[0]] = rawrow
+            t = tuple([rawrow[i] for i in positions])
+            self.__keyindex.add(t, rawrow[0])
+        if self.bloomfilter is not None:
+            self.fillbloomfilter(targetconnection)
+        return len(rawrows)
+
+    def cachestats(self):
+        """Return the counters of the bounded caches as a dict
+           {cache name: {counter name: value}}."""
+        res = {}
+        if hasattr(self.__vals2key, 'stats'):
+            res['vals2key'] = self.__vals2key.stats()
+        if self.cachefullrows and hasattr(self.__key2row, 'stats'):
+            res['key2row'] = self.__key2row.stats()
+        return res
+
+    def getcaches(self):
+        """Return the bounded caches (see pyetlmr.caches) of the dimension."""
+        caches = [self.__vals2key]
+        if self.cachefullrows:
+            caches.append(self.__key2row)
+        return [c for c in caches if hasattr(c, 'stats')]
 
     def _before_lookup(self, row, namemapping):
         namesinrow =[(namemapping.get(a) or a) for a in self.lookupatts]
@@ -394,7 +691,7 @@ class CachedDimension(Dimension):
         if resultkey is not None:
             namesinrow =[(namemapping.get(a) or a) for a in self.lookupatts]
             searchtuple = tuple([row[n] for n in namesinrow])
-            self.__vals2key[searchtuple] = resultkey
+            self.__keyindex.add(searchtuple, resultkey)
 
     def _before_getbykey(self, keyvalue):
         if self.cachefullrows:
@@ -414,13 +711,10 @@ class CachedDimension(Dimension):
         key = (namemapping.get(self.key) or self.key)
         for att in self.lookupatts:
             if (att in namemapping or att in row):
-                # A lookup attribute is changed. We don't know the old value
-                # and thus not if the old value is in the cache... We have
-                # to drop the cache completely... :-/
-                # FIXME: We could look up the old values for the lookup atts
-                # since we have the key. It would then be enough to
-                # do a del self.__vales2key[oldvalues]
-                self.__vals2key.clear()
+                # A lookup attribute is changed. The key index knows the
+                # old values, if they are cached, so only that entry has
+                # to be deleted.
+                self.__keyindex.discard(row[key])
                 break
 
         if self.cachefullrows:
@@ -459,7 +753,8 @@ class SlowlyChangingDimension(Dimension):
                  toatt=None, tofinder=None, maxto=None,
                  srcdateatt=None, srcdateparser=pyetlmr.ymdparser,
                  type1atts=(), cachesize=10000, idfinder=None, defaultidvalue=None,
-                 targetconnection=None):
+                 targetconnection=None, cachepolicy='fifo', cachememory=None,
+                 bloomcapacity=0, negcachesize=0, indexversions=False):
         """Arguments:
            - name: the name of the dimension table in the DW
            - key: the name of the primary key in the DW
@@ -511,6 +806,21 @@ class SlowlyChangingDimension(Dimension):
              applied. Default: ()
            - cachesize: the maximum size of the cache. 0 disables caching
              and values smaller than 0 allows unlimited caching
+           - cachepolicy: the replacement policy of the caches when 
+             cachesize is greater than 0: 'fifo', 'lru', 'clock' or 'arc'
+             (see pyetlmr.caches). Default: 'fifo'
+           - cachememory: an optional number of bytes the caches may use.
+             The caches are then bounded by the approximate size of the 
+             cached rows, and by cachesize only if it is greater than 0.
+             Default: None
+           - bloomcapacity: see Dimension. Default: 0
+           - negcachesize: see Dimension. Default: 0
+           - indexversions: a flag deciding if the versions of the members
+             should be kept in a VersionIndex (see pyetlmr.versionindex)
+             such that lookup finds the version valid at a date by
+             bisection. The versions of a member are read when first
+             needed, or all at once by prefillversions. Requires fromatt
+             and srcdateatt. Default: False
            - idfinder: a function(row, namemapping) -> key value that assigns
              a value to the primary key attribute based on the content of the
              row and namemapping. If not given, it is assumed that the primary
@@ -521,7 +831,8 @@ class SlowlyChangingDimension(Dimension):
         """
 
         Dimension.__init__(self, name, key, attributes, lookupatts, 
-                           idfinder, defaultidvalue, None, targetconnection)
+                           idfinder, defaultidvalue, None, targetconnection,
+                           bloomcapacity, negcachesize)
 
         if not versionatt:
             raise ValueError, 'A version attribute must be given'
@@ -543,14 +854,25 @@ class SlowlyChangingDimension(Dimension):
         self.srcdateparser = srcdateparser
         self.type1atts = type1atts
         self.caching = True
-        if cachesize > 0:
-            self.rowcache = FIFODict(cachesize)
-            self.keycache = FIFODict(cachesize)
+        if cachesize > 0 or cachememory:
+            maxentries = None
+            if cachesize > 0:
+                maxentries = cachesize
+            maxbytes = None
+            if cachememory:
+                maxbytes = cachememory / 2
+            self.rowcache = makecache(cachepolicy, maxentries, 
+                                      maxbytes=maxbytes)
+            self.keycache = makecache(cachepolicy, maxentries, 
+                                      maxbytes=maxbytes)
         elif cachesize < 0:
             self.rowcache = {}
             self.keycache = {}
         else:
             self.caching = False
+        if self.caching:
+            # Knows the cached lookup values of each key (see _before_update)
+            self.keyindex = KeyIndex(self.keycache)
 
         # Check that versionatt, fromatt and toatt are also declared as 
         # attributes
@@ -567,6 +889,30 @@ class SlowlyChangingDimension(Dimension):
                 "UPDATE %s SET %s = %%(%s)s WHERE %s = %%(%s)s" % \
                 (name, toatt, toatt, key, key)
 
+        # The SQL for finding the version valid at a row's source date
+        self.pointlookupsql = None
+        if fromatt and srcdateatt:
+            self.pointlookupsql = "SELECT " + key + " FROM " + name + \
+                " WHERE " + " AND ".join(["%s = %%(%s)s" % (lv, lv) \
+                                              for lv in lookupatts]) + \
+                " AND %s <= %%(%s)s" % (fromatt, srcdateatt)
+            if toatt:
+                self.pointlookupsql += \
+                    " AND %%(%s)s < COALESCE(%s, '9999-12-31')" % \
+                    (srcdateatt, toatt)
+
+        self.versionindex = None
+        if indexversions:
+            if not (fromatt and srcdateatt):
+                raise ValueError, \
+                    "fromatt and srcdateatt are needed for indexversions"
+            self.versionindex = VersionIndex()
+            # This gives "SELECT key, fromatt, toatt FROM name WHERE
+            #             lookupval1 = %(lookupval1)s AND ..."
+            self.versionlookupsql = "SELECT %s, %s, %s FROM %s WHERE " % \
+                (key, fromatt, toatt or 'NULL', name) + \
+                " AND ".join(["%s = %%(%s)s" % (lv, lv) for lv in lookupatts])
+
 
     def lookup_type1(self, row, namemapping={}):
         """ Find the key for the newest version with the given values.
@@ -580,22 +926,80 @@ class SlowlyChangingDimension(Dimension):
 
     
     def lookup(self, row, namemapping={}):
-        keylookupsql = "SELECT " + self.key + " FROM " + self.name + " WHERE " + \
-            " AND ".join(["%s = %%(%s)s" % (lv, lv) for lv in self.lookupatts]) + " AND %s<=%%(%s)s AND %%(%s)s<COALESCE(%s,'9999-12-31')" \
-        % (self.fromatt, self.srcdateatt, self.srcdateatt, self.toatt)
-        
-        #rdt = self.srcdateparser(row[self.srcdateatt])
-        #modref = self.targetconnection.getunderlyingmodule()
-        #rowdate = modref.Date(rdt.year, rdt.month, rdt.day)
-        #row['rowdate'] = rowdate
-        #namemapping[self.fromatt] = 'rowdate'
-        
-        self.targetconnection.execute(keylookupsql, row, namemapping)
+        """Find the key for the version that was valid at the source date
+           of the row.
+
+           Arguments:
+           - row: a dict which must contain at least the lookup attributes
+             and srcdateatt
+           - namemapping: an optional namemapping (see module's documentation)
+        """
+        if self.versionindex is not None:
+            return self.__indexedlookup(row, namemapping)
+        self.targetconnection.execute(self.pointlookupsql, row, namemapping)
         keyvalue = self.targetconnection.fetchonetuple()[0]
         if keyvalue is None:
-            keyvalue = self.defaultidvalue  
-            
+            keyvalue = self.defaultidvalue
+
         return keyvalue
+
+    def lookupmany(self, rows, namemapping={}, batchsize=500):
+        """Find the keys for the newest versions of several rows. Return
+           a list holding the key value for each row.
+
+           The versions are looked up one by one (see lookup).
+        """
+        return [self.lookup(row, namemapping) for row in rows]
+
+    def insertmany(self, rows, namemapping={}):
+        """Insert several versions one by one (see insert). Return a list of
+           their new key values."""
+        return [self.insert(row, namemapping) for row in rows]
+
+    def prefillversions(self, targetconnection=None):
+        """Read all versions from the dimension table into the version index.
+           Return the number of versions read.
+
+           Arguments:
+           - targetconnection: the ConnectionWrapper to read the versions
+             with. If not given, the dimension's own connection is used.
+        """
+        if self.versionindex is None:
+            return 0
+        if targetconnection is None:
+            targetconnection = self.targetconnection
+        sql = "SELECT %s, %s, %s, %s FROM %s" % \
+            (", ".join(self.lookupatts), self.key, self.fromatt,
+             self.toatt or 'NULL', self.name)
+        targetconnection.execute(sql)
+        rawrows = targetconnection.fetchalltuples()
+        n = len(self.lookupatts)
+        members = {}
+        for rawrow in rawrows:
+            members.setdefault(tuple(rawrow[:n]), []).append(
+                (rawrow[n + 1], rawrow[n + 2], rawrow[n]))
+        for (lookupvalues, versions) in members.iteritems():
+            self.versionindex.setversions(lookupvalues, versions)
+        return len(rawrows)
+
+    # Lets pyetlmr.prefill fill the version index with the other caches
+    prefillcache = prefillversions
+
+    def __indexedlookup(self, row, namemapping):
+        lookupvalues = tuple([row[(namemapping.get(a) or a)] \
+                                  for a in self.lookupatts])
+        if lookupvalues not in self.versionindex:
+            # Read all versions of the member once
+            self.targetconnection.execute(self.versionlookupsql, row,
+                                          namemapping)
+            self.versionindex.setversions(lookupvalues,
+                [(f, t, k) for (k, f, t) in \
+                     self.targetconnection.fetchalltuples()])
+        srcdate = row[(namemapping.get(self.srcdateatt) or self.srcdateatt)]
+        if isinstance(srcdate, basestring):
+            srcdate = self.srcdateparser(srcdate)
+        return self.versionindex.lookup(lookupvalues, srcdate,
+                                        self.defaultidvalue)
         
     def ensure(self, row, namemapping={}):
         """Lookup or insert a version of a slowly changing dimension member.
@@ -678,7 +1082,7 @@ class SlowlyChangingDimension(Dimension):
 
             if len(type1updates) > 0:
                 # Some type 1 updates were found
-                self.__performtype1updates(type1updates, other)
+                self._performtype1updates(type1updates, other)
             
             if addnewversion: # type 2
                 # Make a new row version and insert it
@@ -694,8 +1098,7 @@ class SlowlyChangingDimension(Dimension):
                 # Update the todate attribute in the old row version in the DB.
                 if toatt:
                     toattval = str(self.tofinder(self.targetconnection, row, namemapping)).strip("':date ")
-                    self.targetconnection.execute(self.updatetodatesql, 
-                                     {self.key : keyval, self.toatt : toattval})
+                    self._closeversion(keyval, toattval)
             else:
                 # Update the row dict by giving version and dates and the key
                 row[key] = keyval
@@ -708,6 +1111,21 @@ class SlowlyChangingDimension(Dimension):
             return row[key]
 
 
+    def cachestats(self):
+        """Return the counters of the bounded caches as a dict
+           {cache name: {counter name: value}}."""
+        res = {}
+        if self.caching and hasattr(self.keycache, 'stats'):
+            res['keycache'] = self.keycache.stats()
+            res['rowcache'] = self.rowcache.stats()
+        return res
+
+    def getcaches(self):
+        """Return the bounded caches (see pyetlmr.caches) of the dimension."""
+        if self.caching and hasattr(self.keycache, 'stats'):
+            return [self.keycache, self.rowcache]
+        return []
+
     def _before_lookup(self, row, namemapping):
         if self.caching:
             namesinrow =[(namemapping.get(a) or a) for a in self.lookupatts]
@@ -718,7 +1136,7 @@ class SlowlyChangingDimension(Dimension):
         if self.caching and resultkey is not None:
             namesinrow =[(namemapping.get(a) or a) for a in self.lookupatts]
             searchtuple = tuple([row[n] for n in namesinrow])
-            self.keycache[searchtuple] = resultkey
+            self.keyindex.add(searchtuple, resultkey)
 
     def _before_getbykey(self, keyvalue):
         if self.caching:
@@ -735,14 +1153,14 @@ class SlowlyChangingDimension(Dimension):
     def _before_update(self, row, namemapping):
         """ """
         # We have to remove old values from the caches.
+        if not self.caching:
+            return None
         key = (namemapping.get(self.key) or self.key)
         for att in self.lookupatts:
             if (att in namemapping or att in row):
-                # A lookup attribute is changed. We don't know the old value
-                # and thus not if the old value is in the cache... We have
-                # to drop the cache completely... :-/
-                # FIXME: Same fix as in CachedDimension could be used here
-                self.keycache.clear()
+                # A lookup attribute is changed. Delete the cached entry for
+                # the old values of this member only.
+                self.keyindex.discard(row[key])
                 break
 
         if row[key] in self.rowcache:
@@ -760,13 +1178,23 @@ class SlowlyChangingDimension(Dimension):
         # For example, a DEFAULT value in the DB breaks this assumption.
         # Note that we always cache inserted members (in CachedDimension
         # this is an option).
+        if self.versionindex is not None:
+            # The versions of the member are read again when needed
+            self.versionindex.discard(tuple([row[(namemapping.get(a) or a)] \
+                                                 for a in self.lookupatts]))
         if self.caching:
             self._after_lookup(row, namemapping, newkeyvalue)
             tmp = pyetlmr.project(self.all[1:], row, namemapping)
             tmp[self.key] = newkeyvalue
             self._after_getbykey(newkeyvalue, tmp)
 
-    def __performtype1updates(self, updates, lookupvalues, namemapping={}):
+    def _closeversion(self, keyvalue, toattvalue):
+        """Set the toatt of the version with the given key value."""
+        self.targetconnection.execute(self.updatetodatesql,
+                                      {self.key : keyvalue,
+                                       self.toatt : toattvalue})
+
+    def _performtype1updates(self, updates, lookupvalues, namemapping={}):
         """ """
         # find the keys in the rows that should be updated
         self.targetconnection.execute(self.keylookupsql, lookupvalues, 
@@ -788,6 +1216,224 @@ class SlowlyChangingDimension(Dimension):
 SCDimension = SlowlyChangingDimension
 
 
+class BulkSlowlyChangingDimension(SlowlyChangingDimension):
+    """A slowly changing dimension where the changes are applied in bulk.
+
+       New versions, closed versions and type 1 updates are collected in
+       memory. When bulksize changes have been collected, and by endload,
+       the new versions are bulk loaded into the dimension table. The closed
+       versions and the type 1 updates are bulk loaded into temporary
+       staging tables and applied by one UPDATE ... FROM each.
+
+       lookup, getbykey and ensure see the collected changes, but other
+       readers of the dimension table only see them when they are applied.
+    """
+
+    def __init__(self, name, key, attributes, lookupatts, versionatt,
+                 bulkloader, fieldsep='\t', rowsep='\n', nullsubst='\\N',
+                 tempdest=None, bulksize=100000, **kwargs):
+        """Arguments:
+           - name, key, attributes, lookupatts, versionatt: see
+             SlowlyChangingDimension
+           - bulkloader: A method
+             m(name, attributes, fieldsep, rowsep, nullsubst, tempdest)
+             that is called to load data from a temporary file into the
+             dimension table or into a staging table (see BulkFactTable).
+             As the staging tables are temporary, it must use the target
+             connection of the dimension, i.e., the targetconnection
+             argument or else the default target connection when the
+             dimension is made. The UDF_pgcopy of the configs in conf/ use
+             the connection made by UDF_createConnection, which is the
+             default one, and must not reconnect while the dimension loads.
+           - fieldsep: a string used to separate fields in the temporary
+             file. Default: '\\t'
+           - rowsep: a string used to separate rows in the temporary file.
+             Default: '\\n'
+           - nullsubst: a string used to replace None values.
+             Default: '\\N'
+           - tempdest: a file object or None. If None a named temporary file
+             is used.
+           - bulksize: an int deciding the number of changes to collect
+             before they are applied. Default: 100000
+           - kwargs: further arguments for SlowlyChangingDimension
+        """
+        SlowlyChangingDimension.__init__(self, name, key, attributes,
+                                         lookupatts, versionatt, **kwargs)
+        self.__close = False
+        if tempdest is None:
+            self.__close = True
+            self.__namedtempfile = tempfile.NamedTemporaryFile()
+            tempdest = self.__namedtempfile.file
+        self.bulkloader = bulkloader
+        self.fieldsep = fieldsep
+        self.rowsep = rowsep
+        self.nullsubst = nullsubst
+        self.tempdest = tempdest
+        self.bulksize = bulksize
+        # Counters read by pyetlmr.metrics.recordbulkloads
+        self.bulkloads = 0
+        self.bulkloadbytes = 0
+        self.bulkloadseconds = 0.0
+
+        self.__versions = {} # key -> new version, not yet in the DW
+        self.__newest = {}   # lookup values -> key of the newest new version
+        self.__overlay = {}  # key -> version in the DW changed by type 1
+        self.__closings = {} # key of a version in the DW -> toatt value
+        self.__type1 = {}    # lookup values -> {type 1 att : value}
+
+    def ensure(self, row, namemapping={}):
+        """Lookup or add a version of a slowly changing dimension member.
+
+           NB: Has side-effects on the given row.
+
+           Arguments:
+           - row: a dict containing the attributes for the member.
+             key, versionatt, fromatt, and toatt are not required to be
+             present but will be added (if defined).
+           - namemapping: an optional namemapping (see module's documentation)
+        """
+        res = SlowlyChangingDimension.ensure(self, row, namemapping)
+        if len(self.__versions) + len(self.__closings) + \
+                len(self.__type1) >= self.bulksize:
+            self.flush()
+        return res
+
+    def insert(self, row, namemapping={}):
+        """Collect a new version. Return its key value.
+
+           Arguments:
+           - row: the version to add. It must contain all attributes.
+           - namemapping: an optional namemapping (see module's documentation)
+        """
+        key = (namemapping.get(self.key) or self.key)
+        keyval = row.get(key)
+        if keyval is None:
+            keyval = self.idfinder(row, namemapping)
+        version = tuple([keyval] + [row[(namemapping.get(a) or a)] \
+                                        for a in self.attributes])
+        searchtuple = tuple([row[(namemapping.get(a) or a)] \
+                                 for a in self.lookupatts])
+        self.__versions[keyval] = version
+        self.__newest[searchtuple] = keyval
+        self._markpresent(row, namemapping)
+        self._after_insert(row, namemapping, keyval)
+        return keyval
+
+    def _closeversion(self, keyvalue, toattvalue):
+        if toattvalue is not None:
+            toattvalue = str(toattvalue).strip("':date ")
+        version = self.__versions.get(keyvalue)
+        if version is not None:
+            # The version is not in the DW yet. Close it before it is loaded.
+            pos = self.all.index(self.toatt)
+            self.__versions[keyvalue] = \
+                version[:pos] + (toattvalue,) + version[pos + 1:]
+        else:
+            self.__closings[keyvalue] = toattvalue
+        if self.caching and keyvalue in self.rowcache:
+            del self.rowcache[keyvalue]
+
+    def _performtype1updates(self, updates, lookupvalues, namemapping={}):
+        # lookupvalues is the newest version of the member (see ensure)
+        searchtuple = tuple([lookupvalues[a] for a in self.lookupatts])
+        values = self.__type1.get(searchtuple)
+        if values is None:
+            values = dict([(a, lookupvalues[a]) for a in self.type1atts])
+            self.__type1[searchtuple] = values
+        values.update(updates)
+        # getbykey must see the change for the newest version
+        newest = dict(lookupvalues)
+        newest.update(updates)
+        keyval = newest[self.key]
+        version = tuple([newest[a] for a in self.all])
+        if keyval in self.__versions:
+            self.__versions[keyval] = version
+        else:
+            self.__overlay[keyval] = version
+        if self.caching and keyval in self.rowcache:
+            del self.rowcache[keyval]
+
+    def _before_lookup(self, row, namemapping):
+        searchtuple = tuple([row[(namemapping.get(a) or a)] \
+                                 for a in self.lookupatts])
+        keyval = self.__newest.get(searchtuple)
+        if keyval is not None:
+            return keyval
+        return SlowlyChangingDimension._before_lookup(self, row, namemapping)
+
+    def _before_getbykey(self, keyvalue):
+        version = self.__versions.get(keyvalue) or \
+            self.__overlay.get(keyvalue)
+        if version is not None:
+            return dict(zip(self.all, version))
+        return SlowlyChangingDimension._before_getbykey(self, keyvalue)
+
+    def flush(self):
+        """Apply the collected changes to the dimension table."""
+        if self.__versions:
+            self.__bulkload(self.name, self.all, self.__versions.itervalues())
+        if self.__type1:
+            rows = [searchtuple + tuple([values[a] for a in self.type1atts]) \
+                        for (searchtuple, values) in self.__type1.iteritems()]
+            self.__updatefrom(list(self.lookupatts) + list(self.type1atts),
+                              self.lookupatts, self.type1atts, rows)
+        if self.__closings:
+            self.__updatefrom([self.key, self.toatt], [self.key],
+                              [self.toatt], self.__closings.iteritems())
+        if self.versionindex is not None:
+            for searchtuple in self.__newest.keys() + self.__type1.keys():
+                self.versionindex.discard(searchtuple)
+        self.__versions.clear()
+        self.__newest.clear()
+        self.__overlay.clear()
+        self.__closings.clear()
+        self.__type1.clear()
+
+    def __bulkload(self, name, atts, rows):
+        start = time()
+        for row in rows:
+            data = [pyetlmr.getstrornullvalue(val, self.nullsubst) \
+                        for val in row]
+            self.tempdest.write("%s%s" % (self.fieldsep.join(data),
+                                          self.rowsep))
+        self.tempdest.flush()
+        self.bulkloadbytes += self.tempdest.tell()
+        self.tempdest.seek(0)
+        self.bulkloader(name, atts, self.fieldsep, self.rowsep,
+                        self.nullsubst, self.tempdest)
+        self.tempdest.seek(0)
+        self.tempdest.truncate(0)
+        self.bulkloads += 1
+        self.bulkloadseconds += time() - start
+
+    def __updatefrom(self, atts, joinatts, setatts, rows):
+        # Load the rows into a staging table and update the dimension table
+        # from it in one statement
+        staging = "%s_staging" % (self.name,)
+        self.targetconnection.execute(
+            "CREATE TEMPORARY TABLE %s AS SELECT %s FROM %s WHERE 1 = 0" % \
+                (staging, ", ".join(atts), self.name))
+        self.__bulkload(staging, atts, rows)
+        self.targetconnection.execute(
+            "UPDATE %s SET %s FROM %s WHERE %s" % \
+                (self.name,
+                 ", ".join(["%s = %s.%s" % (a, staging, a) for a in setatts]),
+                 staging,
+                 " AND ".join(["%s.%s = %s.%s" % (self.name, a, staging, a) \
+                                   for a in joinatts])))
+        self.targetconnection.execute("DROP TABLE %s" % (staging,))
+
+    def endload(self):
+        """Apply the collected changes and finalize the load."""
+        self.flush()
+        SlowlyChangingDimension.endload(self)
+        if self.__close:
+            self.__namedtempfile.close()
+            self.__close = False
+
+BulkSCDimension = BulkSlowlyChangingDimension
+
+
 
 # NB: SnowflakedDimension's methods may have side-effects:
 # row[somedim.key] = someval.
@@ -890,6 +1536,14 @@ class SnowflakedDimension(object):
         self.expectboguskeyvalues = expectboguskeyvalues
 
 
+    def getcaches(self):
+        """Return the bounded caches of the participating dimensions."""
+        caches = []
+        for dims in self.levels.values():
+            for dim in dims:
+                caches.extend(dim.getcaches())
+        return caches
+
     def __buildlevels(self, node, level):
         tmp = self.levels.get(level, [])
         tmp.append(node)
@@ -1041,6 +1695,25 @@ class SnowflakedDimension(object):
                                               False)
         return key
 
+    def ensuremany(self, rows, namemapping={}):
+        """Lookup or insert several members. Return a list of their keys.
+
+           The rows are handled one participating table at a time: The
+           members of a table are looked up by one batched lookup and the
+           missing are inserted by one insertmany (see Dimension) such that
+           each member is only looked up and inserted once.
+
+           NB: Has the same side-effects on the rows as ensure.
+
+           Arguments:
+           - rows: a sequence of rows to lookup or insert. Each must contain
+             the lookup attributes.
+           - namemapping: an optional namemapping (see module's documentation)
+        """
+        self.__ensuremany_helper(self.root, rows, namemapping)
+        return [row[(namemapping.get(self.root.key) or self.root.key)] \
+                    for row in rows]
+
     def insert(self, row, namemapping={}):
         """Insert the given member. If that fails, insert it. Return key value.
 
@@ -1076,7 +1749,9 @@ class SnowflakedDimension(object):
 
     def endload(self):
         """Finalize the load."""
-        pass
+        for dims in self.levels.values():
+            for dim in dims:
+                dim.endload()
 
 
     def __ensure_helper(self, dimension, row, namemapping, insertdone):
@@ -1122,6 +1797,52 @@ class SnowflakedDimension(object):
         row[(namemapping.get(dimension.key) or dimension.key)] = key
         return (key, insertdone)
 
+    def __ensuremany_helper(self, dimension, rows, namemapping):
+        """ """
+        # As __ensure_helper but for several rows. NB: Has side-effects: Key
+        # values are set in the rows for all dimensions that are visited.
+        keyname = (namemapping.get(dimension.key) or dimension.key)
+        retry = False
+        try:
+            keys = dimension.lookupmany(rows, namemapping)
+        except KeyError:
+            # The keys of the levels above are needed as lookup attributes
+            retry = True
+            keys = [None] * len(rows)
+        pending = self.__setkeys(dimension, rows, keys, keyname)
+        if not pending:
+            return
+        for refed in self.refs.get(dimension, []):
+            self.__ensuremany_helper(refed, pending, namemapping)
+        if retry or self.expectboguskeyvalues:
+            pending = self.__setkeys(dimension, pending,
+                                     dimension.lookupmany(pending, namemapping),
+                                     keyname)
+            if not pending:
+                return
+        # Insert each missing member once
+        namesinrow = [(namemapping.get(a) or a) for a in dimension.lookupatts]
+        members = {}
+        for row in pending:
+            members.setdefault(tuple([row[n] for n in namesinrow]),
+                               []).append(row)
+        memberrows = members.values()
+        newkeys = dimension.insertmany([mrows[0] for mrows in memberrows],
+                                       namemapping)
+        for (mrows, key) in zip(memberrows, newkeys):
+            for row in mrows:
+                row[keyname] = key
+
+    def __setkeys(self, dimension, rows, keys, keyname):
+        # Set the found keys in the rows and return the rows without a key
+        pending = []
+        for (row, key) in zip(rows, keys):
+            if key is None or key == dimension.defaultidvalue:
+                pending.append(row)
+            else:
+                row[keyname] = key
+        return pending
+
     def scdensure(self, row, namemapping={}):
         """Lookup or insert a version of a slowly changing dimension member.
 
@@ -1340,6 +2061,13 @@ class BulkFactTable(object):
 
         self.bulksize = bulksize
         self.__count = 0
+        # Counters read by pyetlmr.metrics.recordbulkloads
+        self.bulkloads = 0
+        self.bulkloadbytes = 0
+        self.bulkloadseconds = 0.0
+        # An optional function f(table) called before each bulk load, e.g.,
+        # by pyetlmr.checkpoint.FactCheckpointer
+        self.beforebulkload = None
 
         if nullsubst is None:
             self.insert = self._insertwithoutnulls
@@ -1387,14 +2115,20 @@ class BulkFactTable(object):
 
 
     def __bulkloadnow(self):
+        start = time()
         self.tempdest.flush()
+        self.bulkloadbytes += self.tempdest.tell()
         self.tempdest.seek(0)
+        if self.beforebulkload is not None:
+            self.beforebulkload(self)
         self.bulkloader(self.name, self.all, 
                         self.fieldsep, self.rowsep, self.nullsubst,
                         self.tempdest)
         self.tempdest.seek(0)
         self.tempdest.truncate(0)
         self.__count = 0
+        self.bulkloads += 1
+        self.bulkloadseconds += time() - start
         
 
     def endload(self):
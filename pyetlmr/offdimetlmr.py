@@ -35,15 +35,27 @@ The advantage of this offline dimension methodology is good for  denormalized di
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
-import tempfile, datetime, time, sys, os, socket, getopt
+import tempfile, datetime, time, sys, os, socket, getopt, pipes
 from disco.core import Disco, result_iterator, Params
-from disco.func import re_reader, default_partition
+from disco.func import re_reader
 from subprocess import Popen, call
 from commands import getstatusoutput
 from mapreader import map_csv_reader_bkey
 from mapreader import map_csv_reader
 from lrustore import LRUShelve
-from unicodecsv import UnicodeWriter
+from disco.util import msg
+from caches import budgetfor
+from metrics import getmetrics, recordcaches, recordbulkloads, recordmemory, \
+     METRICSKEY
+from profiling import instrument, SamplingProfiler
+from spool import openspool, spoolrow, closespool
+from partitioning import partition_func
+from checkpoint import openfactcheckpoints, factstoload, \
+	closefactcheckpoints, openshelvecheckpoints, ensuredbefore, \
+	closeshelvecheckpoints
+from multiprocessing import Process
+from unicodecsv import tsvline
+from prefill import prefill_dimensions
 
 __author__ = "Xiufeng Liu"
 __maintainer__ = "Xiufeng Liu"
@@ -53,30 +65,116 @@ __version__ = '0.1.0'
 #map_reader = map_csv_reader_bkey
 map_reader = map_csv_reader
 
+_cachebudget = None
+_metrics = getmetrics()
+_sampler = SamplingProfiler(_metrics)
+
+def _budgetcaches(dimensions):
+	'''
+	Split config.cachememory bytes between the caches of the dimensions
+	'''
+	global _cachebudget
+	cachememory = getattr(config, 'cachememory', None)
+	if cachememory:
+		_cachebudget = budgetfor(dimensions, cachememory)
+
+def _tickbudget():
+	if _cachebudget is not None:
+		_cachebudget.tick()
+
+def _progress():
+	'''
+	Report the counters of the task every config.progressinterval seconds
+	'''
+	_metrics.progress(msg, getattr(config, 'progressinterval', 60))
+
+def _profile():
+	'''
+	Profile the UDFs and tables of the config if config.profileudfs (time
+	every n'th call) or config.profilesampling (seconds between samples) is set
+	'''
+	every = getattr(config, 'profileudfs', 0)
+	if every:
+		instrument(config, _metrics, every)
+	interval = getattr(config, 'profilesampling', 0)
+	if interval:
+		_sampler.interval = interval
+		_sampler.start()
+
+def _metricsresult(tables):
+	'''
+	Return the metrics of the task as a result pair for the driver
+	'''
+	_sampler.stop()
+	recordcaches(tables)
+	recordbulkloads(tables)
+	recordmemory()
+	return (METRICSKEY, _metrics.tojson())
+
 def dim_map_init(row, params):
+	_metrics.clear()
+	_profile()
 	for dimension in config.dimensions.keys():
 		if dimension.is_bigdim():
-			dimension.open_shelveddb(taskid=this_partition())
+			# With params.dimpartitions, this task writes the partition of
+			# its number (see partitionedstore)
+			dimension.open_shelveddb(taskid=this_partition(), \
+			                         npartitions=getattr(params, 'dimpartitions', 0), \
+			                         seed=getattr(params, 'partitionseed', 0), \
+			                         consistent=getattr(params, 'consistentpartitioning', False))
+	_budgetcaches(config.dimensions.keys())
+	openspool(params, config, this_partition())
+	openshelvecheckpoints(params, [dimension for dimension in
+	                               config.dimensions.keys() if dimension.is_bigdim()])
 
 def dim_map_func(row, params):
 	dimensions = config.dimensions.keys()
 	dim_row = []
+	_metrics.incr('rows.read')
+	spoolrow(row) # Before the rowhandlers change the row
+	ensured = ensuredbefore(row) # By the run this job resumes
 	for dimension in dimensions:
 		if dimension.is_bigdim():  # Process the large dimension in mapper
 			rowhandlers = config.dimensions[dimension].get('rowhandlers',[])
 			namemapping = config.dimensions[dimension].get('namemappings',{})
 			for handler in rowhandlers:
 				handler(row, namemapping)
+			if ensured:
+				continue
+			start = time.time()
 			dimension.ensure(row, namemapping)
+			_metrics.observe('ensure.%s' % dimension.name, time.time()-start)
+			_metrics.incr('rows.%s' % dimension.name)
 		else: # Send the data of small dimensions to reducers
 			srcfields = config.dimensions[dimension].get('srcfields',[])
 			nrow = dict([(field, row[field]) for field in srcfields if row.has_key(field)])
 			dim_row.append((dimension.name, repr(nrow)))
+	_tickbudget()
+	_progress()
 	return dim_row
 
-dim_partition_func = default_partition
+dim_partition_func = partition_func
 
-dim_combiner_func = None
+def _endmaptask():
+	'''
+	Close the spool file and the checkpoints of the map task and end the
+	loads of the big dimensions. Return the metrics of the task as a pair
+	'''
+	closespool()
+	closeshelvecheckpoints()
+	bigdims = [d for d in config.dimensions.keys() if d.is_bigdim()]
+	for dimension in bigdims:
+		dimension.endload()
+	return _metricsresult(bigdims)
+
+def dim_combiner_func(key, value, comb_buffer, done, params):
+	'''
+	Pass the pairs on to the reducers. The big dimensions are ensured in
+	the map tasks, so their metrics are sent when a task is done
+	'''
+	if done:
+		return [_endmaptask()]
+	return [(key, value)]
 
 
 
@@ -91,10 +189,8 @@ def dim_combiner_func_bigdim(name, row, comb_buffer, done, params):
 		if params.count>=50000:
 			return comb_buffer.iteritems()
 	if done:
-		dimensions = config.dimensions.keys()
-		for dimension in dimensions:
-			if dimension.is_bigdim():
-				dimension.endload()
+		(key, value) = _endmaptask()
+		comb_buffer[key] = value
 		return comb_buffer.iteritems()
 
 
@@ -112,10 +208,8 @@ def dim_combiner_func_using_list(name, row, comb_buffer, done, params):
 			return comb_buffer.iteritems()
 
 	if done:
-		dimensions = config.dimensions.keys()
-		for dimension in dimensions:
-			if dimension.is_bigdim():
-				dimension.endload()
+		(key, value) = _endmaptask()
+		comb_buffer[key] = value
 		return comb_buffer.iteritems()
 
 
@@ -124,7 +218,14 @@ def dim_reduce_func(iter, out, params):
 	Process the data of all small dimensions
 	'''
 	rowsdict = {}
+	_metrics.clear()
+	_profile()
 	for name, par_row in iter:
+		if name == METRICSKEY:
+			# The metrics of a map task
+			out.add(name, par_row)
+			continue
+		_metrics.incr('shuffle.bytes', len(par_row))
 		rows = rowsdict.get(name, [])
 		row = eval(par_row)
 		if not row in rows:
@@ -135,37 +236,58 @@ def dim_reduce_func(iter, out, params):
 	for name, rows in rowsdict.iteritems():
 		dimension = dimdict.get(name)
 		dimension.open_shelveddb() # open the offline dimension
+		_budgetcaches([dimension])
 		rowhandlers = config.dimensions[dimension].get('rowhandlers',[])
 		namemapping = config.dimensions[dimension].get('namemappings',{})
 		for row in rows:
 			for handler in rowhandlers:
 				handler(row, namemapping)
+			start = time.time()
 			dimension.ensure(row, namemapping)
+			_metrics.observe('ensure.%s' % name, time.time()-start)
+			_metrics.incr('rows.%s' % name)
+			_tickbudget()
+			_progress()
 		out.add(dimension.shelvedpath, this_host())
 		dimension.endload()
+	out.add(*_metricsresult(dimdict.values()))
 	#config.connection.commit()
 
 
 def dim_reduce_func_bigdim(iter, out, params):
 	opened_dims = []
 	dimdict = dict([(dim.name, dim) for dim in config.dimensions.keys()])
+	_metrics.clear()
+	_profile()
 	for name, par_rows in iter:
+		if name == METRICSKEY:
+			# The metrics of a map task
+			out.add(name, par_rows)
+			continue
 		rows = par_rows
 		dimension = dimdict.get(name)
 		if not dimension in opened_dims:
 			dimension.open_shelveddb()
 			opened_dims.append(dimension)
+			_budgetcaches(opened_dims)
 		rowhandlers = config.dimensions[dimension].get('rowhandlers',[])
 		namemapping = config.dimensions[dimension].get('namemappings',{})
 		for row in rows:
+			_metrics.incr('shuffle.bytes', len(row))
 			row = eval(row)
 			for handler in rowhandlers:
 				handler(row, namemapping)
+			start = time.time()
 			dimension.ensure(row, namemapping)
+			_metrics.observe('ensure.%s' % name, time.time()-start)
+			_metrics.incr('rows.%s' % name)
+			_tickbudget()
+			_progress()
 
 	for dimension in opened_dims:
 		out.add(dimension.shelvedpath, this_host())
 		dimension.endload()
+	out.add(*_metricsresult(opened_dims))
 	#config.connection.commit()
 
 
@@ -181,13 +303,26 @@ def fact_map_init(row, params):
 		for dim in refdims:
 			dims.add(dim)
 	for dim in dims:
-		if dim.is_bigdim():
+		if dim.is_bigdim() and getattr(params, 'dimpartitions', 0):
+			# The lookups are routed to the partitions of the keys
+			dim.open_shelveddb(readonly=True, npartitions=params.dimpartitions, \
+			                   seed=getattr(params, 'partitionseed', 0), \
+			                   consistent=getattr(params, 'consistentpartitioning', False))
+		elif dim.is_bigdim():
 			dim.open_shelveddb(taskid=this_partition(),readonly=True)
 		else:
 			dim.open_shelveddb(readonly=True)
+	_budgetcaches(dims)
+	_metrics.clear()
+	_profile()
+	openfactcheckpoints(params, config)
 
 def fact_map_func(row, params):
-	facts = config.facts.keys()
+	# The facts whose checkpoints are not after the row (all without them)
+	facts = factstoload(row, config.facts.keys())
+	_metrics.incr('rows.read')
+	if not facts:
+		_metrics.incr('rows.skipped')
 	for fact in facts:
 		refereddims = config.facts[fact].get('refdims',[])
 		namemappings = config.facts[fact].get('namemappings', {})
@@ -195,10 +330,16 @@ def fact_map_func(row, params):
 		for handler in rowhandlers:
 			handler(row)
 		for dim in refereddims:
+			start = time.time()
 			row[dim.key] = dim.lookup(row, namemappings)
+			_metrics.observe('lookup.%s' % dim.name, time.time()-start)
 		start = time.time()
 		fact.insert(row)
-		params.totalcopytime += time.time()-start
+		elapsed = time.time()-start
+		params.totalcopytime += elapsed
+		_metrics.observe('insert.%s' % fact.name, elapsed)
+	_tickbudget()
+	_progress()
 	return []
 
 def fact_combiner_func(key, value, comb_buffer, flush, params):
@@ -206,6 +347,8 @@ def fact_combiner_func(key, value, comb_buffer, flush, params):
 		facts = config.facts.keys()
 		for fact in facts:
 			fact.endload()
+		closefactcheckpoints()
+		return [_metricsresult(facts + [dim for fact in facts for dim in config.facts[fact].get('refdims',[])])]
 		#config.connection.commit()
 	#	msg("TotalCopyTime=%d"%params.totalcopytime)
 
@@ -242,11 +385,72 @@ def scp_file(shelvedpath, hostname):
 	else:
 		print >> sys.stderr, "%s ok" % hostname
 
+def _sshcommand():
+	ssh = ["ssh"]
+	if "SSH_KEY" in os.environ:
+		ssh += ["-i", os.environ["SSH_KEY"]]
+	return ssh
+
+def _userhost(hostname):
+	user = os.environ.get("SSH_USER", "")
+	if user:
+		return "%s@%s" % (user, hostname)
+	return hostname
+
+def rsync_command(path, holder, target, appendonly=False):
+	'''
+	Return the command that copies the file at path from the host holder to
+	the same path on the host target by rsync. The data is compressed on
+	the wire and an unchanged file is skipped by its checksum. A changed
+	file is sent as a delta or, if appendonly, only its new end is sent.
+	When holder is not this host, rsync is run on holder by ssh
+	'''
+	ssh = _sshcommand()
+	rsync = ["rsync", "-z", "--partial", "--inplace", "-e", " ".join(ssh)]
+	if appendonly:
+		rsync.append("--append-verify")
+	else:
+		rsync.append("--checksum")
+	rsync += [path, "%s:%s" % (_userhost(target), path)]
+	if holder == socket.getfqdn():
+		return rsync
+	return ssh + [_userhost(holder), " ".join([pipes.quote(arg) for arg in rsync])]
+
+def distribute_files(paths_addrs, servers, fanout=2, appendonly=False):
+	'''
+	Copy each file to all servers by rsync in a tree: in each round, every
+	host that has a file copies it to up to fanout hosts that do not, and
+	all the copies of a round run in parallel. A file thus reaches N hosts
+	in about log(N)/log(fanout+1) rounds. Return the (path, host) pairs
+	that failed
+	'''
+	holders = {} # path -> hosts having the file
+	remaining = {} # path -> hosts to copy the file to
+	for path, addr in paths_addrs:
+		holders[path] = [addr]
+		remaining[path] = [server for server in servers if server != addr]
+	failed = []
+	while [path for path in remaining if remaining[path]]:
+		copies = []
+		for path, targets in remaining.iteritems():
+			for holder in list(holders[path]):
+				for i in range(min(fanout, len(targets))):
+					target = targets.pop(0)
+					cmd = rsync_command(path, holder, target, appendonly)
+					copies.append((path, target, Popen(cmd)))
+		for path, target, process in copies:
+			if process.wait():
+				print >> sys.stderr, "Copying %s to %s failed" % (path, target)
+				failed.append((path, target))
+			else:
+				holders[path].append(target)
+	return failed
+
 def pre_fill_dimensions():
 	path_addr = {}
-	from config import prefilleddims
+	from config import prefilleddims, UDF_createConnection
+	prefill_dimensions(prefilleddims, UDF_createConnection)
 	for dim in prefilleddims:
-		dim.shelve_prefill_dim()
 		path_addr[dim.shelvedpath] = socket.getfqdn()
 	return path_addr
 
@@ -264,45 +468,145 @@ def sync_dims_across_servers(results):
 			if addr in ['127.0.0.1', 'localhost']:
 				addr = socket.getfqdn()
 			servers.add(addr)
-	prefilldim_addr = pre_fill_dimensions()
-	for path, addr in prefilldim_addr.iteritems():
-		targetservers = servers - set([addr])
-		for target in targetservers:
-			scp_file(path, target)
-
+	paths_addrs = pre_fill_dimensions().items()
 	for path, addr in result_iterator(results):
+		if path == METRICSKEY:
+			# The metrics of a task, not a shelve
+			continue
 		if addr in ['127.0.0.1', 'localhost']:
 			addr = socket.getfqdn()
-		targetservers = servers - set([addr])
-		for target in targetservers:
-			scp_file(path, target)
-
+		paths_addrs.append((path, addr))
+
+	if Popen('which rsync'.split()).wait() != 0:
+		# Without rsync, each file is copied to each server by scp
+		for path, addr in paths_addrs:
+			for target in servers - set([addr]):
+				scp_file(path, target)
+		return
+	try:
+		from config import distributefanout as fanout
+	except ImportError:
+		fanout = 2
+	try:
+		from config import appendonlyshelves as appendonly
+	except ImportError:
+		appendonly = False
+	failed = distribute_files(paths_addrs, sorted(servers), fanout, appendonly)
+	if failed:
+		raise Exception, "Copying the offline dimensions failed for %s" % \
+			', '.join(["%s to %s" % (path, host) for path, host in failed])
+
+
+def _copylines(shelveddb, ncolumns):
+	'''
+	Generate the rows of an offline dimension store as lines in the text
+	format of COPY. The store is read one member at a time
+	'''
+	for key, rows in shelveddb.iteritems():
+		for row in rows:
+			yield tsvline(row[:ncolumns])
 
-def golive(config, shelvedb_paths=[]):
-	if shelvedb_paths:
-		csvfilepath = None
+class _CopyPipe(object):
+	'''
+	A file-like object that COPY FROM reads the lines of a generator from
+	such that the rows are streamed into the DW without a temporary file
+	'''
+	def __init__(self, lines):
+		self.lines = lines
+		self.buffer = ''
+
+	def read(self, size=-1):
+		chunks = [self.buffer]
+		length = len(self.buffer)
+		for line in self.lines:
+			chunks.append(line)
+			length += len(line)
+			if size >= 0 and length >= size:
+				break
+		data = ''.join(chunks)
+		if size < 0:
+			self.buffer = ''
+			return data
+		self.buffer = data[size:]
+		return data[:size]
+
+	def readline(self, size=-1):
+		if self.buffer:
+			line, self.buffer = self.buffer, ''
+			return line
+		return next(self.lines, '')
+
+	def __iter__(self):
+		while True:
+			line = self.readline()
+			if not line:
+				break
+			yield line
+
+def golive_one(config, shelvedb_path):
+	'''
+	Copy an offline dimension store into its table in the DW
+	'''
+	columns = []
+	name = shelvedb_path.rpartition('/')[-1]
+	for dimension in config.dimensions:
+		if name==dimension.name:
+			columns = dimension.all
+			break
+	start = time.time()
+	shelveddb = LRUShelve(shelvedb_path, 2000, readonly=True)
+	try:
+		config.UDF_pgcopy(name, columns, '\t', '\n', '\\N', \
+		                  _CopyPipe(_copylines(shelveddb, len(columns))))
+	finally:
+		shelveddb.close()
+	print "Golive of %s: %f seconds" % (name, time.time()-start)
+
+def _golive_process(config, shelvedb_path):
+	# Each process copies on a connection of its own. The process leaves by
+	# os._exit such that the connections it inherited are not closed
+	status = 1
+	try:
+		try:
+			config.connection = config.UDF_createConnection()
+			golive_one(config, shelvedb_path)
+			config.connection.close()
+			status = 0
+		except Exception, e:
+			print >> sys.stderr, "Golive of %s failed: %s" % (shelvedb_path, e)
+	finally:
+		sys.stdout.flush()
+		sys.stderr.flush()
+		os._exit(status)
+
+def golive(config, shelvedb_paths=[], processes=None):
+	'''
+	Copy the offline dimension stores into the DW. The stores are copied
+	in parallel by up to processes (default: config.goliveprocesses or 4)
+	processes, each on its own connection made by config.UDF_createConnection.
+	Without UDF_createConnection, they are copied one at a time
+	'''
+	if not shelvedb_paths:
+		return
+	if processes is None:
+		processes = getattr(config, 'goliveprocesses', 4)
+	if processes <= 1 or len(shelvedb_paths) == 1 or \
+			not hasattr(config, 'UDF_createConnection'):
 		for shelvedb_path in shelvedb_paths:
-			columns = []
-			name = shelvedb_path.rpartition('/')[-1]
-			for dimension in config.dimensions:
-				if name==dimension.name:
-					columns = dimension.all
-					break				
-			shelveddb = LRUShelve(shelvedb_path, 2000, readonly=True)
-			fd, csvfilepath = tempfile.mkstemp(suffix='.csv', prefix=name)
-			tmpfile = file(csvfilepath, 'w')
-			csvwriter = UnicodeWriter(tmpfile, delimiter='\t')          
-			for key, rows in shelveddb.iterms():
-				for row in rows:
-					values = []
-					for i in range(len(columns)):
-						value = row[i]
-						if value == None:
-							value = ''
-						values.append(value)
-					csvwriter.writerow(values)
-			tmpfile.close()
-			os.close(fd)
-			config.UDF_pgcopy(name, columns, '\t', None, '', file(csvfilepath))
-			shelveddb.close()
-			os.remove(csvfilepath)
\ No newline at end of file
+			golive_one(config, shelvedb_path)
+		return
+	running = []
+	failed = []
+	pending = list(shelvedb_paths)
+	while pending or running:
+		while pending and len(running) < processes:
+			shelvedb_path = pending.pop(0)
+			process = Process(target=_golive_process, args=(config, shelvedb_path))
+			process.start()
+			running.append((process, shelvedb_path))
+		process, shelvedb_path = running.pop(0)
+		process.join()
+		if process.exitcode:
+			failed.append(shelvedb_path)
+	if failed:
+		raise Exception, "Golive failed for %s" % ', '.join(failed)
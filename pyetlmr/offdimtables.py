@@ -19,8 +19,10 @@
 import types, tempfile, os, time
 import pyetlmr as etlmr
 from lrustore import LRUShelve
+from partitionedstore import PartitionedShelve
+from versionindex import VersionIndex
 from disco.util import msg
-from unicodecsv import UnicodeWriter
+from unicodecsv import TSVWriter
 
 __author__ = "Xiufeng Liu"
 __maintainer__ = "Xiufeng Liu"
@@ -33,7 +35,8 @@ class CachedDimension(object):
 
 	def __init__(self, name, key, attributes, lookupatts=(), defaultidvalue=None, 
 	             targetconnection=None, shelvedpath=None, cachesize=2000, 
-	             prefill=False, bigdim=False):
+	             prefill=False, bigdim=False, cachepolicy='lru', 
+	             cachememory=None):
 
 		if not type(key) in types.StringTypes:
 			raise ValueError, "Key argument must be a string"
@@ -59,17 +62,47 @@ class CachedDimension(object):
 
 		self.shelvedpath = shelvedpath
 		self.cachesize = cachesize
+		self.cachepolicy = cachepolicy # See pyetlmr.caches
+		self.cachememory = cachememory # Bytes, bounds the cache if given
 		self.shelveddb = None
 		self.prefill = prefill
 		self.bigdim = bigdim
 		self.bigdimid = 0
 
 
-	def open_shelveddb(self, taskid=None, readonly=False):
+	def open_shelveddb(self, taskid=None, readonly=False, npartitions=None,
+	                   seed=0, consistent=False):
+		'''Open the offline dimension. If npartitions is given, the members
+		   are partitioned by their lookup attributes into the shelves at
+		   shelvedpath%d (see pyetlmr.partitionedstore). A task that writes
+		   only writes the partition taskid. seed and consistent choose the
+		   partitioning (see pyetlmr.partitioning.partitionof).'''
+		if self.shelveddb is None and npartitions:
+			self.shelveddb = PartitionedShelve(self.shelvedpath + "%d",
+			                                   npartitions, self.cachesize,
+			                                   readonly=readonly,
+			                                   policy=self.cachepolicy,
+			                                   maxbytes=self.cachememory,
+			                                   owned=None if readonly else [taskid],
+			                                   seed=seed, consistent=consistent)
 		if self.shelveddb is None:
 			if taskid is not None:
 				self.shelvedpath = (self.shelvedpath + "%d") % taskid
-			self.shelveddb = LRUShelve(self.shelvedpath, self.cachesize, readonly=readonly)
+			self.shelveddb = LRUShelve(self.shelvedpath, self.cachesize, 
+			                           readonly=readonly, policy=self.cachepolicy,
+			                           maxbytes=self.cachememory)
+
+	def cachestats(self):
+		if self.shelveddb is None:
+			return {}
+		return {'shelve' : self.shelveddb.cachestats()}
+
+	def getcaches(self):
+		if self.shelveddb is None:
+			return []
+		if isinstance(self.shelveddb, PartitionedShelve):
+			return self.shelveddb.caches()
+		return [self.shelveddb.cacheDict.cache]
 
 	def is_bigdim(self):
 		return self.bigdim
@@ -88,18 +121,30 @@ class CachedDimension(object):
 			return self.shelveddb.get_nextid()
 
 
-	def shelve_prefill_dim(self):
+	def shelve_prefill_dim(self, targetconnection=None):
+		'''Copy the rows of the dimension table into the offline dimension.
+		   Return the number of rows copied. A separate targetconnection
+		   may be given such that several dimensions can be prefilled
+		   concurrently (see pyetlmr.prefill).'''
+		nrows = 0
 		if self.prefill:
+			if targetconnection is None:
+				targetconnection = self.con
 			self.open_shelveddb()
 			sql = 'SELECT %s FROM %s' % (','.join(self.all), self.name)
-			self.con.execute(sql)
-			for row in self.con.fetchalltuples():
+			targetconnection.execute(sql)
+			for row in targetconnection.fetchalltuples():
 				nrow = dict(zip(self.all, row))
 				searchtuple = tuple(nrow[n] for n in self.lookupatts)
 				rows = self.shelveddb.get(searchtuple, [])
 				rows.append(row)
 				self.shelveddb[searchtuple] = rows
+				nrows += 1
 			del self.shelveddb
+			self.shelveddb = None
+		return nrows
+
+	prefillcache = shelve_prefill_dim
 
 	def lookup(self, row, namemapping={}):
 		namesinrow =[(namemapping.get(a) or a) for a in self.lookupatts]
@@ -143,14 +188,14 @@ class CachedDimension(object):
 			try:
 				fd, csvfilepath = tempfile.mkstemp(suffix='.csv', prefix=self.name)
 				tmpfile = file(csvfilepath, 'w')
-				csvwriter = UnicodeWriter(tmpfile, delimiter='\t')          
+				csvwriter = TSVWriter(tmpfile)
 				for k in self.shelveddb:
 					csvwriter.writerows(self.shelveddb[k])
-				tmpfile.close()
+				csvwriter.close()
 				os.close(fd)
 				curs = self.con.cursor()
 				curs.execute('TRUNCATE %s' % self.name)
-				curs.copy_from(file=file(csvfilepath), table=self.name, sep='\t', null='', columns=self.all)
+				curs.copy_from(file=file(csvfilepath), table=self.name, sep='\t', null='\\N', columns=self.all)
 			finally:
 				if curs:
 					curs.close()
@@ -169,10 +214,12 @@ class SlowlyChangingDimension(CachedDimension):
 	def __init__(self, name, key, attributes, lookupatts, versionatt, 
 		         fromatt=None, toatt=None, srcdateatt=None, srcdateparser=etlmr.ymdparser,
 		         type1atts=(), defaultidvalue=None, targetconnection=None,shelvedpath=None, 
-	             cachesize=2000, prefill=False, bigdim=False):
+	             cachesize=2000, prefill=False, bigdim=False, cachepolicy='lru',
+	             cachememory=None, indexversions=False):
 		
 		CachedDimension.__init__(self, name, key, attributes, lookupatts, defaultidvalue, 
-		                         targetconnection, shelvedpath, cachesize, prefill, bigdim)
+		                         targetconnection, shelvedpath, cachesize, prefill, bigdim,
+		                         cachepolicy, cachememory)
 		if not versionatt:
 			raise ValueError, 'A version attribute must be given'
 
@@ -194,25 +241,67 @@ class SlowlyChangingDimension(CachedDimension):
 			if var and var not in attributes:
 				raise ValueError, "%s not present in attributes argument" % (var,)
 
+		# The positions of the key and the validity dates in the stored rows
+		self.keypos = self.all.index(key)
+		self.frompos = fromatt and self.all.index(fromatt)
+		self.topos = toatt and self.all.index(toatt)
+
+		# An optional index of the versions ordered by fromatt such that
+		# lookup can find the version valid at a date by bisection. It is
+		# bounded like the cache as the shelve may not fit in memory.
+		self.versionindex = None
+		if indexversions:
+			if not (fromatt and srcdateatt):
+				raise ValueError, "fromatt and srcdateatt are needed for indexversions"
+			self.versionindex = VersionIndex(cachesize, cachememory)
+
 	def lookup(self, row, namemapping={}):
+		if self.versionindex is not None and not self.type1atts:
+			return self.__indexedlookup(row, namemapping)
 		searchtuple, rows = self._get_rows(row, namemapping)
 		if rows is None:
 			return  self.defaultidvalue
 		else:
 			if self.type1atts:
-				nrow = dict(zip(self.all, rows[0]))
-				return nrow[self.key]
-			else:   
-				size = len(rows)
-				for i in xrange(1, size+1):
-					nrow = dict(zip(self.all, rows[-i]))
-					validfrom = nrow[self.fromatt]
-					validto = nrow.get(self.toatt) or  '9999-12-31' 
-					srcdate = row[namemapping.get(self.srcdateatt) or self.srcdateatt]
-					if validfrom<=srcdate and srcdate < validto:
-						return nrow[self.key]
+				return rows[0][self.keypos]
+			else:
+				srcdate = row[namemapping.get(self.srcdateatt) or self.srcdateatt]
+				frompos, topos = self.frompos, self.topos
+				for i in xrange(len(rows) - 1, -1, -1): # The newest first
+					version = rows[i]
+					validto = (topos and version[topos]) or '9999-12-31'
+					if version[frompos] <= srcdate and srcdate < validto:
+						return version[self.keypos]
 				return self.defaultidvalue
 
+	def __indexedlookup(self, row, namemapping):
+		searchtuple = tuple(row[(namemapping.get(a) or a)] for a in self.lookupatts)
+		indexkey = str(searchtuple) # As in the shelve, see prefillversions
+		if indexkey not in self.versionindex:
+			# Read the versions of the member from the shelve once
+			self.__indexversions(indexkey, self.shelveddb.get(searchtuple) or [])
+		srcdate = row[namemapping.get(self.srcdateatt) or self.srcdateatt]
+		return self.versionindex.lookup(indexkey, srcdate, self.defaultidvalue)
+
+	def __indexversions(self, indexkey, rows):
+		topos = self.topos
+		self.versionindex.setversions(indexkey,
+			[(r[self.frompos], topos and r[topos] or None, r[self.keypos]) for r in rows])
+
+	def prefillversions(self):
+		'''Read the versions of the members in the opened shelve into the
+		   version index until it holds cachesize members. Return the number
+		   of members read.'''
+		if self.versionindex is None:
+			return 0
+		nmembers = 0
+		for indexkey, rows in self.shelveddb.iteritems():
+			if self.cachesize and nmembers >= self.cachesize:
+				break
+			self.__indexversions(indexkey, rows)
+			nmembers += 1
+		return nmembers
+
 	def _get_rows(self, row, namemapping={}):
 		namesinrow =[(namemapping.get(a) or a) for a in self.lookupatts]
 		searchtuple = tuple(row[n] for n in namesinrow)
@@ -296,9 +385,14 @@ class SlowlyChangingDimension(CachedDimension):
 
 	def ensure(self, row, namemapping={}):
 		if self.type1atts:
-			return self._type1_ensure(row, namemapping)
+			res = self._type1_ensure(row, namemapping)
 		else:
-			return self._type2_ensure(row, namemapping)
+			res = self._type2_ensure(row, namemapping)
+		if self.versionindex is not None:
+			# The versions of the member may have changed
+			searchtuple = tuple(row[(namemapping.get(a) or a)] for a in self.lookupatts)
+			self.versionindex.discard(str(searchtuple))
+		return res
 
 
 SCDimension = SlowlyChangingDimension
@@ -351,6 +445,13 @@ class BulkFactTable(object):
 
 		self.bulksize = bulksize
 		self.__count = 0
+		# Counters read by pyetlmr.metrics.recordbulkloads
+		self.bulkloads = 0
+		self.bulkloadbytes = 0
+		self.bulkloadseconds = 0.0
+		# An optional function f(table) called before each bulk load, e.g.,
+		# by pyetlmr.checkpoint.FactCheckpointer
+		self.beforebulkload = None
 		self.__ready = True
 
 		if nullsubst is None:
@@ -414,7 +515,10 @@ class BulkFactTable(object):
 	def __bulkloadnow(self):
 		start = time.time()
 		self.tempdest.flush()
+		self.bulkloadbytes += self.tempdest.tell()
 		self.tempdest.seek(0)
+		if self.beforebulkload is not None:
+			self.beforebulkload(self)
 		self.bulkloader(self.name, self.all, 
 				        self.fieldsep, self.rowsep, self.nullsubst,
 				        self.tempdest)
@@ -422,6 +526,8 @@ class BulkFactTable(object):
 		self.tempdest.truncate(0)
 		self.__count = 0
 		end = time.time()
+		self.bulkloads += 1
+		self.bulkloadseconds += end - start
 
 	def endload(self):
 		"""Finalize the load."""
@@ -17,15 +17,22 @@ Usage: python etlmr.py [options] input_paths
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import os, getopt, sys, time, socket, multiprocessing
+import os, getopt, sys, time, socket, multiprocessing, json, shutil, imp
 from thread import *
 from optparse import OptionParser
 from os import getenv
 import pyetlmr
-from conf import config
 from disco.core import Disco, Params, result_iterator
 import offdimetlmr, odotetlmr, odatetlmr
 from postfix import post_fix
+from datedimension import DateDimension
+from metrics import Metrics, METRICSKEY
+from profiling import costtable, formatcosttable, SAMPLES
+from spool import spool_combiner_func
+from manifest import Manifest
+from mapreader import map_csv_reader_pos
+from checkpoint import CheckpointTable
+from partitionedstore import partitionfiles
 
 __author__ = "Xiufeng Liu"
 __maintainer__ = "Xiufeng Liu"
@@ -77,37 +84,159 @@ def seq_server():
 		start_new_thread(client_thread ,(conn, seq))
 	s.close()    
 
+# The metrics of the tasks of each job merged by collect_results
+jobmetrics = {}
+
+def collect_results(jobname, results):
+	'''
+	Return the keys of the results of a job. The metrics of the tasks are
+	merged into jobmetrics[jobname] instead
+	'''
+	keys = []
+	merged = jobmetrics.setdefault(jobname, Metrics())
+	if results!=None:
+		for key,value in result_iterator(results):
+			if key==METRICSKEY:
+				merged.merge(Metrics.fromjson(value))
+			else:
+				keys.append(key)
+	print "Metrics of %s: %s" % (jobname, merged.progressline())
+	if costtable(merged) or [n for n in merged.counters if n.startswith(SAMPLES)]:
+		# The UDFs and tables were profiled (see config.profileudfs)
+		for line in formatcosttable(merged):
+			print line
+	return keys
+
+def write_metrics_report(path):
+	'''
+	Write the merged metrics of all jobs as JSON to path
+	'''
+	report = dict([(name, m.todict()) for name, m in jobmetrics.iteritems()])
+	reportfile = open(path, 'w')
+	try:
+		json.dump(report, reportfile, indent=2, sort_keys=True)
+	finally:
+		reportfile.close()
+	print "Wrote the metrics report to %s" % path
+
+def input_files(input_paths):
+	'''
+	Return the paths of the files in the given directories
+	'''
+	files = []
+	for input_path in input_paths:
+		files.extend([os.path.join(input_path, f) for f in sorted(os.listdir(input_path)) \
+		              if os.path.isfile(os.path.join(input_path, f))])
+	return files
+
+def input_urls(files, disco_master):
+	'''
+	Return the dfs:// urls of the given files which must be under
+	$DISCO_HOME/root/input
+	'''
+	disco_home = os.environ["DISCO_HOME"]
+	root = os.path.join(disco_home, 'root', 'input')
+	return ['dfs://%s%s' % (disco_master, f.partition(root)[2]) for f in files]
+
+def partition_atts():
+	'''
+	Return the attributes the input is partitioned by: config.partitionatts
+	or else the lookup attributes of the one big dimension. None if neither
+	is given. They are also given to the jobs (see map_csv_reader_bkey)
+	'''
+	atts = getattr(config, 'partitionatts', None)
+	if not atts:
+		# Only the dimensions of the offline method can be big
+		bigdims = [dim for dim in config.dimensions if getattr(dim, 'bigdim', False)]
+		if len(bigdims) != 1:
+			return None
+		atts = bigdims[0].lookupatts
+	return list(atts)
+
+def partition_input(files, npartitions, directory):
+	'''
+	Split the input files into npartitions files in directory by the lookup
+	attributes of the big dimensions (or config.partitionatts) such that
+	map task i of a dimension job gets the members of partition i (see
+	partitionedstore). Return the paths of the files
+	'''
+	atts = partition_atts()
+	if not atts:
+		raise ValueError, 'Set config.partitionatts to the lookup attributes to partition by'
+	return partitionfiles(files, atts, npartitions, directory, \
+	                      seed=getattr(config, 'partitionseed', 0), \
+	                      consistent=getattr(config, 'consistentpartitioning', False))
+
+def fill_datedims(config):
+	'''
+	Insert the rows of the date dimensions before the dimension jobs start
+	such that the workers only compute the keys of the dates
+	'''
+	for dim in config.dimensions:
+		if isinstance(dim, DateDimension):
+			print "Filling %s with %d rows ..." % (dim.name, dim.fill())
+			dim.targetconnection.commit()
+
 def load_dim(master, input, config_path, nr_maps=1, \
              nr_reduces=1, load_method=offdimetlmr, \
-             post_fixing=-1, go_live=1, profile=False):
+             post_fixing=-1, go_live=1, profile=False, spooldir=None, \
+             disco_master=None, checkpoint=None, dimpartitions=0):
+	'''
+	Load the dimensions. If spooldir is given, the first dimension job
+	spools the rows to it (see spool) and the following jobs read the spool
+	files instead of the input. Return the urls of the input to read the
+	rows from after the dimensions are loaded
+	'''
 	try:
 		order = config.order
 	except Exception:
 		order = [config.dimensions.keys()]
 
 	dim_starttime = time.time()
+	fill_datedims(config)
 	for dims in order:
 		dimnames = repr([dim.name for dim in dims])
 		print "Loading %s ..." % str(dimnames)
 		load_one_dim(master, input, config_path, nr_maps,\
-		             nr_reduces, load_method, dimnames, go_live, profile)
+		             nr_reduces, load_method, dimnames, go_live, profile,\
+		             spooldir, checkpoint, dimpartitions)
+		if spooldir:
+			spoolfiles = [f for f in input_files([spooldir]) \
+			              if not os.path.basename(f).startswith('.')]
+			if len(spoolfiles) != len(input):
+				raise Exception, "Found %d spool files for %d map tasks in %s. " \
+				    "The spool directory must be shared by the driver and the " \
+				    "workers" % (len(spoolfiles), len(input), spooldir)
+			input = input_urls(spoolfiles, disco_master)
+			print "Spooled the rows to %d files in %s" % (len(input), spooldir)
+			spooldir = None
 	dim_endtime = time.time()
 	print "Time of loading dimensions: %f seconds" % (dim_endtime-dim_starttime)
 	
 	if post_fixing==1:
 		post_fix(config)
+	return input
 	
 def load_one_dim(master, input, config_path, nr_maps=1, nr_reduces=1,\
                  load_method=offdimetlmr, dimnames= repr([]), \
-                 go_live=1, profile=False):
+                 go_live=1, profile=False, spooldir=None, checkpoint=None, \
+                 dimpartitions=0):
+	'''
+	Run a dimension job. checkpoint is None or a dict with the resume and
+	interval settings of the checkpoints of the shelves (see checkpoint)
+	'''
+	combiner = load_method.dim_combiner_func
+	if spooldir and combiner is None:
+		# The spool files of the map tasks are closed by a combiner
+		combiner = spool_combiner_func
 	dim_job = master.new_job(
 		name = 'dim',
 		input = input,
 		map_init = load_method.dim_map_init,
-		map_reader = load_method.map_reader,
+		map_reader = checkpoint and map_csv_reader_pos or load_method.map_reader,
 		map = load_method.dim_map_func,
 	        partition = load_method.dim_partition_func,
-		combiner = load_method.dim_combiner_func,
+		combiner = combiner,
 		reduce = load_method.dim_reduce_func,
 		scheduler = {'max_cores': nr_maps},
 		nr_reduces = nr_reduces,
@@ -115,27 +244,46 @@ def load_one_dim(master, input, config_path, nr_maps=1, nr_reduces=1,\
 		profile = profile,
 		status_interval = 1000000,
 		params = Params(count=0, dimnames=dimnames, \
-	                        nr_maps=nr_maps, nr_reduces=nr_reduces)
+	                        nr_maps=nr_maps, nr_reduces=nr_reduces, \
+	                        spooldir=spooldir or '', \
+	                        checkpoint=checkpoint and 'dim' or '', \
+	                        resume=checkpoint and checkpoint['resume'] or False, \
+	                        checkpointinterval=checkpoint and checkpoint['interval'] or 0, \
+	                        dimpartitions=dimpartitions, \
+	                        partitionatts=partition_atts(), \
+	                        partitionseed=getattr(config, 'partitionseed', 0), \
+	                        consistentpartitioning=getattr(config, 'consistentpartitioning', False))
 	)
 	results = dim_job.wait()
-	shelvedb_paths = []
+	shelvedb_paths = collect_results('dim %s' % dimnames, results)
 	if results!=None:
-		for key,value in result_iterator(results):
-			shelvedb_paths.append(key)
 		if go_live==1:
 			load_method.golive(config, shelvedb_paths)
 	#results = dim_job.wait(show=True, poll_interval = 100, timeout = 10*3600)
 	#dim_job.purge()
 
 def load_fact(master, input, config_path, nr_maps=1, nr_reduces=1, \
-              load_method=offdimetlmr, profile=False):
+              load_method=offdimetlmr, profile=False, checkpoint=None, \
+              dimpartitions=0):
+	'''
+	Run the fact job. If checkpoint is given (see load_one_dim), the bulk
+	loads are checkpointed. Unless the job resumes, the checkpoints of an
+	earlier run are deleted first. They are deleted when the job succeeds
+	'''
 	#disco = Disco("disco://"+host)
 	fact_starttime = time.time()
+	checkpoints = None
+	if checkpoint:
+		checkpoints = CheckpointTable(config.connection, \
+		                              getattr(config, 'checkpointtable', 'etlmr_checkpoint'), \
+		                              create=True)
+		if not checkpoint['resume']:
+			checkpoints.clear('fact')
 	fact_job = master.new_job(
 		name = 'fact',
 		input = input,
 		map_init = load_method.fact_map_init,
-		map_reader = load_method.map_reader,
+		map_reader = checkpoint and map_csv_reader_pos or load_method.map_reader,
 		map = load_method.fact_map_func,
 		combiner = load_method.fact_combiner_func,
 		scheduler = {'max_cores': nr_maps},
@@ -144,9 +292,17 @@ def load_fact(master, input, config_path, nr_maps=1, nr_reduces=1, \
 		status_interval = 1000000,
 		profile = profile,
 		params = Params(totalcopytime=0, nr_maps=nr_maps, \
-	                        nr_reduces=nr_reduces)
+	                        nr_reduces=nr_reduces, \
+	                        checkpoint=checkpoint and 'fact' or '', \
+	                        dimpartitions=dimpartitions, \
+	                        partitionatts=partition_atts(), \
+	                        partitionseed=getattr(config, 'partitionseed', 0), \
+	                        consistentpartitioning=getattr(config, 'consistentpartitioning', False))
 	)
 	results = fact_job.wait()
+	collect_results('fact', results)
+	if checkpoints is not None and results!=None:
+		checkpoints.clear('fact')
 	#results = fact_job.wait(show=True, poll_interval = 100, timeout = 10*3600)
 	fact_endtime = time.time()
 	print "Time of loading facts: %f seconds" % (fact_endtime-fact_starttime)
@@ -169,7 +325,7 @@ if __name__== "__main__":
 	parser.add_option('--load-step',
 	                  default=1,
 	                  help='Loading step (default=1): 1. Load dimensions; \
-	                  2. Load facts')
+	                  2. Load facts; 3. Load dimensions and facts reading the input once')
 	parser.add_option('--load-method',
 	                  default=1,
 	                  help='Loading method of dimensions (default=1): 1. Online ODOT; \
@@ -183,11 +339,34 @@ if __name__== "__main__":
 	parser.add_option('--profile',
 	                  default=False,
 	                  help='Profile (default=False)')
+	parser.add_option('--metrics-report',
+	                  default=None,
+	                  help='Write the metrics of the jobs as JSON to this path (default=None)')
 	parser.add_option('--config',
 	                  default='conf/config.py',
 	                  help='The path to config.py (default=conf/config.py)')
+	parser.add_option('--manifest',
+	                  default=None,
+	                  help='Load only the input files that the manifest at this path does not record as loaded by the load step, and record them (default=None)')
+	parser.add_option('--spool-dir',
+	                  default=None,
+	                  help='Directory under $DISCO_HOME/root/input for the spooled rows of load step 3. It must be shared by the driver and the workers (default=a new one)')
+	parser.add_option('--checkpoint',
+	                  action='store_true', default=False,
+	                  help='Checkpoint the bulk loads of the facts and the shelves of big dimensions such that a failed load can be resumed (default=False)')
+	parser.add_option('--resume',
+	                  action='store_true', default=False,
+	                  help='Resume a failed load from its checkpoints, implies --checkpoint (default=False)')
+	parser.add_option('--dim-partitions',
+	                  default=0,
+	                  help='Partition the big dimensions of the offline method into this many shelves by their lookup attributes such that the facts can be read in any layout. Load step 1 splits the input into as many files (default=0, one shelve per map task)')
+	parser.add_option('--checkpoint-interval',
+	                  default=1000000,
+	                  help='Rows between the checkpoints of the shelves of big dimensions (default=1000000)')
 
 	(options, input_paths) = parser.parse_args()
+	# The driver uses the same config as the workers (see required_modules)
+	config = imp.load_source('config', options.config)
 	master = Disco("disco://"+options.disco_master)	
 	
 	load_method = odotetlmr
@@ -196,36 +375,105 @@ if __name__== "__main__":
 	load_step = int(options.load_step)
 	if options.load_method=='2':
 		load_method = odatetlmr
-		if  load_step==1:
+		if  load_step in (1, 3):
 			post_fixing = int(options.post_fix)
 			seq_process = multiprocessing.Process(target=seq_server)
 			seq_process.start()		
 	elif options.load_method=='3':
 		load_method = offdimetlmr
 		
-	input_file_urls = []	
-	for input_path in input_paths:
-		input_files = [f for f in os.listdir(input_path) if \
-		               os.path.isfile(os.path.join(input_path, f))]
-		prefix = input_path.partition(os.path.join(disco_home, 'root', 'input'))[2]
-		input_file_urls.extend(['dfs://%s%s' % (options.disco_master, \
-		                                        os.path.join(prefix, f)) \
-		                        for f in input_files])
+	dimpartitions = 0
+	if options.load_method=='3':
+		dimpartitions = int(options.dim_partitions)
+	checkpoint = None
+	if options.checkpoint or options.resume:
+		if load_step==3:
+			# The positions would be in the spool files, which are new in each run
+			parser.error('--checkpoint and --resume need load step 1 or 2')
+		checkpoint = {'resume' : options.resume, \
+		              'interval' : int(options.checkpoint_interval)}
+
+	run_starttime = time.time()
+	files = input_files(input_paths)
+	manifest = None
+	if options.manifest and load_step in (1, 2, 3):
+		# Skip the files that have been loaded (see manifest)
+		manifest = Manifest(options.manifest)
+		allfiles = len(files)
+		files = manifest.select(files, load_step)
+		print "%d of %d input files are new or changed" % (len(files), allfiles)
+		if not files:
+			if seq_process:
+				seq_process.terminate()
+			sys.exit(0)
+	input_file_urls = input_urls(files, options.disco_master)
 	print "input_file_urls=%s" % str(input_file_urls)
 	if load_step==1:
-		load_dim(master, input_file_urls, config_path=options.config,\
-		         nr_maps=int(options.nr_maps), 
-		         nr_reduces=int(options.nr_reducers), load_method=load_method, \
-		         post_fixing=post_fixing, go_live=int(options.go_live), profile=options.profile)
+		partitiondir = None
+		dim_input_urls = input_file_urls
+		if dimpartitions:
+			# Map task i gets the file of partition i
+			partitiondir = os.path.join(disco_home, 'root', 'input', \
+			                            'partitions-%d-%d' % (os.getpid(), time.time()))
+			os.makedirs(partitiondir)
+			dim_input_urls = input_urls(partition_input(files, dimpartitions, partitiondir), \
+			                            options.disco_master)
+		try:
+			load_dim(master, dim_input_urls, config_path=options.config,\
+			         nr_maps=int(options.nr_maps), 
+			         nr_reduces=int(options.nr_reducers), load_method=load_method, \
+			         post_fixing=post_fixing, go_live=int(options.go_live), profile=options.profile, \
+			         checkpoint=checkpoint, dimpartitions=dimpartitions)
+		finally:
+			if partitiondir:
+				shutil.rmtree(partitiondir, ignore_errors=True)
 		if seq_process:
 			seq_process.terminate()		
 	elif load_step==2:
 		load_fact(master, input_file_urls, config_path=options.config, \
 		          nr_maps=int(options.nr_maps), 
 		         nr_reduces=int(options.nr_reducers),load_method=load_method,\
-		         profile=options.profile)
+		         profile=options.profile, checkpoint=checkpoint, \
+		         dimpartitions=dimpartitions)
+	elif load_step==3:
+		if dimpartitions:
+			parser.error('--dim-partitions needs load step 1 or 2')
+		# The first dimension job spools the rows needed by the other
+		# dimension jobs and the fact job such that the input is read once
+		spooldir = options.spool_dir or \
+		           os.path.join(disco_home, 'root', 'input', \
+		                        'spool-%d-%d' % (os.getpid(), time.time()))
+		if not os.path.isdir(spooldir):
+			os.makedirs(spooldir)
+		try:
+			spooled_urls = load_dim(master, input_file_urls, \
+			         config_path=options.config, nr_maps=int(options.nr_maps), 
+			         nr_reduces=int(options.nr_reducers), load_method=load_method, \
+			         post_fixing=post_fixing, go_live=int(options.go_live), \
+			         profile=options.profile, spooldir=spooldir, \
+			         disco_master=options.disco_master)
+			if seq_process:
+				seq_process.terminate()
+			load_fact(master, spooled_urls, config_path=options.config, \
+			          nr_maps=int(options.nr_maps), 
+			          nr_reduces=int(options.nr_reducers),load_method=load_method,\
+			          profile=options.profile)
+		finally:
+			if not options.spool_dir:
+				shutil.rmtree(spooldir, ignore_errors=True)
 	else:
 		parser.print_help()
+	if manifest is not None:
+		counters = {}
+		for metrics in jobmetrics.itervalues():
+			for name, n in metrics.counters.iteritems():
+				if name.startswith('rows.'):
+					counters[name] = counters.get(name, 0) + n
+		runid = manifest.record(files, load_step, int(options.load_method), \
+		                        counters, run_starttime)
+		print "Recorded %d input files as run %d in %s" % (len(files), runid, options.manifest)
+	if options.metrics_report and jobmetrics:
+		write_metrics_report(options.metrics_report)
 		
 	
 	
\ No newline at end of file
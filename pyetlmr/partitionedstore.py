@@ -0,0 +1,221 @@
+"""
+  Big dimension stores split into partitions by a stable hash of the
+  lookup attributes.
+
+  A big dimension (bigdim=True) of the offline method is written by the map
+  tasks of the dimension job into one shelve per task (shelvedpath%d).
+  Without partitioning, a fact map task can only look up the members in
+  the shelve of the task with its own number, such that the fact input must
+  be laid out exactly like the dimension input. When the members are
+  partitioned by their lookup attributes (i.e., dimension task i
+  gets the rows whose key is in partition i, see mapreader.
+  map_csv_reader_bkey and partitionfiles), a PartitionedShelve routes each
+  lookup to the partition holding the key. The fact job can then read any
+  input layout with any number of map tasks. The partitions are opened
+  when they are first used. The keys are put in partitions by
+  partitioning.partitionof, which is the same in all processes.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import csv
+import os
+from lrustore import LRUShelve
+from partitioning import partitionof
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['PartitionedShelve', 'partitionfiles']
+
+
+class PartitionedShelve(object):
+    """A store of npartitions LRUShelves, one per partition, at the paths
+       pathpattern % i. It offers the methods of LRUShelve that the
+       dimensions use, and routes each key to its partition."""
+
+    def __init__(self, pathpattern, npartitions, cachesize, readonly=True,
+                 policy='lru', maxbytes=None, owned=None, seed=0,
+                 consistent=False):
+        """Arguments:
+           - pathpattern: the path of the partitions with %d for the number
+           - npartitions: the number of partitions
+           - cachesize: the size of the cache of each opened partition
+           - readonly: open the partitions read-only. Default: True
+           - policy: the cache policy (see pyetlmr.caches). Default: 'lru'
+           - maxbytes: bounds the memory of each cache if given
+           - owned: the partitions that may be written, e.g., the one of
+             this task. Writing a key of another partition raises a
+             ValueError, as another task writes it. The other partitions
+             are only opened read-only, and only if they exist.
+             Default: all
+           - seed, consistent: the partitioning (see
+             partitioning.partitionof). Default: 0, False
+        """
+        if npartitions < 1:
+            raise ValueError, "npartitions must be positive"
+        self.pathpattern = pathpattern
+        self.npartitions = npartitions
+        self.cachesize = cachesize
+        self.readonly = readonly
+        self.policy = policy
+        self.maxbytes = maxbytes
+        self.owned = set(owned) if owned is not None else None
+        self.seed = seed
+        self.consistent = consistent
+        self.onsync = None
+        self.__partitions = {}
+
+    def partition(self, i):
+        """Return the LRUShelve of partition i, opening it if needed. None is
+           returned if the partition cannot be written and does not exist."""
+        shelve = self.__partitions.get(i)
+        if shelve is None:
+            path = self.pathpattern % i
+            readonly = not self.__writes(i)
+            if readonly and not self.__exists(path):
+                # No task wrote a member to this partition
+                return None
+            shelve = self.__partitions[i] = \
+                LRUShelve(path, self.cachesize, readonly=readonly,
+                          policy=self.policy, maxbytes=self.maxbytes)
+        return shelve
+
+    def __writes(self, i):
+        return not self.readonly and (self.owned is None or i in self.owned)
+
+    def __exists(self, path):
+        # The dbm modules may add a suffix to the path
+        directory, name = os.path.split(path)
+        return [f for f in os.listdir(directory or '.')
+                if f == name or f.startswith(name + '.')] != []
+
+    def partitionof(self, key):
+        return partitionof(key, self.npartitions, self.seed, self.consistent)
+
+    def get(self, key, default=None):
+        shelve = self.partition(self.partitionof(key))
+        if shelve is None:
+            return default
+        return shelve.get(key, default)
+
+    def __getitem__(self, key):
+        shelve = self.partition(self.partitionof(key))
+        if shelve is None:
+            raise KeyError, key
+        return shelve[key]
+
+    def __setitem__(self, key, value):
+        i = self.partitionof(key)
+        if self.owned is not None and i not in self.owned:
+            raise ValueError, "%r is in partition %d, which this store does " \
+                "not write. Is the input partitioned by the key?" % (key, i)
+        self.partition(i)[key] = value
+
+    def __len__(self):
+        return sum([len(self.partition(i) or ()) for i in
+                    range(self.npartitions)])
+
+    def iteritems(self):
+        for i in range(self.npartitions):
+            shelve = self.partition(i)
+            if shelve is not None:
+                for item in shelve.iteritems():
+                    yield item
+
+    def iterkeys(self):
+        for (key, value) in self.iteritems():
+            yield key
+
+    def iterms(self):
+        return list(self.iteritems())
+
+    def cachestats(self):
+        """Return the sums of the numeric stats of the opened caches."""
+        res = {}
+        for shelve in self.__partitions.values():
+            for (name, value) in shelve.cachestats().items():
+                if isinstance(value, (int, long, float)):
+                    res[name] = res.get(name, 0) + value
+        return res
+
+    def caches(self):
+        """Return the caches of the opened partitions."""
+        return [shelve.cacheDict.cache for shelve in
+                self.__partitions.values()]
+
+    def sync(self):
+        for (i, shelve) in self.__partitions.items():
+            if self.__writes(i):
+                shelve.sync()
+        if self.onsync is not None:
+            self.onsync(self)
+
+    def close(self):
+        for shelve in self.__partitions.values():
+            shelve.close()
+        self.__partitions = {}
+
+
+def partitionfiles(paths, atts, npartitions, outputdir, prefix='part',
+                   seed=0, consistent=False):
+    """Split tab-separated input files with a header into npartitions files
+       (prefix-0.csv, ...) in outputdir such that the rows with the same
+       values of atts are in the same file, i.e., partitionof. The files can
+       be given as the input of a dimension job where the map task i must
+       get the file of partition i. Return the paths of the files.
+
+       Arguments:
+       - paths: the paths of the input files
+       - atts: the names of the fields to partition by, e.g., the lookup
+         attributes of a big dimension. Their values must not be changed by
+         the rowhandlers as the values in the files are hashed
+       - npartitions: the number of partitions
+       - outputdir: the directory to write the files to
+       - prefix: the prefix of the names of the files. Default: 'part'
+       - seed, consistent: the partitioning (see partitioning.partitionof).
+         Default: 0, False
+    """
+    outputpaths = [os.path.join(outputdir, '%s-%d.csv' % (prefix, i))
+                   for i in range(npartitions)]
+    outputfiles = [open(path, 'wb') for path in outputpaths]
+    try:
+        writers = [csv.writer(f, delimiter='\t', lineterminator='\n')
+                   for f in outputfiles]
+        header = None
+        for path in paths:
+            inputfile = open(path, 'rb')
+            try:
+                reader = csv.reader(inputfile, delimiter='\t')
+                fields = reader.next()
+                if header is None:
+                    header = fields
+                    for writer in writers:
+                        writer.writerow(header)
+                elif fields != header:
+                    raise ValueError, "%s has another header than %s" % \
+                        (path, paths[0])
+                indexes = [fields.index(att) for att in atts]
+                for row in reader:
+                    key = tuple([row[i] for i in indexes])
+                    writers[partitionof(key, npartitions, seed,
+                                        consistent)].writerow(row)
+            finally:
+                inputfile.close()
+    finally:
+        for f in outputfiles:
+            f.close()
+    return outputpaths
@@ -12,7 +12,10 @@
 #  You should have received a copy of the GNU General Public License  
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.  
 #  
-import types, time
+import types, time, sys
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+import pyetlmr
 from conf import config
 
 __author__ = "Xiufeng Liu"
@@ -38,63 +41,167 @@ class Table(object):
     def set_root(self, root=True):
         self.root = root
         
-    def del_duplicate_rows(self):
-        sql = 'delete from %s where %s not in (select max(%s) from %s group by %s)' % \
-        (self.tablename, self.pkey, self.pkey, self.tablename, ','.join(self.duplicateattrs))
+    def get_fixmap(self):
+        return '%s_fixmap' % (self.tablename,)
+
+    def build_fixmap(self, temporary=True):
+        '''
+        create a table (oldid, newid) mapping the ids of the duplicate records
+        to the id kept for them (the largest). Return the name of the table or
+        None if there are no duplicates. The table must not be temporary if
+        the parent table is fixed on another connection
+        '''
+        if self.root:
+            return None
+        fixmap = self.get_fixmap()
+        self.targetconnection.execute('drop table if exists %s' % (fixmap,))
+        sql = 'create ' + (temporary and 'temporary ' or '') + 'table %s as select oldid, newid from ' \
+              '(select %s as oldid, max(%s) over (partition by %s) as newid from %s) as ids ' \
+              'where oldid <> newid' % \
+              (fixmap, self.pkey, self.pkey, ','.join(self.duplicateattrs), self.tablename)
+        self.targetconnection.execute(sql)
+        self.targetconnection.execute('select count(*) from %s' % (fixmap,))
+        if not self.targetconnection.fetchonetuple()[0]:
+            self.targetconnection.execute('drop table %s' % (fixmap,))
+            return None
+        self.targetconnection.execute('analyze %s' % (fixmap,))
+        return fixmap
+
+    def del_duplicate_rows(self, fixmap):
+        sql = 'delete from %s using %s where %s.%s = %s.oldid' % \
+        (self.tablename, fixmap, self.tablename, self.pkey, fixmap)
         self.targetconnection.execute(sql)
   
     def add_primarykey(self):
         sql = 'alter table %s add primary key(%s)' % (self.tablename, self.pkey)
         self.targetconnection.execute(sql)
 
-    def get_fixedidlist(self):
-        '''
-        return the value as [[1, 3], [2, 4]] where the duplicate records are shown
-        '''
-        if not self.root:
-            sql = 'select %s, %s from %s order by %s' %  \
-            (self.pkey, ','.join(self.duplicateattrs), self.tablename,  ','.join(self.duplicateattrs)) 
-            self.targetconnection.execute(sql)
-            duplicatevalues = None
-            dup_ids = {}
-            while True:
-                row = self.targetconnection.fetchonetuple()
-                if not row[0]:
-                    break
-                idlist = dup_ids.get(row[1:], [])
-                idlist.append(row[0])
-                dup_ids[row[1:]] = idlist
-                
-            fixedidlist = []
-            for idlist in dup_ids.values():
-                if len(idlist)>1:
-                    idlist.sort()
-                    fixedidlist.append(idlist)
-            return fixedidlist
-                               
-        
-    def update_foreignref(self, fkey, fixedidlist):
-        for idlist in fixedidlist:
-            sql = 'update %s set %s=%d where %s in (%s)' % \
-            (self.tablename, fkey, idlist[-1], fkey, ','.join(map(str,idlist[:-1])))
-            self.targetconnection.execute(sql)
-            
+    def update_foreignref(self, fkey, fixmap):
+        sql = 'update %s set %s = %s.newid from %s where %s.%s = %s.oldid' % \
+        (self.tablename, fkey, fixmap, fixmap, self.tablename, fkey, fixmap)
+        self.targetconnection.execute(sql)
             
     def fix(self):
-        fkey_fixidlist = {}
+        '''
+        fix the referenced tables, point the foreign keys to the kept records
+        and delete the duplicate records. Return the name of the fixmap of
+        this table (see build_fixmap) or None
+        '''
+        fkey_fixmap = {}
         for reftab in self.reftables:
-            fixedidlist = reftab.fix()
-            fkey_fixidlist[reftab.get_pkey()] = fixedidlist     
-           
-        for fkey, fixedidlist in fkey_fixidlist.iteritems():
-            self.update_foreignref(fkey, fixedidlist)
+            fixmap = reftab.fix()
+            if fixmap:
+                fkey_fixmap[reftab.get_pkey()] = fixmap
+        return self.fixone(fkey_fixmap)
+
+    def fixone(self, fkey_fixmap, temporary=True):
+        '''
+        fix this table when the referenced tables have been fixed. fkey_fixmap
+        maps the foreign keys to the fixmaps of the referenced tables
+        '''
+        for fkey, fixmap in fkey_fixmap.iteritems():
+            self.update_foreignref(fkey, fixmap)
+            self.targetconnection.execute('drop table %s' % (fixmap,))
             
-        fidlist = self.get_fixedidlist()  
-        if not self.root: # No duplicate rows to be deleted in the root dimension
-	    self.del_duplicate_rows()
+        # The foreign keys are fixed now, so the duplicates can be found
+        fixmap = self.build_fixmap(temporary)
+        if fixmap: # No duplicate rows to be deleted in the root dimension
+            self.del_duplicate_rows(fixmap)
             #self.add_primarykey()
         self.targetconnection.commit()
-        return fidlist
+        return fixmap
+
+
+def fix_concurrently(root, connectionfactory, maxworkers=None):
+    '''
+    fix the tables of the snowflake with the given root like root.fix(), but
+    tables that do not depend on each other are fixed at the same time, each
+    on its own connection from connectionfactory. A table is fixed when the
+    tables it references have been fixed
+    '''
+    parents = {}
+    waiting = {}
+    fkey_fixmaps = {}
+    tables = [root]
+    for table in tables:
+        waiting[table] = len(table.reftables)
+        fkey_fixmaps[table] = {}
+        for reftab in table.reftables:
+            parents[reftab] = table
+            tables.append(reftab)
+    # The factory typically makes each new connection the default one
+    defaultconnection = pyetlmr.getdefaulttargetconnection()
+
+    def fixtable(table):
+        # Everything is inside the try such that the callback always gets a
+        # result. Otherwise, the pool would swallow the exception and the
+        # loop below would wait forever
+        connection = None
+        oldconnection = table.targetconnection
+        try:
+            try:
+                connection = connectionfactory()
+                table.targetconnection = connection
+                return (table, table.fixone(fkey_fixmaps[table], temporary=False), None)
+            except Exception:
+                if connection is not None:
+                    # close() would commit what was done
+                    connection.rollback()
+                return (table, None, sys.exc_info())
+        finally:
+            table.targetconnection = oldconnection
+            if connection is not None:
+                connection.close()
+
+    def dropfixmaps():
+        # The fixmaps are not temporary, so those that were made but not
+        # used when a table failed must be dropped
+        fixmaps = [fixmap for fixmaps in fkey_fixmaps.values()
+                   for fixmap in fixmaps.values()]
+        while not finished.empty():
+            (table, fixmap, excinfo) = finished.get()
+            if fixmap:
+                fixmaps.append(fixmap)
+        if not fixmaps:
+            return
+        connection = connectionfactory()
+        try:
+            for fixmap in fixmaps:
+                connection.execute('drop table if exists %s' % (fixmap,))
+            connection.commit()
+        finally:
+            connection.close()
+
+    finished = Queue()
+    pool = ThreadPool(maxworkers or len(tables))
+    failed = False
+    try:
+        for table in tables:
+            if not table.reftables:
+                pool.apply_async(fixtable, (table,), callback=finished.put)
+        while True:
+            (table, fixmap, excinfo) = finished.get()
+            if excinfo is not None:
+                failed = True
+                raise excinfo[0], excinfo[1], excinfo[2]
+            if table is root:
+                return fixmap
+            parent = parents[table]
+            if fixmap:
+                fkey_fixmaps[parent][table.get_pkey()] = fixmap
+            waiting[parent] -= 1
+            if waiting[parent] == 0:
+                pool.apply_async(fixtable, (parent,), callback=finished.put)
+    finally:
+        pool.close()
+        pool.join()
+        if failed:
+            try:
+                dropfixmaps()
+            except Exception, ex:
+                print "Could not drop the fixmaps: %s" % (ex,)
+        if defaultconnection is not None:
+            defaultconnection.setasdefault()
 
 
 def __build_snowflake(snflkdim, startdim, connection):
@@ -143,7 +250,13 @@ def post_fix(config):
         postfix_starttime = time.time()
         rootdim = __build_snowflake(snflkdim, snflkdim[0][0], connection)
         rootdim.set_root()
-        rootdim.fix()
+        connectionfactory = getattr(config, 'UDF_createConnection', None)
+        if connectionfactory:
+            # Independent branches of the snowflake are fixed concurrently
+            fix_concurrently(rootdim, connectionfactory, 
+                             getattr(config, 'postfixworkers', None))
+        else:
+            rootdim.fix()
 	postfix_endtime = time.time()
 	print "Post-fixing time: %f" % (postfix_endtime-postfix_starttime)        
 
@@ -0,0 +1,81 @@
+"""
+  A coordinator for filling the caches of several dimensions at the start 
+  of a job. The dimensions are filled concurrently, each on its own 
+  connection, such that the start-up time is bounded by the largest 
+  dimension instead of the sum of all of them.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#  
+#  This file is free software: you may copy, redistribute and/or modify it  
+#  under the terms of the GNU General Public License version 2 
+#  as published by the Free Software Foundation.
+#  
+#  This file is distributed in the hope that it will be useful, but  
+#  WITHOUT ANY WARRANTY; without even the implied warranty of  
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU  
+#  General Public License for more details.  
+#  
+#  You should have received a copy of the GNU General Public License  
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.  
+#  
+import time
+from multiprocessing.pool import ThreadPool
+import pyetlmr
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['prefill_dimensions']
+
+
+def prefill_dimensions(dimensions, connectionfactory, maxworkers=None, 
+                       report=True):
+    """Fill the caches of the given dimensions concurrently.
+
+       Return a dict {dimension name: (number of rows, seconds)}.
+
+       Arguments:
+       - dimensions: a sequence of dimensions offering a method
+         prefillcache(targetconnection) that returns the number of rows read,
+         i.e., CachedDimension from odattables, odottables or offdimtables.
+       - connectionfactory: a function() -> ConnectionWrapper. It is called
+         once per dimension and the connection is closed again when the 
+         dimension has been filled (e.g., config.UDF_createConnection).
+       - maxworkers: the maximum number of dimensions to fill at the same
+         time. If None, all dimensions are filled at the same time.
+       - report: a flag deciding if the duration and the number of rows
+         are printed for each dimension. Default: True
+    """
+    dimensions = list(dimensions)
+    if not dimensions:
+        return {}
+    # The factory typically makes each new connection the default one, but
+    # the dimensions were declared with the current default.
+    defaultconnection = pyetlmr.getdefaulttargetconnection()
+
+    def fill(dimension):
+        connection = connectionfactory()
+        try:
+            starttime = time.time()
+            nrows = dimension.prefillcache(connection)
+            return (dimension.name, nrows, time.time() - starttime)
+        finally:
+            connection.close()
+
+    pool = ThreadPool(maxworkers or len(dimensions))
+    try:
+        results = pool.map(fill, dimensions)
+    finally:
+        pool.close()
+        pool.join()
+        if defaultconnection is not None:
+            defaultconnection.setasdefault()
+
+    stats = {}
+    for (name, nrows, seconds) in results:
+        stats[name] = (nrows, seconds)
+        if report:
+            print "Prefilled %s: %d rows in %f seconds" % (name, nrows, seconds)
+    return stats
@@ -0,0 +1,198 @@
+"""
+  Opt-in profiling of the user-defined parts of a load.
+
+  instrument wraps the rowhandlers of a config, the ensure, lookup and
+  insert methods of its dimensions and fact tables and the bulkloaders of
+  its bulk tables such that their calls are counted and timed in a Metrics
+  instance (see pyetlmr.metrics). The metrics are merged across the workers
+  like the other metrics, and costtable turns them into a table of the calls
+  and seconds per UDF and table method.
+
+  SamplingProfiler counts which functions the process is in at a fixed
+  interval of CPU time, which also finds hot spots inside the UDFs.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import signal
+import time
+from functools import wraps
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['profiled', 'instrument', 'SamplingProfiler', 'costtable',
+           'formatcosttable']
+
+
+# The prefixes of the names profiled calls and samples are recorded under
+CALLS = 'profile.calls.'
+TIMES = 'profile.seconds.'
+SAMPLES = 'profile.samples.'
+
+
+def profiled(name, func, metrics, every=1):
+    """Return a function that calls func and records the call in metrics.
+
+       All calls are counted in the counter CALLS + name. Every every'th
+       call is timed in the histogram TIMES + name such that the cost of
+       the timing can be kept down for cheap functions.
+    """
+    if getattr(func, 'profiledname', None) is not None:
+        return func # Already wrapped
+    callsname = CALLS + name
+    timesname = TIMES + name
+    counter = [0]
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        counter[0] += 1
+        if counter[0] % every:
+            metrics.incr(callsname)
+            return func(*args, **kwargs)
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.observe(timesname, time.time() - start)
+            metrics.incr(callsname)
+    wrapper.profiledname = name
+    return wrapper
+
+
+def __wrapmethods(table, methods, metrics, every):
+    for method in methods:
+        func = getattr(table, method, None)
+        if callable(func):
+            setattr(table, method,
+                    profiled("%s.%s" % (method, table.name), func, metrics,
+                             every))
+
+
+def __wraphandlers(settings, metrics, every):
+    rowhandlers = settings.get('rowhandlers')
+    if rowhandlers:
+        settings['rowhandlers'] = tuple([
+                profiled("udf.%s" % (getattr(h, '__name__', repr(h)),), h,
+                         metrics, every) for h in rowhandlers])
+
+
+def instrument(config, metrics, every=1):
+    """Wrap the rowhandlers, tables and bulkloaders of the config (see
+       profiled). Calling it again for the same config does nothing.
+
+       Arguments:
+       - config: a config module with the dicts dimensions and facts
+       - metrics: the Metrics instance to record the calls in
+       - every: time every every'th call. Default: 1
+    """
+    if getattr(config, '_profiled', False):
+        return
+    config._profiled = True
+    for (dim, settings) in getattr(config, 'dimensions', {}).items():
+        __wraphandlers(settings, metrics, every)
+        dims = [dim]
+        if getattr(dim, 'levels', None):
+            # A SnowflakedDimension. Also wrap the participating dimensions.
+            for leveldims in dim.levels.values():
+                dims.extend(leveldims)
+        for d in dims:
+            __wrapmethods(d, ('ensure', 'lookup', 'scdlookup', 'insert'),
+                          metrics, every)
+            if callable(getattr(d, 'bulkloader', None)):
+                d.bulkloader = profiled("bulkloader.%s" % (d.name,),
+                                        d.bulkloader, metrics, 1)
+    for (fact, settings) in getattr(config, 'facts', {}).items():
+        __wraphandlers(settings, metrics, every)
+        __wrapmethods(fact, ('insert',), metrics, every)
+        if callable(getattr(fact, 'bulkloader', None)):
+            fact.bulkloader = profiled("bulkloader.%s" % (fact.name,),
+                                       fact.bulkloader, metrics, 1)
+
+
+class SamplingProfiler(object):
+    """Counts the function the process is in every interval seconds of CPU
+       time in the counters SAMPLES + 'file:function'. Uses SIGPROF and can
+       thus only be used in the main thread on Unix.
+
+       The samples are counted in a dict of their own and added to the
+       metrics by stop, as the signal handler may run while the counters of
+       the metrics are being read or changed."""
+
+    def __init__(self, metrics, interval=0.01):
+        self.metrics = metrics
+        self.interval = interval
+        self.running = False
+        self.samples = {}
+
+    def __sample(self, signum, frame):
+        if frame is not None:
+            code = frame.f_code
+            name = "%s%s:%s" % (SAMPLES, os.path.basename(code.co_filename),
+                                code.co_name)
+            self.samples[name] = self.samples.get(name, 0) + 1
+
+    def start(self):
+        """Start sampling."""
+        if not self.running:
+            signal.signal(signal.SIGPROF, self.__sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+            self.running = True
+
+    def stop(self):
+        """Stop sampling and add the samples to the metrics."""
+        if self.running:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+            self.running = False
+        samples, self.samples = self.samples, {}
+        for (name, n) in samples.iteritems():
+            self.metrics.incr(name, n)
+
+
+def costtable(metrics):
+    """Return a list of (name, calls, estimated seconds, seconds per call)
+       for the profiled calls in metrics sorted by the seconds (the largest
+       first). The seconds are estimated from the timed calls."""
+    res = []
+    for (countername, calls) in metrics.counters.iteritems():
+        if not countername.startswith(CALLS):
+            continue
+        name = countername[len(CALLS):]
+        hist = metrics.histograms.get(TIMES + name)
+        percall = hist and hist.count and hist.total / hist.count or 0.0
+        res.append((name, calls, percall * calls, percall))
+    res.sort(key=lambda row: row[2], reverse=True)
+    return res
+
+
+def formatcosttable(metrics, limit=30):
+    """Return the cost table (see costtable) and the most sampled functions
+       as lines of text."""
+    lines = ["%-50s %12s %12s %12s" % ('UDF/method', 'calls', 'seconds',
+                                       'usec/call')]
+    for (name, calls, seconds, percall) in costtable(metrics)[:limit]:
+        lines.append("%-50s %12d %12.3f %12.1f" % (name, calls, seconds,
+                                                   percall * 1e6))
+    samples = [(n, name[len(SAMPLES):]) for (name, n) in
+               metrics.counters.iteritems() if name.startswith(SAMPLES)]
+    if samples:
+        samples.sort(reverse=True)
+        total = float(sum([n for (n, name) in samples]))
+        lines.append("%-50s %12s %12s" % ('Sampled function', 'samples', '%'))
+        for (n, name) in samples[:limit]:
+            lines.append("%-50s %12d %12.1f" % (name, n, 100 * n / total))
+    return lines
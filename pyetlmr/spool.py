@@ -0,0 +1,151 @@
+"""
+  Spooling of the source rows for loading the dimensions and the facts
+  from one read of the input (see paralleletl.py --load-step 3).
+
+  When the first dimension job is given a spool directory, each of its map
+  tasks writes the fields of the rows that the dimensions and the facts use
+  (see spoolfields) to a file of its own in the directory. The files are
+  tab-separated with a header like the input files and can thus be read by
+  the same map readers, but they only hold the needed fields and are much
+  smaller than the input. The following dimension jobs and the fact job
+  read the spool files instead of the input.
+
+  The driver lists the spool directory, so it must be on a filesystem that
+  the driver and all the workers share (or all run on one node). The driver
+  checks that there is a spool file for each map task.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import csv
+import os
+from metrics import getmetrics, recordmemory, METRICSKEY
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['spoolfields', 'SpoolWriter', 'openspool', 'spoolrow',
+           'closespool', 'spool_combiner_func']
+
+
+def spoolfields(config):
+    """Return the sorted names of the source fields the dimensions and facts
+       of the config use.
+
+       config.spoolfields is used if it is set. Otherwise, the fields are
+       the srcfields of the dimensions and facts and, for the facts, the
+       (mapped) lookup attributes of their refdims, the srcdateatt of slowly
+       changing refdims and the keyrefs and measures. Fields that are not
+       in the input are left out when the first row is spooled.
+    """
+    fields = getattr(config, 'spoolfields', None)
+    if fields:
+        return sorted(fields)
+    fields = set()
+    for settings in config.dimensions.values():
+        fields.update(settings.get('srcfields', ()))
+    for (fact, settings) in config.facts.items():
+        fields.update(settings.get('srcfields', ()))
+        namemapping = settings.get('namemappings', {})
+        atts = list(getattr(fact, 'all', ())) # The keyrefs and measures
+        for dim in settings.get('refdims', ()):
+            atts.extend(getattr(dim, 'lookupatts', ()))
+            if getattr(dim, 'srcdateatt', None):
+                atts.append(dim.srcdateatt)
+        fields.update([namemapping.get(att) or att for att in atts])
+    return sorted(fields)
+
+
+class SpoolWriter(object):
+    """Writes the given fields of rows to a tab-separated file with a
+       header. The file is named by the number of the map task (spool-
+       00003.csv) such that the spool files sort in the order of the map
+       tasks and fact task i reads the rows of dimension task i (the offline
+       method opens the shelves of the big dimensions by task number). The
+       rows are written to a hidden temporary file which is renamed when the
+       task is done, such that a failed attempt of a task leaves no spool
+       file behind. Fields that are not in the first row (e.g., fields set
+       by rowhandlers) are left out."""
+
+    def __init__(self, directory, fields, partition, prefix='spool'):
+        self.directory = directory
+        self.fields = fields
+        self.path = os.path.join(directory, '%s-%05d.csv' % (prefix, partition))
+        self.tmppath = os.path.join(directory, '.%s-%05d.csv.tmp' % \
+                                    (prefix, partition))
+        self.rows = 0
+        self.__file = None
+        self.__writer = None
+
+    def __open(self):
+        self.__file = open(self.tmppath, 'wb')
+        self.__writer = csv.writer(self.__file, delimiter='\t',
+                                   lineterminator='\n')
+        self.__writer.writerow(self.fields)
+
+    def write(self, row):
+        """Write the fields of the row."""
+        if self.__file is None:
+            self.fields = [field for field in self.fields if field in row]
+            self.__open()
+        self.__writer.writerow([row.get(field, '') for field in self.fields])
+        self.rows += 1
+
+    def close(self):
+        """Close the file and give it its final name. A task without rows
+           writes a file with only the header such that the files stay in
+           step with the tasks. Return the path."""
+        if self.__file is None:
+            self.__open()
+        self.__file.close()
+        self.__file = None
+        os.rename(self.tmppath, self.path)
+        return self.path
+
+
+_writer = None
+
+def openspool(params, config, partition):
+    """Start spooling the rows of the map task with the number partition
+       (this_partition()) if params.spooldir is set."""
+    global _writer
+    spooldir = getattr(params, 'spooldir', None)
+    if spooldir and _writer is None:
+        _writer = SpoolWriter(spooldir, spoolfields(config), partition)
+
+def spoolrow(row):
+    """Spool the row if this task spools."""
+    if _writer is not None:
+        _writer.write(row)
+
+def closespool():
+    """Close the spool file of this task. Return its path or None."""
+    global _writer
+    if _writer is None:
+        return None
+    path = _writer.close()
+    _writer = None
+    return path
+
+def spool_combiner_func(key, value, comb_buffer, done, params):
+    """A combiner that passes the pairs on. When the map task is done, it
+       closes the spool file and sends the metrics of the task (see
+       pyetlmr.metrics). For dimension jobs that have no combiner."""
+    if done:
+        closespool()
+        recordmemory()
+        return [(METRICSKEY, getmetrics().tojson())]
+    return [(key, value)]
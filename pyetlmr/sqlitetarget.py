@@ -0,0 +1,277 @@
+"""
+  SQLite as the DW target, e.g., for local runs, benchmarks and small
+  single-node loads without a PostgreSQL server.
+
+  SQLiteConnectionWrapper offers the methods of pyetlmr.ConnectionWrapper
+  for a sqlite3 connection and translates the 'pyformat' parameters the
+  tables use (%(name)s and %s) into those of sqlite3 (:name and ?).
+  copyfrom emulates PostgreSQL's COPY for the bulkloaders of the bulk
+  tables by inserting the rows of the file by executemany in one
+  transaction. connect opens a database file in WAL mode (such that the
+  tasks can read while another one writes) or an in-memory database.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import re
+import sqlite3
+from sys import modules
+import pyetlmr
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['translate', 'SQLiteConnectionWrapper', 'connect', 'copyfrom',
+           'bulkloader']
+
+
+MEMORY = ':memory:'
+
+_pyformat = re.compile(r"%\((\w+)\)s|%s|%%")
+
+def _toqmark(match):
+    if match.group(1) is not None:
+        return ':' + match.group(1)
+    if match.group(0) == '%s':
+        return '?'
+    return '%'
+
+# The escapes of the text format of COPY (see unicodecsv.tsvline). A
+# backslash before any other character stands for the character itself.
+_copyescape = re.compile(r"\\(.)", re.DOTALL)
+_copyescapes = {'t' : '\t', 'n' : '\n', 'r' : '\r', 'b' : '\b', 'f' : '\f',
+                'v' : '\v'}
+
+def _uncopyescape(match):
+    char = match.group(1)
+    return _copyescapes.get(char, char)
+
+def _copyvalue(value, nullval):
+    if value == nullval:
+        return None
+    if '\\' in value:
+        return _copyescape.sub(_uncopyescape, value)
+    return value
+
+@pyetlmr.memoize(1000)
+def translate(stmt):
+    """Return the statement with the 'pyformat' parameters %(name)s and %s
+       replaced by the sqlite3 parameters :name and ? (and %% by %)."""
+    return _pyformat.sub(_toqmark, stmt)
+
+
+class SQLiteConnectionWrapper(object):
+    """A ConnectionWrapper for sqlite3 connections.
+
+       This class offers the same methods as ConnectionWrapper. The
+       documentation is not repeated here.
+    """
+
+    def __init__(self, connection):
+        self.__connection = connection
+        self.__cursor = connection.cursor()
+        self.__close = False
+        self.nametranslator = lambda s: s
+
+    def execute(self, stmt, arguments=None, namemapping=None):
+        if namemapping and arguments:
+            arguments = pyetlmr.copy(arguments, **namemapping)
+        if arguments is None:
+            arguments = ()
+        self.__cursor.execute(translate(stmt), arguments)
+
+    def executemany(self, stmt, params):
+        self.__cursor.executemany(translate(stmt), params)
+
+    def executescript(self, script):
+        """Execute a script of SQL statements (without parameters). The
+           running transaction is committed first."""
+        self.__connection.executescript(script)
+
+    def rowfactory(self, names=None):
+        rows = self.__cursor
+        self.__cursor = self.__connection.cursor()
+        if names is None:
+            names = [self.nametranslator(t[0]) for t in rows.description]
+        return pyetlmr.rowfactory(rows, names, True)
+
+    # sqlite3 sets rowcount to -1 for queries. Thus, whether there is a
+    # result is told by the description instead.
+    def fetchone(self, names=None):
+        if self.__cursor.description is None:
+            return {}
+        if names is None:
+            names = [self.nametranslator(t[0]) for t in
+                     self.__cursor.description]
+        values = self.__cursor.fetchone()
+        if values is None:
+            return dict([(n, None) for n in names])#A row with each att = None
+        else:
+            return dict(zip(names, values))
+
+    def fetchonetuple(self):
+        if self.__cursor.description is None:
+            return ()
+        values = self.__cursor.fetchone()
+        if values is None:
+            return (None, ) * len(self.__cursor.description)
+        else:
+            return values
+
+    def fetchmanytuples(self, cnt):
+        if self.__cursor.description is None:
+            return []
+        return self.__cursor.fetchmany(cnt)
+
+    def fetchalltuples(self):
+        if self.__cursor.description is None:
+            return []
+        return self.__cursor.fetchall()
+
+    def rowcount(self):
+        return self.__cursor.rowcount
+
+    def getunderlyingmodule(self):
+        return modules[self.__connection.__class__.__module__]
+
+    def commit(self):
+        self.__connection.commit()
+
+    def isclose(self):
+        return self.__close
+
+    def close(self):
+        if not self.__close:
+            self.__connection.commit()
+            self.__cursor.close()
+            self.__connection.close()
+            self.__close = True
+
+    def rollback(self):
+        self.__connection.rollback()
+
+    def setasdefault(self):
+        # The default is kept in pyetlmr such that getdefaulttargetconnection
+        # finds it
+        pyetlmr._defaulttargetconnection = self
+
+    def cursor(self):
+        return self.__connection.cursor()
+
+    def __del__(self):
+        self.close()
+
+
+def connect(path=MEMORY, wal=True, synchronous='NORMAL', timeout=60.0,
+            schema=None, setasdefault=True):
+    """Open a SQLite database and return a SQLiteConnectionWrapper for it.
+
+       Arguments:
+       - path: the path of the database file or ':memory:' for an in-memory
+         database which only lives as long as the connection and is only
+         seen by it. Default: ':memory:'
+       - wal: use write-ahead logging such that readers do not block the
+         writer (ignored for in-memory databases). Default: True
+       - synchronous: the value of PRAGMA synchronous. NORMAL is safe with
+         WAL; OFF is faster but may lose the last transactions if the
+         machine crashes. Default: 'NORMAL'
+       - timeout: the seconds to wait for another connection's write lock.
+         Default: 60.0
+       - schema: an optional path to a SQL script creating the tables, which
+         is run when the database has no tables
+       - setasdefault: make the connection the default target connection.
+         Default: True
+    """
+    conn = sqlite3.connect(path, timeout=timeout)
+    # The values read from the source files are byte strings
+    conn.text_factory = str
+    if wal and path != MEMORY:
+        conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=%s' % (synchronous,))
+    wrappedconn = SQLiteConnectionWrapper(conn)
+    if schema is not None:
+        wrappedconn.execute("SELECT count(*) FROM sqlite_master "
+                            "WHERE type = 'table'")
+        if not wrappedconn.fetchonetuple()[0]:
+            schemafile = open(schema)
+            try:
+                wrappedconn.executescript(schemafile.read())
+            finally:
+                schemafile.close()
+    if setasdefault:
+        wrappedconn.setasdefault()
+    return wrappedconn
+
+
+def copyfrom(connection, name, atts, fieldsep, rowsep, nullval, filehandle,
+             batchsize=10000):
+    """Insert the rows of a file like PostgreSQL's COPY FROM. The values
+       are read like COPY reads its text format: nullval is NULL, and the
+       backslash escapes (e.g., \\t and \\\\) are decoded. The rows are
+       inserted by executemany in one transaction which is committed when
+       all the rows are inserted. Return the number of rows inserted.
+
+       Arguments:
+       - connection: the SQLiteConnectionWrapper to use
+       - name: the name of the table
+       - atts: the names of the columns in the order they are in the file
+       - fieldsep: the string separating the values of a row
+       - rowsep: the string separating the rows
+       - nullval: the string representing NULL
+       - filehandle: the file to read the rows from
+       - batchsize: the number of rows to give to each executemany.
+         Default: 10000
+    """
+    stmt = "INSERT INTO %s(%s) VALUES (%s)" % \
+        (name, ", ".join(atts), ", ".join(["?"] * len(atts)))
+    nullval = str(nullval)
+    if rowsep == '\n':
+        lines = filehandle
+    else:
+        lines = filehandle.read().split(rowsep)
+    batch = []
+    inserted = 0
+    try:
+        for line in lines:
+            if line.endswith(rowsep):
+                line = line[:-len(rowsep)]
+            if not line:
+                continue
+            batch.append([_copyvalue(v, nullval) for v in
+                          line.split(fieldsep)])
+            if len(batch) >= batchsize:
+                connection.executemany(stmt, batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            connection.executemany(stmt, batch)
+            inserted += len(batch)
+    except Exception:
+        connection.rollback()
+        raise
+    connection.commit()
+    return inserted
+
+
+def bulkloader(connection=None, batchsize=10000):
+    """Return a function that can be given as the bulkloader of the bulk
+       tables (e.g., BulkFactTable) and loads the rows by means of copyfrom.
+       If no connection is given, the default target connection at the time
+       of the load is used."""
+    def loader(name, atts, fieldsep, rowsep, nullval, filehandle):
+        copyfrom(connection or pyetlmr.getdefaulttargetconnection(), name,
+                 atts, fieldsep, rowsep, nullval, filehandle, batchsize)
+    return loader
@@ -19,7 +19,7 @@ __author__ = "Xiufeng Liu"
 __maintainer__ = "Xiufeng Liu"
 __version__ = '0.1.0'
 
-__all__ = ['UTF8Recoder','UnicodeReader','UnicodeWriter']
+__all__ = ['UTF8Recoder','UnicodeReader','UnicodeWriter','tsvline','TSVWriter']
 
 class UTF8Recoder:
     """
@@ -92,3 +92,97 @@ class UnicodeWriter:
             
     def close(self):
         self.stream.close()
+
+
+# The escapes of the text format of PostgreSQL's COPY
+_tsvescapes = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'))
+
+def _tsvescape(value):
+    for (char, escape) in _tsvescapes:
+        if char in value:
+            value = value.replace(char, escape)
+    return value
+
+def _utf8(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def tsvline(row, nullval='\\N', fieldsep='\t', rowsep='\n'):
+    """
+    Return the values of row as a UTF-8 line in the text format of COPY.
+    None is written as nullval, and backslashes, tabs, newlines and carriage
+    returns in the values are escaped. unicode values are encoded as UTF-8
+    and str values are written as they are, so they may be in any encoding.
+    """
+    if not isinstance(row, (list, tuple)):
+        row = list(row)
+    values = []
+    nulls = 0
+    for value in row:
+        if value is None:
+            values.append(nullval)
+            nulls += 1
+        elif isinstance(value, str):
+            values.append(value)
+        elif isinstance(value, unicode):
+            values.append(value.encode('utf-8'))
+        else:
+            values.append(str(value))
+    line = fieldsep.join(values)
+    # Most rows need no escapes, which is seen from the line alone
+    if line.count(fieldsep) != len(values) - 1 or \
+            line.count('\\') != nulls * nullval.count('\\') or \
+            '\n' in line or '\r' in line:
+        line = fieldsep.join([nullval if value is None else
+                              _tsvescape(_utf8(value)) for value in row])
+    return line + rowsep
+
+class TSVWriter:
+    """
+    A writer of rows to the file "f" as UTF-8 lines in the text format of
+    PostgreSQL's COPY (see tsvline). The lines are buffered and written in
+    writes of about bufsize bytes.
+    """
+
+    def __init__(self, f, nullval='\\N', fieldsep='\t', rowsep='\n',
+                 bufsize=1 << 16):
+        self.stream = f
+        self.nullval = nullval
+        self.fieldsep = fieldsep
+        self.rowsep = rowsep
+        self.bufsize = bufsize
+        self.rows = 0
+        self.__buffer = []
+        self.__buffered = 0
+
+    def writerow(self, row):
+        line = tsvline(row, self.nullval, self.fieldsep, self.rowsep)
+        self.__buffer.append(line)
+        self.__buffered += len(line)
+        self.rows += 1
+        if self.__buffered >= self.bufsize:
+            self.flush()
+
+    def writerows(self, rows):
+        nullval, fieldsep, rowsep = self.nullval, self.fieldsep, self.rowsep
+        for row in rows:
+            line = tsvline(row, nullval, fieldsep, rowsep)
+            self.__buffer.append(line)
+            self.__buffered += len(line)
+            self.rows += 1
+            if self.__buffered >= self.bufsize:
+                self.flush()
+
+    def flush(self):
+        if self.__buffer:
+            self.stream.write(''.join(self.__buffer))
+            self.__buffer = []
+            self.__buffered = 0
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+        self.stream.close()
@@ -0,0 +1,121 @@
+"""
+  An in-memory index of the versions of slowly changing dimension members.
+  For each member, i.e., each tuple of lookup values, the versions are kept
+  sorted by their valid-from dates such that the version valid at a given
+  date is found by bisection instead of by a query or a linear scan.
+
+  Dates are compared as ISO strings of the form 'yyyy-MM-dd HH:mm:ss' (see
+  datestr) such that dates and timestamps read from the DW, from an offline
+  store and from the source data can be mixed.
+"""
+#
+# Copyright (c) 2011 Xiufeng Liu (xiliu@cs.aau.dk)
+#
+#  This file is free software: you may copy, redistribute and/or modify it
+#  under the terms of the GNU General Public License version 2
+#  as published by the Free Software Foundation.
+#
+#  This file is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from bisect import bisect_right
+from caches import LRUCache
+
+__author__ = "Xiufeng Liu"
+__maintainer__ = "Xiufeng Liu"
+__version__ = '0.1.0'
+
+__all__ = ['VersionIndex', 'datestr']
+
+
+def datestr(value):
+    """Return a date, a datetime or a string as an ISO string of the form
+       'yyyy-MM-dd HH:mm:ss'. A date is taken as its midnight such that
+       '2011-01-05' and '2011-01-05 00:00:00' are equal. None is returned
+       as None."""
+    if value is None:
+        return None
+    # The strip removes the quotes and the cast of DB adapted dates
+    value = str(value).strip("':date ").replace('T', ' ', 1)
+    if len(value) == 10:
+        value += ' 00:00:00'
+    return value
+
+
+class VersionIndex(object):
+    """Maps the lookup values of members to their versions
+       (validfrom, validto, key) sorted by validfrom. A validto of None
+       means that the version is still valid."""
+
+    def __init__(self, maxmembers=None, maxbytes=None):
+        """Arguments:
+           - maxmembers: the number of members to keep. When more are added,
+             the least recently used are forgotten and must be read again by
+             the caller. If None, all members are kept. Default: None
+           - maxbytes: bounds the memory of the members if given (see
+             caches.approxsize). Default: None
+        """
+        # lookup values -> ([validfrom, ...], [(validfrom, validto, key), ...])
+        if maxmembers is None and maxbytes is None:
+            self.__members = {}
+        else:
+            self.__members = LRUCache(maxmembers, maxbytes=maxbytes)
+
+    def add(self, lookupvalues, validfrom, validto, key):
+        """Add a version of the member with the given lookup values."""
+        entry = self.__members.get(lookupvalues)
+        if entry is None:
+            entry = self.__members[lookupvalues] = ([], [])
+        (froms, versions) = entry
+        validfrom = datestr(validfrom)
+        pos = bisect_right(froms, validfrom)
+        froms.insert(pos, validfrom)
+        versions.insert(pos, (validfrom, datestr(validto), key))
+
+    def setversions(self, lookupvalues, versions):
+        """Replace the versions of a member.
+
+           Arguments:
+           - lookupvalues: the lookup values of the member
+           - versions: a sequence of (validfrom, validto, key) tuples. It may
+             be empty to record that the member has no versions.
+        """
+        versions = [(datestr(f), datestr(t), k) for (f, t, k) in versions]
+        versions.sort()
+        self.__members[lookupvalues] = ([v[0] for v in versions], versions)
+
+    def lookup(self, lookupvalues, when, default=None):
+        """Return the key of the version valid at the date when, or default
+           if no version of the member is valid then."""
+        entry = self.__members.get(lookupvalues)
+        if entry is None:
+            return default
+        (froms, versions) = entry
+        when = datestr(when)
+        pos = bisect_right(froms, when) - 1
+        if pos < 0:
+            return default
+        (validfrom, validto, key) = versions[pos]
+        if validto is None or when < validto:
+            return key
+        return default
+
+    def discard(self, lookupvalues):
+        """Forget the versions of a member, e.g., when they are changed."""
+        if lookupvalues in self.__members:
+            del self.__members[lookupvalues]
+
+    def clear(self):
+        """Forget all members."""
+        self.__members.clear()
+
+    def __contains__(self, lookupvalues):
+        return lookupvalues in self.__members
+
+    def __len__(self):
+        return len(self.__members)